@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+"""
+Microbenchmark for chunk allocation on the master.
+
+Creates a single file with 100k chunks over 200 chunkservers, then deletes
+it and garbage-collects it so the freed slots go back to the pool. There are
+no chunkservers running, delete commands are acked without being sent.
+
+    $ python benchmarks/bench_allocation.py [--chunks 100000] [--servers 200]
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "master"))
+
+from master import Master
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--chunks", type=int, default=100_000)
+    parser.add_argument("--servers", type=int, default=200)
+    args = parser.parse_args()
+
+    master = Master()
+    for i in range(args.servers):
+        master.register_chunkserver(f"http://chunkserver{i}:8000")
+
+    size = args.chunks * master.max_chunk_size
+
+    start = time.perf_counter()
+    master.create_file("/bench/big_file", size)
+    create_time = time.perf_counter() - start
+
+    usage = [len(chunks) for chunks in master.chunkservers.values()]
+    print(f"create_file: {args.chunks} chunks x {master.replication_factor} replicas "
+          f"over {args.servers} servers in {create_time:.3f}s "
+          f"({args.chunks / create_time:,.0f} chunks/s)")
+    print(f"chunks per server: min={min(usage)} max={max(usage)}")
+
+    master.delete_file("/bench/big_file")
+    master.garbage_collection_time = 0
+
+    async def ack_deletes(client, chunkserver_id, chunk_ids):
+        return 0
+    master.delete_chunks = ack_deletes
+
+    start = time.perf_counter()
+    asyncio.run(master.garbage_collection())
+    gc_time = time.perf_counter() - start
+    stats = master.gc_status()
+    print(f"garbage_collection: {gc_time:.3f}s in {stats['last_cycle_slices']} slices, "
+          f"longest slice {stats['last_max_slice_seconds'] * 1000:.1f}ms, "
+          f"free slots: {sum(a.free for a in master.allocators.values())}")
+
+    start = time.perf_counter()
+    master.create_file("/bench/big_file_2", size)
+    print(f"create_file on recycled slots: {time.perf_counter() - start:.3f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+"""
+Single vs batched metadata calls for many small files, against a master over
+HTTP with its operation log on. Looks up --files files one /get_file_chunks
+or /get_file_layout call at a time, then all at once through
+/get_file_layouts (one response, and streamed page by page). Deletes as many
+files one /delete_file call at a time, in one /delete_files batch, and as one
+prefix delete of their directory. Reports wall time, requests and response
+bytes per method, and checks that every file was found and deleted.
+
+    $ python benchmarks/bench_batch_metadata.py [--files 10000] [--servers 20]
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import httpx
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+from bench_location_cache import start_master
+
+
+def create_files(master, directory: str, count: int) -> list:
+    # Set up in-process, the benchmark is about lookups and deletes
+    paths = [f"{directory}/part-{i:05d}" for i in range(count)]
+    for path in paths:
+        master.create_file(path, 1024)
+    master.sync_log()
+    return paths
+
+
+def timed(label: str, requests: int, run) -> tuple:
+    start = time.perf_counter()
+    received, result = run()
+    elapsed = time.perf_counter() - start
+    print(f"  {label:<34} {elapsed:8.3f}s  {requests:>6} requests  {received / 1e6:8.2f} MB received")
+    return elapsed, result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--files", type=int, default=10_000)
+    parser.add_argument("--servers", type=int, default=20)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="gfs-batch-metadata-bench-")
+    os.chdir(workdir)
+    os.environ["MASTER_DATA_DIR"] = os.path.join(workdir, "master")
+    failed = []
+    try:
+        master_url = start_master()
+        master = sys.modules["master"].master
+        http = httpx.Client(base_url=master_url, timeout=httpx.Timeout(300.0, connect=5.0))
+        for i in range(args.servers):
+            http.post("/register_chunkserver", json={"chunkserver_id": f"http://chunkserver{i}:8000",
+                                                      "used_bytes": 0, "free_bytes": 1 << 50}).raise_for_status()
+
+        paths = create_files(master, "/bench/lookup", args.files)
+        print(f"Looking up {args.files} files")
+
+        def single(endpoint):
+            def run():
+                received = 0
+                for path in paths:
+                    resp = http.get(endpoint, params={"path": path})
+                    received += len(resp.content)
+                    if resp.status_code != 200:
+                        failed.append(f"{endpoint} {path}: {resp.status_code}")
+                return received, None
+            return run
+
+        def batch(stream: bool):
+            def run():
+                found = 0
+                received = 0
+                if stream:
+                    with http.stream("POST", "/get_file_layouts", json={"paths": paths, "stream": True}) as resp:
+                        for line in resp.iter_lines():
+                            if line:
+                                received += len(line)
+                                found += sum("error" not in entry for entry in json.loads(line)["files"])
+                else:
+                    resp = http.post("/get_file_layouts", json={"paths": paths})
+                    received = len(resp.content)
+                    found = sum("error" not in entry for entry in resp.json()["files"])
+                if found != len(paths):
+                    failed.append(f"Batch lookup found {found} of {len(paths)} files")
+                return received, None
+            return run
+
+        single_time, _ = timed("single /get_file_chunks", len(paths), single("/get_file_chunks"))
+        timed("single /get_file_layout", len(paths), single("/get_file_layout"))
+        batch_time, _ = timed("batch /get_file_layouts", 1, batch(False))
+        timed("batch /get_file_layouts, streamed", 1, batch(True))
+        print(f"  batched lookups are {single_time / batch_time:.0f}x faster than single calls")
+
+        print(f"Deleting {args.files} files")
+        singles = create_files(master, "/bench/single", args.files)
+        batched = create_files(master, "/bench/batch", args.files)
+        create_files(master, "/bench/prefix", args.files)
+
+        def delete_single():
+            received = 0
+            for path in singles:
+                resp = http.post("/delete_file", json={"path": path})
+                received += len(resp.content)
+            return received, None
+
+        def delete_batch():
+            resp = http.post("/delete_files", json={"paths": batched})
+            return len(resp.content), None
+
+        def delete_prefix():
+            resp = http.post("/delete_files", json={"prefix": "/bench/prefix"})
+            return len(resp.content), resp.json()["deleted"]
+
+        single_time, _ = timed("single /delete_file", len(singles), delete_single)
+        batch_time, _ = timed("batch /delete_files", 1, delete_batch)
+        prefix_time, deleted = timed("prefix /delete_files", 1, delete_prefix)
+        print(f"  batched deletes are {single_time / batch_time:.0f}x, the prefix delete "
+              f"{single_time / prefix_time:.0f}x faster than single calls")
+        if deleted != args.files:
+            failed.append(f"Prefix delete removed {deleted} of {args.files} files")
+        for directory in ("/bench/single", "/bench/batch", "/bench/prefix"):
+            left = master.files_under(directory)
+            if left:
+                failed.append(f"{len(left)} files in {directory} were not deleted")
+        failed.extend(master.check_chunk_index())
+        http.close()
+    finally:
+        os.chdir("/")
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print("OK" if not failed else "FAILED")
+    for problem in failed[:10]:
+        print(f"  {problem}")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+"""
+Benchmark for bulk allocation of a very large file and for the size and
+encoding cost of the legacy (nested ChunkEntry) vs compact (FileLayout)
+create_file responses.
+
+    $ python benchmarks/bench_bulk_allocation.py [--chunks 1000000] [--servers 200]
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "master"))
+
+from master import Master
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--chunks", type=int, default=1_000_000)
+    parser.add_argument("--servers", type=int, default=200)
+    args = parser.parse_args()
+
+    master = Master()
+    # Make sure the whole file fits regardless of the server count
+    master.chunkserver_capacity = (2 * args.chunks * master.replication_factor // args.servers + 1) * master.max_chunk_size
+    for i in range(args.servers):
+        master.register_chunkserver(f"http://chunkserver{i}:8000")
+
+    start = time.perf_counter()
+    chunks = master.create_file("/bench/huge_file", args.chunks * master.max_chunk_size)
+    print(f"create_file ({args.chunks} chunks): {time.perf_counter() - start:.3f}s")
+
+    start = time.perf_counter()
+    legacy = json.dumps(chunks)
+    print(f"legacy response:  {time.perf_counter() - start:.3f}s to encode, {len(legacy) / 1e6:.1f} MB")
+
+    start = time.perf_counter()
+    compact = json.dumps(master.get_file_layout("/bench/huge_file"))
+    print(f"compact response: {time.perf_counter() - start:.3f}s to build and encode, {len(compact) / 1e6:.1f} MB")
+
+    start = time.perf_counter()
+    page = json.dumps(master.get_file_layout("/bench/huge_file", offset=0, limit=10_000))
+    print(f"compact page of 10k chunks: {(time.perf_counter() - start) * 1000:.1f}ms, {len(page) / 1e3:.0f} KB")
+
+
+if __name__ == "__main__":
+    main()
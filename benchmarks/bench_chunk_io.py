@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""
+Throughput benchmark for chunkserver I/O: JSON (/write_chunk, /read_chunk)
+vs binary streaming (/write_chunk_binary, /read_chunk_binary) at several
+chunk sizes. Runs a chunkserver on loopback in this process, without a master.
+
+    $ python benchmarks/bench_chunk_io.py [--sizes 4096,65536,1048576,8388608] [--requests 50]
+"""
+import argparse
+import os
+import shutil
+import socket
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+import httpx
+import uvicorn
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "chunkserver"))
+
+from chunkserver import ChunkServer
+
+
+def start_chunkserver(name: str = "bench", master_url: str | None = None, setup=None) -> str:
+    """
+    Runs a chunkserver on a free loopback port in a background thread and
+    returns its address. Chunks go to chunks/<name>/ under the current directory.
+    Nothing is registered with the master, `master_url` is only where copy reports go.
+    `setup` is called with the ChunkServer before it starts, e.g. to add middleware.
+    """
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    chunkserver = ChunkServer(master_url)
+    chunkserver.address = f"http://127.0.0.1:{port}"
+    chunkserver.chunk_dir = os.path.join("chunks", name)
+    chunkserver.load_chunks()
+    if setup is not None:
+        setup(chunkserver)
+    server = uvicorn.Server(uvicorn.Config(chunkserver.app, host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    return f"http://127.0.0.1:{port}"
+
+
+def report(label: str, size: int, latencies: list):
+    latencies = sorted(latencies)
+    p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+    throughput = size * len(latencies) / sum(latencies) / 1e6
+    print(f"  {label:<12} {throughput:9.1f} MB/s   p50 {statistics.median(latencies) * 1000:8.2f}ms   p99 {p99 * 1000:8.2f}ms")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", default="4096,65536,1048576,8388608")
+    parser.add_argument("--requests", type=int, default=50)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="gfs-chunk-io-bench-")
+    os.chdir(workdir)
+    try:
+        url = start_chunkserver()
+        with httpx.Client(timeout=60) as client:
+            for size in (int(s) for s in args.sizes.split(",")):
+                print(f"chunk size {size} bytes")
+                text = "x" * size
+                data = text.encode()
+                results = {"json write": [], "binary write": [], "json read": [], "binary read": []}
+                for i in range(args.requests):
+                    start = time.perf_counter()
+                    client.post(f"{url}/write_chunk", json={"chunk_id": i, "data": text}).raise_for_status()
+                    results["json write"].append(time.perf_counter() - start)
+
+                    start = time.perf_counter()
+                    client.post(f"{url}/write_chunk_binary/{i}", content=data).raise_for_status()
+                    results["binary write"].append(time.perf_counter() - start)
+
+                    start = time.perf_counter()
+                    client.get(f"{url}/read_chunk/{i}").json()["data"]
+                    results["json read"].append(time.perf_counter() - start)
+
+                    start = time.perf_counter()
+                    client.get(f"{url}/read_chunk_binary/{i}").read()
+                    results["binary read"].append(time.perf_counter() - start)
+
+                for label, latencies in results.items():
+                    report(label, size, latencies)
+    finally:
+        os.chdir("/")
+        shutil.rmtree(workdir)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+Chunkserver restart with a large chunk directory: time to load the stored
+chunks from the manifest vs by listing and stat'ing the directory, and time
+for the master to reconcile the chunk report sent on registration. Also shows
+how many parts a restart queues for re-replication with the report (none)
+and when the master forgets the server's chunks, as it did before reports.
+
+    $ python benchmarks/bench_chunkserver_restart.py [--chunks 1000000]
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+CHUNK_SIZE = 16  # Bytes per chunk, the files only need to exist
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "master"))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "chunkserver"))
+
+
+def write_chunks(chunk_dir: str, chunk_ids: list, version: int):
+    os.makedirs(chunk_dir)
+    data = b"x" * CHUNK_SIZE
+    with open(os.path.join(chunk_dir, "MANIFEST"), "w") as manifest:
+        for chunk_id in chunk_ids:
+            fd = os.open(os.path.join(chunk_dir, f"{chunk_id}.chunk"), os.O_WRONLY | os.O_CREAT, 0o644)
+            os.write(fd, data)
+            os.close(fd)
+            manifest.write(f"+ {chunk_id} {CHUNK_SIZE} {version}\n")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--chunks", type=int, default=1_000_000)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="gfs-restart-bench-")
+    os.chdir(workdir)
+    os.environ["CHUNK_SIZE"] = str(CHUNK_SIZE)
+    from chunkserver import ChunkServer
+    from master import Master
+
+    try:
+        address = "http://bench-chunkserver:8000"
+        master = Master()
+        master.replication_factor = 1
+        master.register_chunkserver(address, used_bytes=0, free_bytes=2 * args.chunks * CHUNK_SIZE)
+        master.create_file("/bench/big_file", args.chunks * CHUNK_SIZE)
+        chunk_ids = [replicas[0]['chunk_id'] for replicas in master.files["/bench/big_file"]]
+        version = master.namespace.lookup("/bench/big_file").version
+
+        start = time.perf_counter()
+        chunk_dir = os.path.join("chunks", "bench")
+        write_chunks(chunk_dir, chunk_ids, version)
+        print(f"{args.chunks} chunks on disk (written in {time.perf_counter() - start:.1f}s)")
+
+        chunkserver = ChunkServer("http://unused")
+        chunkserver.address = address
+        chunkserver.chunk_dir = chunk_dir
+        start = time.perf_counter()
+        chunkserver.load_chunks()
+        manifest_seconds = time.perf_counter() - start
+
+        os.remove(os.path.join(chunk_dir, "MANIFEST"))
+        scanned = ChunkServer("http://unused")
+        scanned.chunk_dir = chunk_dir
+        start = time.perf_counter()
+        scanned.load_chunks()
+        scan_seconds = time.perf_counter() - start
+        assert scanned.stored_chunks == chunkserver.stored_chunks
+
+        report = chunkserver.chunk_report()
+        start = time.perf_counter()
+        result = master.register_chunkserver(address, 0, args.chunks * CHUNK_SIZE, **report)
+        reconcile_seconds = time.perf_counter() - start
+        queued = len(master.replication.queue)
+
+        print(f"  load from manifest      {manifest_seconds:7.2f}s")
+        print(f"  load by directory scan  {scan_seconds:7.2f}s")
+        print(f"  master reconcile        {reconcile_seconds:7.2f}s   {result}")
+        print(f"  parts queued for re-replication: {queued} with the chunk report, "
+              f"{args.chunks} if the master forgets the server's chunks")
+    finally:
+        os.chdir("/")
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
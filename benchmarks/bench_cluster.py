@@ -0,0 +1,428 @@
+#!/usr/bin/env python3
+"""
+Load tests against a real cluster: the master and --chunkservers chunkservers
+run as separate processes on loopback (see cluster.py), driven through the
+Python client from --threads threads. Workloads, run in this order:
+
+    create_storm  every thread creates --small-files small files
+    sequential    --large-files large files written, then read back, one at a time
+    hot_set       reads of --hot-files files, 90% going to a tenth of them
+    kill_restart  reads while a chunkserver is killed, re-replicated around and restarted
+    delete_gc     --delete-files files deleted in batches, then garbage collected
+
+Every workload reports ops/s, MB/s and p50/p99 latency, kill_restart also how
+long the master took to notice the dead chunkserver, to restore full replication
+and to take the chunkserver back. Data is checked on every read. File contents
+and the order of operations per thread come from --seed, so runs are
+repeatable. --output writes the results as JSON, --compare checks them against
+an earlier run's JSON and exits with 1 if a metric got worse by more than --tolerance.
+With --repeat every run gets a fresh cluster and the medians are compared.
+
+    $ python benchmarks/bench_cluster.py [--workloads create_storm,hot_set] [--chunkservers 5] [--threads 8]
+          [--repeat 3] [--output results.json] [--compare baseline.json] [--tolerance 0.2]
+"""
+import argparse
+import datetime
+import hashlib
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "client"))
+
+from cluster import ROOT, LocalCluster
+from gfs_client import GFSClient
+
+WORKLOADS = ("create_storm", "sequential", "hot_set", "kill_restart", "delete_gc")
+
+
+def percentile(samples: list, p: float) -> float:
+    return samples[min(len(samples) - 1, int(len(samples) * p / 100))]
+
+
+class Recorder:
+    """
+    Latencies, bytes and errors of the operations of one workload, from any number of threads.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = []  # (finished at, seconds, bytes)
+        self.errors = []  # (failed at, message)
+        self.started = time.perf_counter()
+        self.finished = None
+
+    def timed(self, operation, size: int = 0):
+        start = time.perf_counter()
+        try:
+            operation()
+        except Exception as e:
+            with self.lock:
+                self.errors.append((time.perf_counter(), f"{type(e).__name__}: {e}"))
+            return
+        end = time.perf_counter()
+        with self.lock:
+            self.latencies.append((end, end - start, size))
+
+    def stop(self):
+        self.finished = time.perf_counter()
+
+    def summary(self, since: float = None, until: float = None) -> dict:
+        """
+        Totals and latency percentiles of the operations that finished between `since` and `until`.
+        """
+        since = self.started if since is None else since
+        until = (self.finished or time.perf_counter()) if until is None else until
+        with self.lock:
+            done = [(latency, size) for end, latency, size in self.latencies if since <= end <= until]
+            errors = [message for at, message in self.errors if since <= at <= until]
+        latencies = sorted(latency for latency, _ in done)
+        elapsed = until - since
+        result = {
+            "ops": len(done),
+            "errors": len(errors),
+            "seconds": elapsed,
+            "ops_per_sec": len(done) / elapsed,
+            "mb_per_sec": sum(size for _, size in done) / elapsed / 1e6,
+        }
+        if errors:
+            result["first_error"] = errors[0]
+        if latencies:
+            result["p50_ms"] = percentile(latencies, 50) * 1000
+            result["p99_ms"] = percentile(latencies, 99) * 1000
+        return result
+
+
+def payload(seed: int, name: str, size: int) -> bytes:
+    return random.Random(f"{seed}:{name}").randbytes(size)
+
+
+def run_threads(threads: int, target) -> None:
+    workers = [threading.Thread(target=target, args=(index,)) for index in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+
+def write_files(master_url: str, files: dict, threads: int):
+    # Setup for the read workloads, not measured
+    paths = sorted(files)
+    failures = []
+
+    def writer(index: int):
+        with GFSClient(master_url) as client:
+            for path in paths[index::threads]:
+                try:
+                    client.write_file(path, files[path])
+                except Exception as e:
+                    failures.append(f"{path}: {e}")
+
+    run_threads(threads, writer)
+    if failures:
+        raise RuntimeError(f"Could not write {len(failures)} files, first: {failures[0]}")
+
+
+def checked_read(client: GFSClient, path: str, digest: str):
+    if hashlib.sha256(client.read_file(path)).hexdigest() != digest:
+        raise ValueError(f"{path} read back different data")
+
+
+def create_storm(cluster: LocalCluster, args) -> dict:
+    recorder = Recorder()
+
+    def creator(index: int):
+        with GFSClient(cluster.master_url) as client:
+            for i in range(args.small_files):
+                name = f"t{index}/f{i:05d}"
+                data = payload(args.seed, name, args.small_size)
+                recorder.timed(lambda: client.write_file(f"/create_storm/{name}", data), len(data))
+
+    run_threads(args.threads, creator)
+    recorder.stop()
+    return recorder.summary()
+
+
+def sequential(cluster: LocalCluster, args) -> dict:
+    files = {f"/sequential/f{i}": payload(args.seed, f"large{i}", args.large_size) for i in range(args.large_files)}
+    digests = {path: hashlib.sha256(data).hexdigest() for path, data in files.items()}
+    results = {}
+    with GFSClient(cluster.master_url) as client:
+        recorder = Recorder()
+        for path, data in files.items():
+            recorder.timed(lambda: client.write_file(path, data), len(data))
+        recorder.stop()
+        results["write"] = recorder.summary()
+
+        recorder = Recorder()
+        for path in files:
+            recorder.timed(lambda: checked_read(client, path, digests[path]), args.large_size)
+        recorder.stop()
+        results["read"] = recorder.summary()
+    return results
+
+
+def hot_set(cluster: LocalCluster, args) -> dict:
+    files = {f"/hot_set/f{i:04d}": payload(args.seed, f"hot{i}", args.hot_size) for i in range(args.hot_files)}
+    write_files(cluster.master_url, files, args.threads)
+    paths = sorted(files)
+    hot = paths[:max(1, len(paths) // 10)]
+    digests = {path: hashlib.sha256(data).hexdigest() for path, data in files.items()}
+    recorder = Recorder()
+    master_requests = []
+
+    def reader(index: int):
+        rand = random.Random(f"{args.seed}:hot_set:{index}")
+        with GFSClient(cluster.master_url) as client:
+            for _ in range(args.hot_reads // args.threads):
+                path = rand.choice(hot) if rand.random() < 0.9 else rand.choice(paths)
+                recorder.timed(lambda: checked_read(client, path, digests[path]), args.hot_size)
+            master_requests.append(client.master_requests)
+
+    run_threads(args.threads, reader)
+    recorder.stop()
+    return {**recorder.summary(), "master_requests": sum(master_requests)}
+
+
+def fully_replicated(cluster: LocalCluster, paths: list, dead: str) -> bool:
+    status = cluster.get("/replication_status")
+    if status is None or status["recovering"] or status["queued"] or status["in_flight"] or status["retrying"]:
+        return False
+    with GFSClient(cluster.master_url, use_cache=False) as client:
+        for layout in client.get_layouts(paths).values():
+            if "error" in layout:
+                return False
+            for part in range(len(layout["replica_offsets"]) - 1):
+                replicas = [server for server, _ in client.replicas(layout, part)]
+                if len(replicas) < 3 or dead in replicas:
+                    return False
+    return True
+
+
+def kill_restart(cluster: LocalCluster, args) -> dict:
+    """
+    Readers run the whole time. After --warmup seconds chunkserver 0 is killed; once
+    every chunk is back to three live replicas it is started again on the same disk.
+    """
+    files = {f"/kill_restart/f{i:04d}": payload(args.seed, f"recovery{i}", args.recovery_size)
+             for i in range(args.recovery_files)}
+    write_files(cluster.master_url, files, args.threads)
+    paths = sorted(files)
+    digests = {path: hashlib.sha256(data).hexdigest() for path, data in files.items()}
+    recorder = Recorder()
+    done = threading.Event()
+
+    def reader(index: int):
+        rand = random.Random(f"{args.seed}:kill_restart:{index}")
+        with GFSClient(cluster.master_url) as client:
+            while not done.is_set():
+                path = rand.choice(paths)
+                recorder.timed(lambda: checked_read(client, path, digests[path]), args.recovery_size)
+
+    readers = threading.Thread(target=run_threads, args=(args.threads, reader))
+    readers.start()
+    result = {}
+    try:
+        time.sleep(args.warmup)
+        victim = cluster.chunkserver_url(0)
+        killed_at = time.perf_counter()
+        cluster.kill_chunkserver(0)
+        cluster.wait_until(lambda: victim not in cluster.live_chunkservers(), 120, "the master to drop the killed chunkserver")
+        result["detection_seconds"] = time.perf_counter() - killed_at
+        cluster.wait_until(lambda: fully_replicated(cluster, paths, victim), 600, "re-replication", interval=0.25)
+        recovered_at = time.perf_counter()
+        result["recovery_seconds"] = recovered_at - killed_at
+        result["restart_seconds"] = cluster.start_chunkserver(0)
+        time.sleep(args.warmup)
+    finally:
+        done.set()
+        readers.join()
+        recorder.stop()
+    result["outage"] = recorder.summary(since=killed_at, until=recovered_at)
+    return {**recorder.summary(), **result}
+
+
+def delete_gc(cluster: LocalCluster, args) -> dict:
+    files = {f"/delete_gc/f{i:05d}": payload(args.seed, f"delete{i}", args.small_size) for i in range(args.delete_files)}
+    write_files(cluster.master_url, files, args.threads)
+    paths = sorted(files)
+    chunks = 3 * len(paths) * -(-args.small_size // args.chunk_size)
+    reclaimed_before = cluster.get("/gc_status")["total_reclaimed_chunks"]
+
+    recorder = Recorder()
+    with GFSClient(cluster.master_url) as client:
+        for start in range(0, len(paths), args.delete_batch):
+            batch = paths[start:start + args.delete_batch]
+            recorder.timed(lambda: client.delete_files(batch))
+        deleted_at = time.perf_counter()
+        recorder.stop()
+
+    def reclaimed() -> bool:
+        status = cluster.get("/gc_status")
+        return status["total_reclaimed_chunks"] - reclaimed_before >= chunks and not status["pending_deletes"]
+
+    result = recorder.summary()
+    del result["mb_per_sec"]
+    # Latencies are per request, ops are files
+    result.update(requests=result["ops"], ops=len(paths), ops_per_sec=len(paths) / result["seconds"])
+    result["gc_seconds"] = cluster.wait_until(reclaimed, 600, f"{chunks} chunks to be reclaimed", interval=0.1)
+    result["gc_chunks_per_sec"] = chunks / (time.perf_counter() - deleted_at)
+    return result
+
+
+# Metrics compared by --compare, by name: True if higher is better
+DIRECTIONS = {"ops_per_sec": True, "mb_per_sec": True, "gc_chunks_per_sec": True,
+              "p50_ms": False, "p99_ms": False, "detection_seconds": False, "recovery_seconds": False,
+              "restart_seconds": False, "gc_seconds": False, "errors": False}
+
+
+def flatten(results: dict, prefix: str = "") -> dict:
+    flat = {}
+    for key, value in results.items():
+        if isinstance(value, dict):
+            flat.update(flatten(value, f"{prefix}{key}."))
+        elif key in DIRECTIONS:
+            flat[prefix + key] = value
+    return flat
+
+
+def median(runs: list):
+    """
+    The median of every number across the results of repeated runs, keeping their structure.
+    """
+    first = runs[0]
+    if isinstance(first, dict):
+        return {key: median([run[key] for run in runs if key in run]) for key in first}
+    if isinstance(first, (int, float)) and not isinstance(first, bool):
+        return statistics.median(runs)
+    return first
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list:
+    """
+    Prints every metric next to its baseline value, returns the ones that regressed.
+    """
+    regressions = []
+    old = flatten(baseline["workloads"])
+    print(f"Compared to {baseline.get('git_commit', 'the baseline')[:12]} (tolerance {tolerance:.0%}):")
+    for name, value in flatten(results["workloads"]).items():
+        if name not in old:
+            continue
+        before = old[name]
+        higher_is_better = DIRECTIONS[name.rsplit(".", 1)[-1]]
+        change = (value - before) / before if before else (0.0 if value == before else float("inf"))
+        worse = -change if higher_is_better else change
+        flag = "REGRESSED" if worse > tolerance else ""
+        print(f"  {name:<36} {before:12.2f} -> {value:12.2f}  {change:+8.1%}  {flag}")
+        if flag:
+            regressions.append(name)
+    return regressions
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=ROOT, capture_output=True, text=True).stdout.strip()
+    except OSError:
+        return ""
+
+
+def run_suite(args, workloads: list, label: str, failed: list) -> dict:
+    """
+    Runs the workloads on a fresh cluster, printing and returning their results.
+    """
+    results = {}
+    workdir = tempfile.mkdtemp(prefix="gfs-cluster-bench-")
+    try:
+        with LocalCluster(workdir, args.chunkservers, env={"CHUNK_SIZE": str(args.chunk_size)}) as cluster:
+            print(f"Cluster of {args.chunkservers} chunkservers at {cluster.master_url}, "
+                  f"{args.chunk_size // 1024} KiB chunks, {args.threads} client threads{label}")
+            for name in workloads:
+                result = globals()[name](cluster, args)
+                results[name] = result
+                print(f"  {name}")
+                # sequential has a summary for writes and one for reads, kill_restart one for the outage
+                parts = result.items() if name == "sequential" else [("", result), ("outage", result.get("outage"))]
+                for part, summary in parts:
+                    if summary is None:
+                        continue
+                    metrics = "   ".join(f"{key} {value:,.2f}" for key, value in flatten(summary).items() if "." not in key)
+                    print(f"    {part:<8}{metrics}")
+                    if summary["errors"] and part != "outage":  # Outage errors are counted in the total too
+                        failed.append(f"{name} {part}: {summary['errors']} failed operations, first: {summary['first_error']}")
+    finally:
+        if args.keep:
+            print(f"Cluster directory: {workdir}")
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workloads", default=",".join(WORKLOADS))
+    parser.add_argument("--chunkservers", type=int, default=5)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--chunk-size", type=int, default=4 * 1024 * 1024)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--small-files", type=int, default=250, help="files per thread in create_storm")
+    parser.add_argument("--small-size", type=int, default=4096)
+    parser.add_argument("--large-files", type=int, default=8)
+    parser.add_argument("--large-size", type=int, default=64 * 1024 * 1024)
+    parser.add_argument("--hot-files", type=int, default=200)
+    parser.add_argument("--hot-size", type=int, default=64 * 1024)
+    parser.add_argument("--hot-reads", type=int, default=20_000)
+    parser.add_argument("--recovery-files", type=int, default=100)
+    parser.add_argument("--recovery-size", type=int, default=1024 * 1024)
+    parser.add_argument("--warmup", type=float, default=2.0, help="seconds of reads before the kill and after the restart")
+    parser.add_argument("--delete-files", type=int, default=5000)
+    parser.add_argument("--delete-batch", type=int, default=1000)
+    parser.add_argument("--repeat", type=int, default=1, help="runs, each on a fresh cluster, reporting the medians")
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--compare", help="JSON results of an earlier run to check for regressions")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="relative change counted as a regression")
+    parser.add_argument("--keep", action="store_true", help="keep the cluster's directory and logs")
+    args = parser.parse_args()
+    workloads = args.workloads.split(",")
+    unknown = set(workloads) - set(WORKLOADS)
+    if unknown:
+        parser.error(f"unknown workloads {', '.join(sorted(unknown))}, pick from {', '.join(WORKLOADS)}")
+
+    results = {
+        "benchmark": "bench_cluster",
+        "started_at": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+        "git_commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "config": vars(args),
+        "runs": [],
+    }
+    failed = []
+    for run in range(args.repeat):
+        label = f", run {run + 1} of {args.repeat}" if args.repeat > 1 else ""
+        results["runs"].append(run_suite(args, workloads, label, failed))
+    results["workloads"] = median(results["runs"])
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            failed += [f"{name} regressed" for name in compare(results, json.load(f), args.tolerance)]
+    print("OK" if not failed else "FAILED")
+    for problem in failed[:10]:
+        print(f"  {problem}")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+"""
+Erasure coding: Reed-Solomon encode and decode throughput of the NumPy GF(256)
+codec for several codes and shard sizes, then whole-file read latency of 3x
+replicated vs erasure coded files with all chunkservers up and with some of
+them failing every read (degraded reads decode the lost data shards from parity).
+
+    $ python benchmarks/bench_erasure.py [--codes 6+3,10+4] [--shard-sizes 1048576,8388608] [--reads 100]
+"""
+import argparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+from fastapi.responses import Response
+
+sys.path.insert(0, os.path.dirname(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "client"))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "common"))
+
+from bench_chunk_io import start_chunkserver
+from bench_location_cache import start_master
+from erasure import ReedSolomon
+from gfs_client import GFSClient
+
+
+def best_seconds(run, repeat: int) -> float:
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def bench_codec(codes: list, shard_sizes: list, repeat: int):
+    print("codec throughput (MB/s of data shards, best of %d)" % repeat)
+    print(f"  {'code':<6} {'shard':>9} {'encode':>9} {'rebuild 1':>10} {'decode m':>9}")
+    for data_shards, parity_shards in codes:
+        codec = ReedSolomon(data_shards, parity_shards)
+        for size in shard_sizes:
+            data = [os.urandom(size) for _ in range(data_shards)]
+            parity = codec.encode(data)
+            shards = dict(enumerate(data + parity))
+            stripe_mb = data_shards * size / 1e6
+
+            encode = best_seconds(lambda: codec.encode(data), repeat)
+            # One data shard lost, as when re-replicating after a disk failure
+            survivors = {index: shard for index, shard in shards.items() if index != 0}
+            rebuild = best_seconds(lambda: codec.reconstruct(survivors, size, [0]), repeat)
+            # The first `parity_shards` data shards lost, the worst case a read can still decode
+            worst = {index: shard for index, shard in shards.items() if index >= parity_shards}
+            decode = best_seconds(lambda: codec.reconstruct(worst, size, range(parity_shards)), repeat)
+            assert codec.reconstruct(worst, size, range(parity_shards))[0] == data[0]
+
+            print(f"  {f'{data_shards}+{parity_shards}':<6} {size / 1024:>7.0f}KB {stripe_mb / encode:>9.1f} "
+                  f"{stripe_mb / rebuild:>10.1f} {stripe_mb / decode:>9.1f}")
+
+
+def failing_reads(down: set):
+    """
+    Makes a chunkserver answer 503 to chunk reads while its address is in `down`.
+    """
+    def setup(chunkserver):
+        @chunkserver.app.middleware("http")
+        async def fail_reads(request, call_next):
+            if chunkserver.address in down and request.url.path.startswith("/read_chunk_binary"):
+                return Response(status_code=503)
+            return await call_next(request)
+    return setup
+
+
+def percentile(samples: list, p: float) -> float:
+    return samples[min(len(samples) - 1, int(len(samples) * p / 100))]
+
+
+def read_latencies(master_url: str, paths: list, reads: int) -> tuple:
+    with GFSClient(master_url, hedge=False) as client:
+        for path in paths:
+            client.read_file(path)  # Warm the location cache and connections
+        warm = client.degraded_reads
+        rand = random.Random(7)
+        latencies = []
+        for _ in range(reads):
+            start = time.perf_counter()
+            client.read_file(rand.choice(paths))
+            latencies.append(time.perf_counter() - start)
+        return sorted(latencies), client.degraded_reads - warm
+
+
+def bench_reads(args, data_shards: int, parity_shards: int):
+    workdir = tempfile.mkdtemp(prefix="gfs-erasure-bench-")
+    os.chdir(workdir)
+    os.environ["CHUNK_SIZE"] = str(args.chunk_size)
+    os.environ["REBALANCE_BYTES_PER_SECOND"] = "0"
+    down: set = set()
+    try:
+        master_url = start_master()
+        servers = [start_chunkserver(f"cs{i}", master_url, setup=failing_reads(down))
+                   for i in range(data_shards + parity_shards + 1)]
+        size = args.chunks * args.chunk_size
+        with GFSClient(master_url) as client:
+            for server in servers:
+                client.master_call("POST", "/register_chunkserver", json={"chunkserver_id": server, "free_bytes": 1 << 50})
+            replicated = [f"/bench/replicated_{i}" for i in range(args.files)]
+            coded = [f"/bench/ec_{i}" for i in range(args.files)]
+            for path in replicated:
+                client.write_file(path, os.urandom(size))
+            for path in coded:
+                client.write_file(path, os.urandom(size), ec=(data_shards, parity_shards))
+
+        print(f"\n{args.reads} reads of {args.chunks} x {args.chunk_size // 1024}KB files, "
+              f"{data_shards}+{parity_shards} erasure coding vs 3 replicas, {len(servers)} chunkservers")
+        rand = random.Random(1)
+        for failed in sorted({0, 1, parity_shards}):
+            down.clear()
+            down.update(rand.sample(servers, failed))
+            for label, paths in (("replicated", replicated), (f"ec {data_shards}+{parity_shards}", coded)):
+                if failed > 2 and label == "replicated":
+                    continue  # Three replicas survive at most two failures
+                latencies, degraded = read_latencies(master_url, paths, args.reads)
+                print(f"  {failed} down  {label:<11} p50 {percentile(latencies, 50) * 1000:7.1f}ms   "
+                      f"p99 {percentile(latencies, 99) * 1000:7.1f}ms   "
+                      f"{size * len(latencies) / sum(latencies) / 1e6:7.1f} MB/s   "
+                      f"degraded stripes {degraded}")
+    finally:
+        os.chdir("/")
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--codes", default="3+2,6+3,10+4", help="comma separated data+parity shard counts")
+    parser.add_argument("--shard-sizes", default="1048576,8388608")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--read-code", default="6+3", help="code of the erasure coded files in the read benchmark")
+    parser.add_argument("--reads", type=int, default=100)
+    parser.add_argument("--files", type=int, default=10)
+    parser.add_argument("--chunks", type=int, default=12, help="chunks per file")
+    parser.add_argument("--chunk-size", type=int, default=1024 * 1024)
+    parser.add_argument("--skip-reads", action="store_true", help="only measure the codec")
+    args = parser.parse_args()
+
+    codes = [tuple(int(n) for n in code.split("+")) for code in args.codes.split(",")]
+    bench_codec(codes, [int(size) for size in args.shard_sizes.split(",")], args.repeat)
+    if not args.skip_reads:
+        data_shards, parity_shards = (int(n) for n in args.read_code.split("+"))
+        bench_reads(args, data_shards, parity_shards)
+
+
+if __name__ == "__main__":
+    main()
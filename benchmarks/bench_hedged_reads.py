@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""
+Whole-file read latency with one slow chunkserver: sequential reads (one chunk
+at a time in layout replica order, next replica only on failure) vs a
+concurrent, latency-balanced read window vs the same window with hedged
+requests. The slow chunkserver delays every chunk read by --delay seconds.
+Reports p50, p99 and p99.9 latency per read.
+
+    $ python benchmarks/bench_hedged_reads.py [--reads 300] [--chunks 8] [--delay 0.2]
+"""
+import argparse
+import asyncio
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "client"))
+
+from bench_chunk_io import start_chunkserver
+from bench_location_cache import start_master
+from gfs_client import GFSClient, LocationCache
+
+MODES = [
+    ("sequential", {"read_window": 1, "hedge": False, "balance": False}),
+    ("window", {"read_window": 8, "hedge": False}),
+    ("window+hedge", {"read_window": 8, "hedge": True}),
+]
+
+
+def slow_reads(delay: float):
+    def setup(chunkserver):
+        @chunkserver.app.middleware("http")
+        async def delay_reads(request, call_next):
+            if request.url.path.startswith("/read_chunk_binary"):
+                await asyncio.sleep(delay)
+            return await call_next(request)
+    return setup
+
+
+def percentile(samples: list, p: float) -> float:
+    return samples[min(len(samples) - 1, int(len(samples) * p / 100))]
+
+
+def run_mode(master_url: str, paths: list, reads: int, threads: int, options: dict) -> tuple:
+    cache = LocationCache()
+    clients = [GFSClient(master_url, cache=cache, **options) for _ in range(threads)]
+    for client in clients:
+        client.read_file(paths[0])  # Warm the cache and connections
+    latencies = []
+    lock = threading.Lock()
+
+    def reader(client: GFSClient, seed: int):
+        rand = random.Random(seed)
+        for _ in range(reads // threads):
+            start = time.perf_counter()
+            client.read_file(rand.choice(paths))
+            elapsed = time.perf_counter() - start
+            with lock:
+                latencies.append(elapsed)
+
+    workers = [threading.Thread(target=reader, args=(client, i)) for i, client in enumerate(clients)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+    hedged = sum(client.hedged_requests for client in clients)
+    chunk_requests = sum(client.chunk_requests for client in clients)
+    for client in clients:
+        client.executor.shutdown(wait=True)  # Let hedge losers finish before the next mode
+        client.close()
+    return sorted(latencies), hedged, chunk_requests
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--reads", type=int, default=300)
+    parser.add_argument("--files", type=int, default=50)
+    parser.add_argument("--chunks", type=int, default=8, help="chunks per file")
+    parser.add_argument("--chunk-size", type=int, default=64 * 1024)
+    parser.add_argument("--chunkservers", type=int, default=4)
+    parser.add_argument("--delay", type=float, default=0.2, help="seconds the slow chunkserver adds to each read")
+    parser.add_argument("--threads", type=int, default=1, help="concurrent readers, all servers share this process's CPU")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="gfs-hedged-reads-bench-")
+    os.chdir(workdir)
+    os.environ["CHUNK_SIZE"] = str(args.chunk_size)
+    try:
+        master_url = start_master()
+        servers = [start_chunkserver(f"cs{i}", master_url) for i in range(args.chunkservers - 1)]
+        servers.append(start_chunkserver("slow", master_url, setup=slow_reads(args.delay)))
+        paths = [f"/bench/file_{i}" for i in range(args.files)]
+        with GFSClient(master_url) as client:
+            for server in servers:
+                client.master_call("POST", "/register_chunkserver", json={"chunkserver_id": server})
+            for path in paths:
+                client.write_file(path, os.urandom(args.chunks * args.chunk_size))
+
+        print(f"{args.reads} reads of {args.chunks} x {args.chunk_size} byte files, "
+              f"1 of {args.chunkservers} chunkservers {args.delay * 1000:.0f}ms slower")
+        for label, options in MODES:
+            latencies, hedged, chunk_requests = run_mode(master_url, paths, args.reads, args.threads, options)
+            print(f"  {label:<13} p50 {percentile(latencies, 50) * 1000:7.1f}ms   "
+                  f"p99 {percentile(latencies, 99) * 1000:7.1f}ms   "
+                  f"p99.9 {percentile(latencies, 99.9) * 1000:7.1f}ms   "
+                  f"hedged {hedged / chunk_requests:5.1%} of chunk requests")
+    finally:
+        os.chdir("/")
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
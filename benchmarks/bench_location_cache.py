@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""
+Read-heavy workload against a master and chunkservers on loopback, with the
+client location cache off and on. Each thread is a client, all of them share
+one cache. Reports reads/s and the request rate the master sees; with the
+cache the master is only asked once per file and lease.
+
+    $ python benchmarks/bench_location_cache.py [--files 100] [--reads 2000] [--threads 8]
+"""
+import argparse
+import os
+import random
+import shutil
+import socket
+import sys
+import tempfile
+import threading
+import time
+
+import uvicorn
+
+sys.path.insert(0, os.path.dirname(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "client"))
+
+from bench_chunk_io import start_chunkserver
+from gfs_client import GFSClient, LocationCache
+
+
+def start_master() -> str:
+    """
+    Runs the master app on a free loopback port in a background thread and
+    returns its URL. Set CHUNK_SIZE etc. in os.environ before calling.
+    """
+    sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "master"))
+    os.environ.setdefault("HEARTBEAT_TIMEOUT", "3600")  # Benchmark chunkservers send no heartbeats
+    import master
+
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    server = uvicorn.Server(uvicorn.Config(master.app, host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    return f"http://127.0.0.1:{port}"
+
+
+def run_workload(master_url: str, paths: list, reads: int, threads: int, use_cache: bool) -> dict:
+    cache = LocationCache()
+    clients = [GFSClient(master_url, use_cache=use_cache, cache=cache) for _ in range(threads)]
+    per_thread = reads // threads
+
+    def reader(client: GFSClient, seed: int):
+        rand = random.Random(seed)
+        for _ in range(per_thread):
+            client.read_file(rand.choice(paths))
+
+    workers = [threading.Thread(target=reader, args=(client, i)) for i, client in enumerate(clients)]
+    start = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - start
+
+    master_requests = sum(client.master_requests for client in clients)
+    for client in clients:
+        client.close()
+    return {
+        "reads": per_thread * threads,
+        "elapsed": elapsed,
+        "master_requests": master_requests,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--files", type=int, default=100)
+    parser.add_argument("--file-size", type=int, default=64 * 1024)
+    parser.add_argument("--reads", type=int, default=2000)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--chunkservers", type=int, default=3)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="gfs-location-cache-bench-")
+    os.chdir(workdir)
+    os.environ.setdefault("CHUNK_SIZE", str(64 * 1024))
+    try:
+        master_url = start_master()
+        servers = [start_chunkserver(f"cs{i}", master_url) for i in range(args.chunkservers)]
+        with GFSClient(master_url) as client:
+            for server in servers:
+                client.master_call("POST", "/register_chunkserver", json={"chunkserver_id": server})
+            paths = [f"/bench/file_{i}" for i in range(args.files)]
+            data = os.urandom(args.file_size)
+            for path in paths:
+                client.write_file(path, data)
+
+        print(f"{args.reads} reads of {args.files} files ({args.file_size} bytes) from {args.threads} threads")
+        for use_cache in (False, True):
+            result = run_workload(master_url, paths, args.reads, args.threads, use_cache)
+            print(f"  cache {'on ' if use_cache else 'off'}  {result['reads'] / result['elapsed']:8.0f} reads/s   "
+                  f"master {result['master_requests'] / result['elapsed']:8.0f} req/s   "
+                  f"({result['master_requests']} master requests)")
+    finally:
+        os.chdir("/")
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+"""
+Concurrency stress test and throughput benchmark for the master's metadata.
+
+Client threads call the same Master methods the HTTP handlers run in the
+threadpool, a mix of creates, layout reads, directory listings and deletes,
+while a garbage collector thread reclaims deleted files like the master's
+event loop does (chunk deletes are acked without chunkservers). Runs at 1, 8
+and 32 clients and reports operations/s.
+
+The "background" scenario runs the rest of the master's event loop alongside
+the clients as well: the heartbeat check disconnects a chunkserver every
+--kill-interval seconds and a fresh one registers, the replication scheduler
+re-replicates the lost replicas and the rebalancer moves replicas to the
+fresh chunkservers (copies succeed without chunkservers). It also reports
+the longest the event loop stalled; a metadata call taking its locks on the
+loop shows up there, and so does waiting for the GIL on machines with fewer
+cores than client threads.
+
+After every run the metadata is checked: no chunk slot may be handed out
+twice, the reverse chunk index must match the files, every allocated slot must
+belong to a file or be waiting for the garbage collector, and every part with
+a replica left must be back to full replication.
+
+    $ python benchmarks/bench_metadata_concurrency.py [--clients 1,8,32] [--ops 4000] [--servers 50]
+          [--scenarios plain,background] [--kill-interval 0.05]
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "master"))
+
+from master import Master
+
+
+SLOTS = 4000  # Chunk slots per chunkserver
+
+
+def make_master(servers: int) -> Master:
+    master = Master()
+    for i in range(servers):
+        master.register_chunkserver(f"http://chunkserver{i}:8000", 0, SLOTS * master.max_chunk_size)
+    master.garbage_collection_time = 0
+    master.gc_batch_size = 500
+
+    async def ack_deletes(client, chunkserver_id, chunk_ids):
+        await asyncio.sleep(0.001)
+        return 0
+    master.delete_chunks = ack_deletes
+
+    async def copy(client, source_chunk, target_chunkserver_id, target_chunk_id, path, part_index, rebuild=None):
+        await asyncio.to_thread(master.copy_request, source_chunk, target_chunk_id, path, part_index, rebuild)
+        await asyncio.sleep(0.002)
+    master.copy_chunk = copy
+
+    master.replication.base_backoff = 0.01
+    master.replication.max_backoff = 0.1
+    master.rebalancer.bytes_per_second = 1 << 40
+    master.rebalancer.threshold = 0.02
+    master.rebalancer.interval = 0.05
+    return master
+
+
+def client(master: Master, seed: int, ops: int, counts: Counter, errors: list):
+    rand = random.Random(seed)
+    mine = []  # Files this client created and did not delete yet
+    for n in range(ops):
+        roll = rand.random()
+        try:
+            if roll < 0.35 or not mine:
+                path = f"/bench/dir{rand.randrange(16)}/c{seed}-f{n}"
+                master.create_file(path, rand.randint(1, 8) * master.max_chunk_size)
+                mine.append(path)
+                counts["create"] += 1
+            elif roll < 0.75:
+                master.get_file_layout(rand.choice(mine))
+                counts["read"] += 1
+            elif roll < 0.85:
+                master.list_directory(rand.choice(mine).rsplit("/", 1)[0], limit=100)
+                counts["list"] += 1
+            else:
+                master.delete_file(mine.pop(rand.randrange(len(mine))))
+                counts["delete"] += 1
+        except Exception as e:
+            errors.append(f"{type(e).__name__}: {e}")
+
+
+def collector(master: Master, stop: threading.Event):
+    async def run():
+        while not stop.is_set():
+            await master.garbage_collection()
+            await asyncio.sleep(0.005)
+        await master.garbage_collection()
+    asyncio.run(run())
+
+
+def background(master: Master, stop: threading.Event, servers: int, kill_interval: float, stats: Counter):
+    """
+    Runs the master's event loop: its serial background loop with a chunkserver
+    going silent every `kill_interval`, the replication scheduler and the rebalancer.
+    """
+    rand = random.Random(servers)
+
+    async def watch_loop():
+        # How late a short sleep wakes up is how long the loop was blocked
+        while not stop.is_set():
+            started = time.perf_counter()
+            await asyncio.sleep(0.001)
+            stats["max_stall_us"] = max(stats["max_stall_us"], int((time.perf_counter() - started - 0.001) * 1e6))
+
+    async def serial_loop():
+        last_kill = time.perf_counter()
+        while not stop.is_set():
+            if time.perf_counter() - last_kill >= kill_interval:
+                last_kill = time.perf_counter()
+                master.last_heartbeat[rand.choice(sorted(master.chunkserver_ids))] = 0
+                await asyncio.to_thread(master.register_chunkserver, f"http://chunkserver{servers + stats['killed']}:8000",
+                                        0, SLOTS * master.max_chunk_size)
+                stats["killed"] += 1
+            await asyncio.to_thread(master.heartbeat_check)
+            await master.garbage_collection()
+            await asyncio.sleep(0.005)
+
+    async def run():
+        master.replication.start()
+        master.rebalancer.start()
+        await asyncio.gather(watch_loop(), serial_loop())
+        # Let the last moves and copies finish, then reclaim what they left behind
+        await master.rebalancer.stop()
+        replication = master.replication
+        while replication.queue or replication.in_flight or replication.delayed or replication.episode_started_at:
+            await asyncio.sleep(0.01)
+        stats["replicated"] = replication.completed
+        stats["moved"] = master.rebalancer.completed
+        await replication.stop()
+        await master.garbage_collection()
+    asyncio.run(run())
+
+
+def check(master: Master) -> list:
+    problems = master.check_chunk_index()
+    owners = Counter()
+    for parts in master.files.values():
+        for replicas in parts:
+            for chunk in replicas:
+                owners[(chunk['chunkserver_id'], chunk['chunk_id'])] += 1
+    problems += [f"Chunk {key} is used {count} times" for key, count in owners.items() if count > 1][:10]
+    for chunkserver_id, chunk_ids in master.chunkservers.items():
+        allocator = master.allocators[chunkserver_id]
+        if allocator.capacity - allocator.free != len(chunk_ids):
+            problems.append(f"{chunkserver_id}: allocator has {allocator.capacity - allocator.free} slots in use, "
+                            f"{len(chunk_ids)} chunks allocated")
+        leaked = [chunk_id for chunk_id in chunk_ids if (chunkserver_id, chunk_id) not in master.chunk_locations]
+        if leaked:
+            problems.append(f"{chunkserver_id}: {len(leaked)} allocated chunks belong to no file")
+    # Parts whose every replica was lost before it could be copied cannot recover
+    wrong = [(path, part_index) for path, parts in master.files.items() for part_index in range(len(parts))
+             if 0 < len(master.live_replicas(path, part_index)) != master.replication_factor]
+    if wrong:
+        problems.append(f"{len(wrong)} parts are not at {master.replication_factor} replicas, first: {wrong[0]}")
+    return problems
+
+
+def lost_parts(master: Master) -> int:
+    return sum(not master.live_replicas(path, part_index)
+               for path, parts in master.files.items() for part_index in range(len(parts)))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--clients", default="1,8,32")
+    parser.add_argument("--ops", type=int, default=4000, help="operations per run, split over the clients")
+    parser.add_argument("--servers", type=int, default=50)
+    parser.add_argument("--scenarios", default="plain,background")
+    parser.add_argument("--kill-interval", type=float, default=0.05, help="seconds between chunkserver failures")
+    args = parser.parse_args()
+
+    failed = False
+    runs = [(scenario, int(n)) for scenario in args.scenarios.split(",") for n in args.clients.split(",")]
+    for scenario, clients in runs:
+        master = make_master(args.servers)
+        counts, errors, stats = Counter(), [], Counter()
+        stop = threading.Event()
+        if scenario == "background":
+            loop_thread = threading.Thread(target=background, args=(master, stop, args.servers, args.kill_interval, stats))
+        else:
+            loop_thread = threading.Thread(target=collector, args=(master, stop))
+        loop_thread.start()
+
+        threads = [threading.Thread(target=client, args=(master, i, args.ops // clients, counts, errors))
+                   for i in range(clients)]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+        stop.set()
+        loop_thread.join()
+
+        problems = check(master)
+        total = sum(counts.values())
+        print(f"{scenario:>10} {clients:>3} clients: {total / elapsed:>9,.0f} ops/s  "
+              f"({counts['create']} creates, {counts['read']} reads, {counts['list']} lists, {counts['delete']} deletes, "
+              f"{len(errors)} errors)  {'OK' if not problems and not errors else 'INCONSISTENT'}")
+        if scenario == "background":
+            print(f"{'':>22}{stats['killed']} chunkservers lost, {stats['replicated']} replicas copied, "
+                  f"{stats['moved']} moved, {lost_parts(master)} parts lost every replica, "
+                  f"event loop stalled up to {stats['max_stall_us'] / 1000:.1f} ms")
+        for problem in (errors[:5] + problems[:10]):
+            print(f"      {problem}")
+        failed |= bool(problems or errors)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
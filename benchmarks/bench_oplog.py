@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""
+Benchmark for the master operation log.
+
+Measures metadata ops/sec (small file creates) with logging off, with
+logging on, and with logging on plus a durable sync after every operation,
+raw group commit throughput with concurrent writers, and recovery time from
+a checkpoint plus log tail vs from the full log.
+
+    $ python benchmarks/bench_oplog.py [--files 10000] [--writers 16]
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "master"))
+
+from master import Master
+from oplog import OperationLog
+
+
+def new_master(data_dir=None) -> Master:
+    master = Master(data_dir=data_dir)
+    if not master.chunkserver_ids:
+        for i in range(20):
+            master.register_chunkserver(f"http://chunkserver{i}:8000")
+    return master
+
+
+def create_files(master: Master, count: int, sync: bool) -> float:
+    start = time.perf_counter()
+    for i in range(count):
+        master.create_file(f"/bench/dir{i % 100}/file{i}", 2 * master.max_chunk_size)
+        if sync:
+            master.sync_log()
+    master.sync_log()
+    return count / (time.perf_counter() - start)
+
+
+def group_commit(directory: str, writers: int, per_writer: int) -> float:
+    oplog = OperationLog(directory)
+    oplog.start(0)
+
+    def writer(n):
+        for i in range(per_writer):
+            oplog.wait(oplog.append({"op": "delete", "path": f"/w{n}/{i}", "deleted_at": 0.0}))
+
+    threads = [threading.Thread(target=writer, args=(n,)) for n in range(writers)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    oplog.close()
+    return writers * per_writer / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--files", type=int, default=10_000)
+    parser.add_argument("--writers", type=int, default=16)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="gfs-oplog-bench-")
+    try:
+        print(f"logging off:            {create_files(new_master(), args.files, sync=False):10,.0f} creates/s")
+        print(f"logging on:             {create_files(new_master(os.path.join(workdir, 'a')), args.files, sync=False):10,.0f} creates/s")
+        sync_count = max(1, args.files // 20)
+        print(f"logging on, sync each:  {create_files(new_master(os.path.join(workdir, 'b')), sync_count, sync=True):10,.0f} creates/s")
+        print(f"group commit, {args.writers} writers: {group_commit(os.path.join(workdir, 'c'), args.writers, 200):10,.0f} durable appends/s")
+
+        # Recovery from the full log
+        directory = os.path.join(workdir, "d")
+        master = new_master(directory)
+        create_files(master, args.files, sync=False)
+        master.oplog.close()
+        start = time.perf_counter()
+        new_master(directory).oplog.close()
+        print(f"recovery, full log replay:        {time.perf_counter() - start:.3f}s")
+
+        # Recovery from a checkpoint plus a 10% tail
+        directory = os.path.join(workdir, "e")
+        master = new_master(directory)
+        create_files(master, args.files, sync=False)
+        master.checkpoint()
+        for i in range(args.files // 10):
+            master.create_file(f"/bench/tail/file{i}", master.max_chunk_size)
+        master.sync_log()
+        master.oplog.close()
+        start = time.perf_counter()
+        new_master(directory).oplog.close()
+        print(f"recovery, checkpoint + 10% tail:  {time.perf_counter() - start:.3f}s")
+    finally:
+        shutil.rmtree(workdir)
+
+
+if __name__ == "__main__":
+    main()
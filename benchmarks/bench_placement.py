@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+"""
+Placement policy simulation: replays an allocation trace against an in-process
+master once per policy and reports, for each:
+
+  - placement throughput, replicas placed per second of create_file time
+  - skew of disk utilization across chunkservers (max / mean, coefficient of variation)
+  - share of live replicas on the hot chunkservers, which report heavy load
+  - share of chunks whose replicas sit in distinct racks
+  - rebalance cost, chunks (and GiB) to move until every server is within
+    --tolerance of the mean utilization
+  - creates that failed for lack of space
+
+A trace is JSON lines: {"op": "join", "server", "slots", "labels", "load"},
+{"op": "create", "path", "chunks"} and {"op": "delete", "path"}. Without --trace
+a synthetic one is generated: servers of mixed sizes in racks and zones, a few
+of them hot, files created and deleted around a target fill, and a batch of
+empty servers joining halfway through.
+
+    $ python benchmarks/bench_placement.py [--servers 60] [--ops 5000] [--policies most_free,p2c,p2c+rack]
+    $ python benchmarks/bench_placement.py --save-trace trace.jsonl
+    $ python benchmarks/bench_placement.py --trace trace.jsonl
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "master"))
+
+from master import Master
+from placement import make_policy
+
+DEFAULT_POLICIES = "most_free,p2c,write_balance,most_free+rack,p2c+rack,write_balance+rack"
+
+
+def generate_trace(args) -> list:
+    rng = random.Random(args.seed)
+    trace = []
+    total_slots = 0
+
+    def join(index: int):
+        nonlocal total_slots
+        slots = args.slots * rng.choice((1, 2, 4))
+        total_slots += slots
+        rack = index % args.racks
+        hot = rng.random() < args.hot
+        trace.append({
+            "op": "join",
+            "server": f"http://chunkserver{index}:8000",
+            "slots": slots,
+            "labels": {"rack": f"rack{rack}", "zone": f"zone{rack % args.zones}"},
+            "load": {"inflight_requests": 40 if hot else rng.randint(0, 2),
+                     "write_bytes_per_second": (200 if hot else rng.randint(0, 10)) * 1024 * 1024},
+        })
+
+    for index in range(args.servers):
+        join(index)
+
+    live = {}  # path -> chunks
+    live_chunks = 0
+    for n in range(args.ops):
+        if n == args.ops // 2:
+            for index in range(args.servers, args.servers + args.join):
+                join(index)
+        full = live_chunks * args.replication > args.fill * total_slots
+        if live and (full or rng.random() < 0.3):
+            path = rng.choice(list(live))
+            live_chunks -= live.pop(path)
+            trace.append({"op": "delete", "path": path})
+        else:
+            path = f"/sim/file{n}"
+            chunks = min(64, 1 + int(rng.expovariate(1 / 8)))
+            live[path] = chunks
+            live_chunks += chunks
+            trace.append({"op": "create", "path": path, "chunks": chunks})
+    return trace
+
+
+def reclaim(master: Master):
+    # Deleted chunks go straight back to their servers, there are no chunkservers to ack
+    while True:
+        batch, dropped = master.collect_garbage(float("inf"))
+        if not batch and not dropped:
+            break
+        for chunkserver_id, chunk_ids in batch.items():
+            master.release_chunks(chunkserver_id, chunk_ids)
+
+
+def replay(trace: list, spec: str, replication: int, tolerance: float) -> dict:
+    master = Master()
+    master.replication_factor = replication
+    master.placement = make_policy(spec)
+    master.rand.seed(0)
+    chunk_size = master.max_chunk_size
+    hot = set()
+
+    placed = failed = 0
+    placement_seconds = 0.0
+    for record in trace:
+        op = record["op"]
+        if op == "join":
+            master.register_chunkserver(record["server"], used_bytes=0, free_bytes=record["slots"] * chunk_size,
+                                        labels=record.get("labels"))
+            master.load[record["server"]] = record.get("load") or {}
+            if (record.get("load") or {}).get("inflight_requests", 0) >= 10:
+                hot.add(record["server"])
+        elif op == "create":
+            start = time.perf_counter()
+            try:
+                with contextlib.redirect_stdout(io.StringIO()):  # The master prints allocation failures
+                    master.create_file(record["path"], record["chunks"] * chunk_size)
+                placed += record["chunks"] * replication
+            except Exception:
+                failed += 1
+            placement_seconds += time.perf_counter() - start
+        elif op == "delete":
+            if master.file_exists(record["path"]):
+                master.delete_file(record["path"])
+                reclaim(master)
+
+    servers = sorted(master.chunkserver_ids)
+    used = {server: len(master.chunkservers[server]) for server in servers}
+    capacity = {server: master.slot_capacity(server) for server in servers}
+    utilization = [used[server] / capacity[server] for server in servers]
+    mean = sum(used.values()) / sum(capacity.values())
+
+    # Chunks that must leave overfull servers and land on underfull ones
+    excess = sum(max(0, used[server] - capacity[server] * (mean + tolerance)) for server in servers)
+    deficit = sum(max(0, capacity[server] * (mean - tolerance) - used[server]) for server in servers)
+    moves = int(max(excess, deficit))
+
+    spread = total = 0
+    for parts in master.files.values():
+        for replicas in parts:
+            racks = {master.labels.get(chunk['chunkserver_id'], {}).get("rack", chunk['chunkserver_id'])
+                     for chunk in replicas}
+            spread += len(racks) == len(replicas)
+            total += 1
+
+    live_replicas = sum(used.values())
+    return {
+        "policy": master.placement.name,
+        "replicas_per_second": placed / placement_seconds if placement_seconds else 0.0,
+        "max_over_mean": max(utilization) / mean if mean else 0.0,
+        "cv": statistics.pstdev(utilization) / mean if mean else 0.0,
+        "hot_share": sum(used[server] for server in hot) / live_replicas if live_replicas else 0.0,
+        "hot_capacity_share": sum(capacity[server] for server in hot) / sum(capacity.values()),
+        "rack_spread": spread / total if total else 1.0,
+        "moves": moves,
+        "move_gib": moves * chunk_size / 1024 ** 3,
+        "failed": failed,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--trace", help="replay this JSON lines trace instead of generating one")
+    parser.add_argument("--save-trace", help="write the generated trace here")
+    parser.add_argument("--policies", default=DEFAULT_POLICIES)
+    parser.add_argument("--servers", type=int, default=60)
+    parser.add_argument("--join", type=int, default=6, help="empty servers joining halfway through")
+    parser.add_argument("--racks", type=int, default=6)
+    parser.add_argument("--zones", type=int, default=3)
+    parser.add_argument("--slots", type=int, default=1000, help="chunk slots of the smallest server")
+    parser.add_argument("--hot", type=float, default=0.1, help="fraction of servers under heavy load")
+    parser.add_argument("--ops", type=int, default=5000)
+    parser.add_argument("--fill", type=float, default=0.7, help="target fraction of slots in use")
+    parser.add_argument("--replication", type=int, default=3)
+    parser.add_argument("--tolerance", type=float, default=0.05, help="utilization band around the mean after rebalancing")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    if args.trace:
+        with open(args.trace) as f:
+            trace = [json.loads(line) for line in f if line.strip()]
+    else:
+        trace = generate_trace(args)
+        if args.save_trace:
+            with open(args.save_trace, "w") as f:
+                f.writelines(json.dumps(record) + "\n" for record in trace)
+
+    joins = sum(record["op"] == "join" for record in trace)
+    print(f"{len(trace) - joins} file operations over {joins} chunkservers, RF {args.replication}")
+    print(f"{'policy':<20} {'replicas/s':>11} {'max/mean':>9} {'cv':>6} {'hot':>12} "
+          f"{'rack spread':>12} {'rebalance':>18} {'failed':>7}")
+    for spec in args.policies.split(","):
+        result = replay(trace, spec, args.replication, args.tolerance)
+        print(f"{result['policy']:<20} {result['replicas_per_second']:>11,.0f} {result['max_over_mean']:>9.2f} "
+              f"{result['cv']:>6.2f} {result['hot_share']:>5.1%} /{result['hot_capacity_share']:>5.1%} "
+              f"{result['rack_spread']:>12.1%} {result['moves']:>7} ({result['move_gib']:>6.0f} GiB) "
+              f"{result['failed']:>7}")
+    print("hot: share of live replicas on the hot servers / their share of the capacity")
+
+
+if __name__ == "__main__":
+    main()
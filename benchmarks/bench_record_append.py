@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+"""
+Record append throughput and correctness with concurrent producers. Every
+level of --producers appends to its own file through three chunkservers:
+each producer thread appends --records records and keeps the offsets the
+file system returned. Reports records/s, MB/s and p50/p99 latency per
+append, then checks that no two acknowledged records overlap and that every
+replica of the file holds every acknowledged record at its offset.
+
+    $ python benchmarks/bench_record_append.py [--producers 1,2,4,8,16,32,64] [--records 200] [--record-size 1024]
+"""
+import argparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+import httpx
+
+sys.path.insert(0, os.path.dirname(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "client"))
+
+from bench_chunk_io import start_chunkserver
+from bench_location_cache import start_master
+from gfs_client import GFSClient
+
+
+def percentile(samples: list, p: float) -> float:
+    return samples[min(len(samples) - 1, int(len(samples) * p / 100))]
+
+
+def make_record(producer: int, seq: int, size: int, rand: random.Random) -> bytes:
+    header = f"<{producer}:{seq}>".encode()
+    return header + rand.randbytes(max(0, rand.randint(size // 2, size * 3 // 2) - len(header)))
+
+
+def run_level(master_url: str, path: str, producers: int, records: int, record_size: int) -> tuple:
+    appended = []  # (offset, record)
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+    clients = [GFSClient(master_url) for _ in range(producers)]
+
+    def producer(client: GFSClient, index: int):
+        rand = random.Random(index)
+        for seq in range(records):
+            record = make_record(index, seq, record_size, rand)
+            start = time.perf_counter()
+            try:
+                offset = client.record_append(path, record)
+            except Exception as e:
+                with lock:
+                    errors.append(f"{type(e).__name__}: {e}")
+                continue
+            elapsed = time.perf_counter() - start
+            with lock:
+                appended.append((offset, record))
+                latencies.append(elapsed)
+
+    workers = [threading.Thread(target=producer, args=(client, i)) for i, client in enumerate(clients)]
+    start = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - start
+    retries = sum(client.append_retries for client in clients)
+    for client in clients:
+        client.close()
+    return appended, sorted(latencies), elapsed, retries, errors
+
+
+def verify(master_url: str, path: str, appended: list) -> list:
+    """
+    Acknowledged records must not overlap, and must be at their offset on every replica.
+    """
+    problems = []
+    end = 0
+    for offset, record in sorted(appended, key=lambda entry: entry[0]):
+        if offset < end:
+            problems.append(f"Record at {offset} overlaps the one ending at {end}")
+        end = max(end, offset + len(record))
+
+    with GFSClient(master_url, use_cache=False) as client:
+        layout = client.get_layout(path)
+        chunk_size = layout["chunk_size"]
+        replicas = {}  # (part, chunkserver_id) -> chunk contents
+        for part in range(len(layout["replica_offsets"]) - 1):
+            for chunkserver_id, chunk_id in client.replicas(layout, part):
+                resp = httpx.get(f"{chunkserver_id}/read_chunk_binary/{chunk_id}", timeout=60.0)
+                replicas[(part, chunkserver_id)] = resp.content if resp.status_code == 200 else b""
+        for offset, record in appended:
+            part, start = divmod(offset, chunk_size)
+            holders = [server for (p, server) in replicas if p == part]
+            if not holders:
+                problems.append(f"Record at {offset} is in part {part}, which the file does not have")
+            for server in holders:
+                if replicas[(part, server)][start:start + len(record)] != record:
+                    problems.append(f"Record at {offset} is missing on {server}")
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--producers", default="1,2,4,8,16,32,64")
+    parser.add_argument("--records", type=int, default=200, help="records per producer")
+    parser.add_argument("--record-size", type=int, default=1024, help="mean record size in bytes")
+    parser.add_argument("--chunk-size", type=int, default=1024 * 1024)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="gfs-record-append-bench-")
+    os.chdir(workdir)
+    os.environ["CHUNK_SIZE"] = str(args.chunk_size)
+    failed = False
+    try:
+        master_url = start_master()
+        servers = [start_chunkserver(f"cs{i}", master_url) for i in range(3)]
+        with GFSClient(master_url) as client:
+            for server in servers:
+                client.master_call("POST", "/register_chunkserver", json={"chunkserver_id": server})
+
+        print(f"Appending ~{args.record_size} byte records to {args.chunk_size // 1024} KiB chunks, 3 replicas")
+        for producers in (int(n) for n in args.producers.split(",")):
+            path = f"/bench/log_{producers}"
+            appended, latencies, elapsed, retries, errors = run_level(
+                master_url, path, producers, args.records, args.record_size)
+            problems = errors + verify(master_url, path, appended)
+            total_bytes = sum(len(record) for _, record in appended)
+            print(f"  {producers:>3} producers: {len(appended) / elapsed:>8,.0f} records/s  "
+                  f"{total_bytes / elapsed / 1e6:7.2f} MB/s   "
+                  f"p50 {percentile(latencies, 50) * 1000:7.2f}ms   p99 {percentile(latencies, 99) * 1000:7.2f}ms   "
+                  f"{retries} retries   {'OK' if not problems else 'INCONSISTENT'}")
+            for problem in problems[:10]:
+                print(f"      {problem}")
+            failed |= bool(problems)
+    finally:
+        os.chdir("/")
+        shutil.rmtree(workdir, ignore_errors=True)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""
+Benchmark for replicated chunk writes: the client pushing every replica
+itself (fan-out) vs one write forwarded along the replica chain.
+Reports client-side bytes sent and end-to-end latency for replication
+factors 1-5. Runs the chunkservers on loopback in this process.
+
+    $ python benchmarks/bench_replica_chain.py [--size 8388608] [--requests 20]
+"""
+import argparse
+import asyncio
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+import httpx
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+from bench_chunk_io import start_chunkserver
+
+
+async def fan_out(client: httpx.AsyncClient, servers: list, chunk_id: int, data: bytes):
+    responses = await asyncio.gather(*[
+        client.post(f"{server}/write_chunk_binary/{chunk_id}", content=data) for server in servers
+    ])
+    for resp in responses:
+        resp.raise_for_status()
+
+
+async def chain(client: httpx.AsyncClient, servers: list, chunk_id: int, data: bytes):
+    resp = await client.post(
+        f"{servers[0]}/write_chunk_binary/{chunk_id}",
+        params=[("forward", f"{chunk_id}@{server}") for server in servers[1:]],
+        content=data,
+    )
+    resp.raise_for_status()
+    assert len(resp.json()["replicas"]) == len(servers)
+
+
+async def run(args):
+    servers = [start_chunkserver(f"server{i}") for i in range(5)]
+    data = os.urandom(args.size)
+    async with httpx.AsyncClient(timeout=120) as client:
+        for replication_factor in range(1, 6):
+            targets = servers[:replication_factor]
+            for label, write in (("fan-out", fan_out), ("chain", chain)):
+                latencies = []
+                for i in range(args.requests):
+                    start = time.perf_counter()
+                    await write(client, targets, i, data)
+                    latencies.append(time.perf_counter() - start)
+                sent = args.size * (replication_factor if write is fan_out else 1)
+                latencies.sort()
+                print(f"rf={replication_factor} {label:<8} client sent {sent / 1e6:7.1f} MB/write   "
+                      f"p50 {statistics.median(latencies) * 1000:8.2f}ms   "
+                      f"p99 {latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000:8.2f}ms")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size", type=int, default=8 * 1024 * 1024)
+    parser.add_argument("--requests", type=int, default=20)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="gfs-chain-bench-")
+    os.chdir(workdir)
+    try:
+        asyncio.run(run(args))
+    finally:
+        os.chdir("/")
+        shutil.rmtree(workdir)
+
+
+if __name__ == "__main__":
+    main()
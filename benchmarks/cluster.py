@@ -0,0 +1,150 @@
+"""
+A local cluster for load tests: the master and N chunkservers, each in its own
+process on a loopback port, started like the Docker images start them but
+without Docker. Every process runs in its own directory under `workdir` and
+logs to <name>.log there. Chunkservers can be killed with SIGKILL and started
+again on the same port and disk, as a crashed machine coming back would.
+
+    with LocalCluster(workdir, chunkservers=5, env={"CHUNK_SIZE": "1048576"}) as cluster:
+        client = GFSClient(cluster.master_url)
+"""
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+from typing import Dict, List, Optional
+
+import httpx
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+# Settings that make failures show up within seconds instead of minutes, overridable with `env`
+CLUSTER_ENV = {
+    "HEARTBEAT_INTERVAL": "1",
+    "HEARTBEAT_TIMEOUT": "3",
+    "BACKGROUND_INTERVAL_SECONDS": "0.5",
+    "GC_RETENTION_SECONDS": "0",
+    "REBALANCE_INTERVAL_SECONDS": "3600",  # Rebalancing would add copies the workloads did not ask for
+    "SCRUB_BYTES_PER_SECOND": "0",
+}
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+class LocalCluster:
+    def __init__(self, workdir: str, chunkservers: int = 5, env: Optional[Dict[str, str]] = None):
+        self.workdir = workdir
+        self.env = {**os.environ, **CLUSTER_ENV, **(env or {}), "PYTHONUNBUFFERED": "1"}
+        self.master_port = free_port()
+        self.master_url = f"http://127.0.0.1:{self.master_port}"
+        self.master: Optional[subprocess.Popen] = None
+        self.ports: List[int] = [free_port() for _ in range(chunkservers)]
+        self.chunkservers: List[Optional[subprocess.Popen]] = [None] * chunkservers
+        self.http = httpx.Client(timeout=httpx.Timeout(30.0, connect=2.0))
+
+    def __enter__(self) -> "LocalCluster":
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def chunkserver_url(self, index: int) -> str:
+        return f"http://127.0.0.1:{self.ports[index]}"
+
+    def spawn(self, name: str, command: List[str], cwd: str, env: Dict[str, str]) -> subprocess.Popen:
+        directory = os.path.join(self.workdir, name)
+        os.makedirs(directory, exist_ok=True)
+        log = open(os.path.join(self.workdir, f"{name}.log"), "ab")
+        try:
+            return subprocess.Popen(command, cwd=cwd, env={**self.env, **env, "PYTHONPATH": cwd},
+                                    stdout=log, stderr=subprocess.STDOUT)
+        finally:
+            log.close()  # The child has its own copy
+
+    def start(self, timeout: float = 60.0):
+        # The master keeps its metadata in MASTER_DATA_DIR, chunkservers their chunks under the working directory
+        self.master = self.spawn(
+            "master",
+            [sys.executable, "-m", "uvicorn", "master:app", "--host", "127.0.0.1",
+             "--port", str(self.master_port), "--log-level", "warning"],
+            cwd=os.path.join(ROOT, "master"),
+            env={"MASTER_DATA_DIR": os.path.join(self.workdir, "master")},
+        )
+        self.wait_until(lambda: self.get("/gc_status") is not None, timeout, "the master to start")
+        for index in range(len(self.chunkservers)):
+            self.start_chunkserver(index, wait=False)
+        self.wait_until(lambda: len(self.live_chunkservers()) == len(self.chunkservers), timeout,
+                        "all chunkservers to register")
+
+    def start_chunkserver(self, index: int, wait: bool = True, timeout: float = 60.0) -> float:
+        """
+        Starts chunkserver `index` and returns the seconds until the master counted it as live.
+        """
+        name = f"chunkserver{index}"
+        started = time.perf_counter()
+        self.chunkservers[index] = self.spawn(
+            name,
+            # Runs chunkserver.py from the chunkserver's own directory, where its chunks/ live
+            [sys.executable, os.path.join(ROOT, "chunkserver", "chunkserver.py")],
+            cwd=os.path.join(self.workdir, name),
+            env={
+                "MASTER_URL": self.master_url,
+                "CHUNKSERVER_ID": name,
+                "EXTERNAL_HOST": "127.0.0.1",
+                "EXTERNAL_PORT": str(self.ports[index]),
+                "PORT": str(self.ports[index]),
+            },
+        )
+        if wait:
+            url = self.chunkserver_url(index)
+            self.wait_until(lambda: url in self.live_chunkservers(), timeout, f"{name} to register")
+        return time.perf_counter() - started
+
+    def kill_chunkserver(self, index: int):
+        process = self.chunkservers[index]
+        if process is not None and process.poll() is None:
+            process.send_signal(signal.SIGKILL)
+            process.wait()
+        self.chunkservers[index] = None
+
+    def stop(self):
+        for index in range(len(self.chunkservers)):
+            self.kill_chunkserver(index)
+        if self.master is not None and self.master.poll() is None:
+            self.master.terminate()
+            try:
+                self.master.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                self.master.kill()
+        self.master = None
+        self.http.close()
+
+    def get(self, endpoint: str) -> Optional[dict]:
+        try:
+            resp = self.http.get(f"{self.master_url}{endpoint}")
+        except httpx.HTTPError:
+            return None
+        return resp.json() if resp.status_code == 200 else None
+
+    def live_chunkservers(self) -> List[str]:
+        return list(self.get("/chunkserver_status") or {})
+
+    def wait_until(self, condition, timeout: float, what: str, interval: float = 0.05) -> float:
+        """
+        Polls `condition` until it holds and returns the seconds that took.
+        """
+        started = time.perf_counter()
+        while not condition():
+            if time.perf_counter() - started > timeout:
+                raise TimeoutError(f"Timed out after {timeout:g}s waiting for {what}, logs are in {self.workdir}")
+            if self.master is not None and self.master.poll() is not None:
+                raise RuntimeError(f"The master exited with {self.master.returncode}, see {self.workdir}/master.log")
+            time.sleep(interval)
+        return time.perf_counter() - started
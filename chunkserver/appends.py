@@ -0,0 +1,52 @@
+import asyncio
+import time
+
+from checksum import ChunkChecksums
+
+
+class AppendChunk:
+    """
+    Record append state of one chunk on a replica. On the primary, appends from all
+    clients queue up in `pending` and are written in batches: one task per chunk
+    drains the queue, so records get consecutive offsets and each batch costs one
+    local write and one request per secondary.
+    """
+
+    def __init__(self, version: int | None, chunk_size: int, size: int, checksums: ChunkChecksums):
+        self.version = version
+        self.chunk_size = chunk_size
+        self.size = size  # Bytes written so far, the next record goes here
+        self.checksums = checksums  # Open (unfinished) checksums of the bytes written so far
+        self.sealed = size >= chunk_size  # Padded to the full chunk size, takes no more records
+        self.lease_expires = 0.0  # Monotonic time this replica stops being primary
+        self.secondaries: list[str] = []  # "<chunk_id>@<address>" of the other replicas, set by the lease
+        self.pending: list[tuple[bytes | None, asyncio.Future]] = []  # Queued records, None asks to seal
+        self.draining = False
+
+    def has_lease(self) -> bool:
+        return time.monotonic() < self.lease_expires
+
+    def max_record(self) -> int:
+        # Bounds the padding a full chunk wastes, like GFS
+        return self.chunk_size // 4
+
+    def assign(self, batch: list[tuple[bytes | None, asyncio.Future]]) -> tuple[list[int | None], bytes, bool]:
+        """
+        Gives the queued records their offsets in queue order. The first record that
+        does not fit, or a seal request, seals the chunk: it and every record after it
+        get None and have to go to the next chunk. Returns the offsets, the bytes to
+        write at the current size and whether the chunk gets sealed.
+        """
+        offsets: list[int | None] = []
+        records = []
+        position = self.size
+        seal = self.sealed
+        for data, _ in batch:
+            if seal or data is None or position + len(data) > self.chunk_size:
+                seal = True
+                offsets.append(None)
+                continue
+            records.append(data)
+            offsets.append(position)
+            position += len(data)
+        return offsets, b"".join(records), seal
@@ -0,0 +1,128 @@
+import struct
+import zlib
+from array import array
+
+try:
+    from crc32c import crc32c
+except ImportError:  # New chunks fall back to zlib's CRC-32
+    crc32c = None
+
+BLOCK_SIZE = 64 * 1024  # Bytes covered by one checksum
+
+
+# Algorithm id stored in the checksum file -> crc(data, previous value). CRC32C is only
+# available with the native crc32c package, a pure Python one would stall every read.
+ALGORITHMS = {0: zlib.crc32}
+if crc32c is not None:
+    ALGORITHMS[1] = crc32c
+ALGORITHM_NAMES = {0: "CRC-32", 1: "CRC32C"}
+DEFAULT_ALGORITHM = 1 if crc32c is not None else 0
+
+HEADER = struct.Struct("<4sBQ")  # magic, algorithm id, chunk size
+MAGIC = b"GFSC"
+
+
+class ChecksumError(Exception):
+    pass
+
+
+class UnsupportedChecksum(ChecksumError):
+    """
+    The checksum file is fine, but this server lacks the library for its algorithm.
+    """
+
+
+class ChunkChecksums:
+    """
+    Per-block checksums of one chunk. Built incrementally while the chunk is
+    streamed in, so writes need no second pass over the data.
+    """
+
+    def __init__(self, algorithm: int = DEFAULT_ALGORITHM):
+        self.algorithm = algorithm
+        self.crc = ALGORITHMS[algorithm]
+        self.crcs = array("I")
+        self.size = 0
+        self.partial = 0  # Running checksum of the unfinished last block
+        self.partial_length = 0
+
+    # -------- Building --------
+
+    def update(self, data: bytes):
+        view = memoryview(data)
+        while view:
+            take = min(len(view), BLOCK_SIZE - self.partial_length)
+            self.partial = self.crc(view[:take], self.partial)
+            self.partial_length += take
+            self.size += take
+            view = view[take:]
+            if self.partial_length == BLOCK_SIZE:
+                self.crcs.append(self.partial)
+                self.partial = self.partial_length = 0
+
+    def finish(self) -> "ChunkChecksums":
+        if self.partial_length:
+            self.crcs.append(self.partial)
+            self.partial = self.partial_length = 0
+        return self
+
+    def copy(self) -> "ChunkChecksums":
+        checksums = ChunkChecksums(self.algorithm)
+        checksums.crcs = array("I", self.crcs)
+        checksums.size = self.size
+        checksums.partial = self.partial
+        checksums.partial_length = self.partial_length
+        return checksums
+
+    def reopen(self, tail: bytes):
+        """
+        Continues a finished chunk, e.g. to append to it. `tail` is the chunk's
+        unfinished last block, empty if the chunk ends on a block boundary.
+        """
+        if self.size % BLOCK_SIZE:
+            self.crcs.pop()
+            self.partial = self.crc(tail)
+            self.partial_length = len(tail)
+
+    @classmethod
+    def of(cls, data: bytes) -> "ChunkChecksums":
+        checksums = cls()
+        checksums.update(data)
+        return checksums.finish()
+
+    # -------- Verifying --------
+
+    def verify(self, data: bytes, first_block: int):
+        """
+        Checks `data`, which starts at block `first_block` and ends on a block
+        boundary or at the end of the chunk. Raises ChecksumError on a mismatch.
+        """
+        view = memoryview(data)
+        for index in range(first_block, first_block + -(-len(data) // BLOCK_SIZE)):
+            start = (index - first_block) * BLOCK_SIZE
+            block = view[start:start + BLOCK_SIZE]
+            if index >= len(self.crcs) or self.crc(block) != self.crcs[index]:
+                raise ChecksumError(f"checksum mismatch in block {index}")
+
+    # -------- Storage --------
+
+    def to_bytes(self) -> bytes:
+        return HEADER.pack(MAGIC, self.algorithm, self.size) + self.crcs.tobytes()
+
+    @classmethod
+    def from_bytes(cls, raw: bytes) -> "ChunkChecksums":
+        if len(raw) < HEADER.size:
+            raise ChecksumError("truncated chunk checksum file")
+        magic, algorithm, size = HEADER.unpack_from(raw)
+        if magic != MAGIC or algorithm not in ALGORITHM_NAMES:
+            raise ChecksumError("not a chunk checksum file")
+        if algorithm not in ALGORITHMS:
+            raise UnsupportedChecksum(f"checksummed with {ALGORITHM_NAMES[algorithm]}, install the crc32c package to verify it")
+        checksums = cls(algorithm)
+        checksums.size = size
+        if (len(raw) - HEADER.size) % checksums.crcs.itemsize:
+            raise ChecksumError("truncated chunk checksum file")
+        checksums.crcs.frombytes(raw[HEADER.size:])
+        if len(checksums.crcs) != -(-size // BLOCK_SIZE):
+            raise ChecksumError("truncated chunk checksum file")
+        return checksums
@@ -0,0 +1,77 @@
+from collections import OrderedDict
+
+DEFAULT_MAX_ENTRY_BYTES = 4 * 1024 * 1024
+
+
+class ChunkCache:
+    """
+    Byte-bounded LRU cache of whole chunk contents, keyed by chunk id.
+
+    Chunks larger than `max_entry_bytes` (by default 4 MiB or a quarter of the
+    capacity, whichever is less) are never cached, so big chunks cannot flush
+    the rest of the cache. The chunkserver runs on one event loop and touches
+    the cache without awaiting in between, so it needs no lock. Fills that read
+    the disk in between pass the `generation` they started at, and are dropped
+    if any chunk was invalidated meanwhile.
+    """
+
+    def __init__(self, capacity_bytes: int, max_entry_bytes: int | None = None):
+        self.capacity_bytes = capacity_bytes
+        if max_entry_bytes is None:
+            max_entry_bytes = min(DEFAULT_MAX_ENTRY_BYTES, capacity_bytes // 4)
+        self.max_entry_bytes = max_entry_bytes
+        self.entries: OrderedDict[int, bytes] = OrderedDict()  # Least recently used first
+        self.used_bytes = 0
+        self.generation = 0  # Bumped by every invalidation
+
+        # Metrics
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def admits(self, size: int) -> bool:
+        return 0 < size <= min(self.max_entry_bytes, self.capacity_bytes)
+
+    def get(self, chunk_id: int) -> bytes | None:
+        data = self.entries.get(chunk_id)
+        if data is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(chunk_id)
+        self.hits += 1
+        return data
+
+    def put(self, chunk_id: int, data: bytes, generation: int | None = None):
+        if not self.admits(len(data)) or (generation is not None and generation != self.generation):
+            return
+        self.invalidate(chunk_id, count=False)
+        while self.entries and self.used_bytes + len(data) > self.capacity_bytes:
+            _, evicted = self.entries.popitem(last=False)
+            self.used_bytes -= len(evicted)
+            self.evictions += 1
+        self.entries[chunk_id] = data
+        self.used_bytes += len(data)
+
+    def invalidate(self, chunk_id: int, count: bool = True):
+        if count:
+            self.generation += 1
+        data = self.entries.pop(chunk_id, None)
+        if data is not None:
+            self.used_bytes -= len(data)
+            if count:
+                self.invalidations += 1
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else None,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+            "entries": len(self.entries),
+            "used_bytes": self.used_bytes,
+            "capacity_bytes": self.capacity_bytes,
+            "max_entry_bytes": self.max_entry_bytes,
+        }
@@ -1,21 +1,97 @@
 import socket
-from fastapi import FastAPI
+from fastapi import FastAPI, HTTPException, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse, Response, StreamingResponse
 from pydantic import BaseModel
 import uvicorn
 import httpx
 import asyncio
 import os
+import shutil
+import sys
+import time
+
+# Modules shared between the services live in common/; images copy them next to this file
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "common"))
+
+from appends import AppendChunk
+from checksum import ALGORITHMS, BLOCK_SIZE, ChecksumError, ChunkChecksums, UnsupportedChecksum
+from chunk_cache import ChunkCache
+from erasure import ReedSolomon
+from manifest import ChunkManifest
+from metrics import Registry, RequestMetrics, StackSampler
 
 class ChunkPayload(BaseModel):
     chunk_id: int
     data: str
 
+class DeleteChunksRequest(BaseModel):
+    chunk_ids: list[int]
+
+class ReplicateChunkRequest(BaseModel):
+    chunk_id: int  # Id to store the copy under
+    source_chunkserver_id: str
+    source_chunk_id: int
+    expected_size: int | None = None  # Bytes the copy must have, if the master knows
+    version: int | None = None  # Chunk version to store the copy with
+
+class ShardSource(BaseModel):
+    shard: int  # Index of the shard in its stripe
+    chunkserver_id: str
+    chunk_id: int
+
+class ReconstructChunkRequest(BaseModel):
+    chunk_id: int  # Id to store the rebuilt shard under
+    shard: int  # Index of the shard to rebuild
+    data_shards: int
+    parity_shards: int
+    shard_size: int  # Bytes of the stripe's longest shard, shorter ones count as zero-padded to it
+    expected_size: int  # Bytes of the rebuilt shard
+    empty_shards: list[int] = []  # Data shards past the end of the file, known to be all zeros
+    sources: list[ShardSource]  # Surviving shards of the stripe, data shards first
+    version: int | None = None
+
+class EncodeStripeRequest(BaseModel):
+    data: list[list[str]]  # Replicas of each data shard as "<chunk_id>@<address>", none past the end of the file
+    parity: list[str]  # Where each parity shard goes, "<chunk_id>@<address>"
+    shard_size: int  # Bytes of the stripe's longest data shard
+    version: int | None = None
+
+class GrantLeaseRequest(BaseModel):
+    chunk_id: int
+    version: int | None = None
+    chunk_size: int
+    lease_seconds: float
+    secondaries: list[str]  # "<chunk_id>@<address>" of the other replicas
+
+class SealChunkRequest(BaseModel):
+    version: int | None = None
+    chunk_size: int
+    secondaries: list[str]  # "<chunk_id>@<address>" of the other live replicas
+
+class RequestCounter:
+    """
+    ASGI middleware counting the requests a chunkserver is serving, reported as load.
+    """
+    def __init__(self, app, server: "ChunkServer"):
+        self.app = app
+        self.server = server
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        self.server.inflight_requests += 1
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.server.inflight_requests -= 1
+
 class ChunkServer:
-    def __init__(self, master_url: str = "http://master:8000"):
+    def __init__(self, master_url: str | None = None):
         self.master_url = master_url or os.getenv("MASTER_URL", "http://master:8000")
         self.host = "0.0.0.0"
-        self.port = 8000  # internal container port
+        self.port = int(os.getenv("PORT", "8000"))  # internal container port
 
         self.external_host = os.getenv("EXTERNAL_HOST", "localhost")
         self.external_port = os.getenv("EXTERNAL_PORT", "8000")  # default fallback
@@ -24,9 +100,61 @@ class ChunkServer:
         self.id = chunkserver_id
         self.address = f"http://{self.external_host}:{self.external_port}" 
 
-        self.master_url = master_url
         self.stored_chunks = set()
-        self.heartbeat_interval = 10  # seconds
+        self.manifest: ChunkManifest | None = None  # Record of stored chunks that survives restarts, see load_chunks()
+        self.chunk_versions: dict[int, int] = {}  # Version each chunk was written with, reads for another version are stale
+        self.checksums: dict[int, ChunkChecksums | None] = {}  # Per-block checksums of each chunk, also stored next to it on disk
+        self.corrupt_chunks: set[int] = set()  # Chunks that failed verification, reported to the master until deleted
+        self.unverifiable: set[int] = set()  # Chunks whose checksum algorithm this server cannot compute, never served
+        self.heartbeat_interval = float(os.getenv("HEARTBEAT_INTERVAL", "5"))  # seconds, keep well below the master's HEARTBEAT_TIMEOUT
+        # Chunk changes not yet acknowledged by the master, sent with the next heartbeat
+        self.added_chunks: dict[int, int] = {}  # chunk_id -> version of chunks committed since
+        self.removed_chunks: set[int] = set()  # Chunks lost from disk without the master deleting them
+        self.appended_sizes: dict[int, int] = {}  # chunk_id -> length of chunks that grew by record appends since
+        self.reported_corrupt: set[int] = set()  # Corrupt chunks the master already acknowledged
+        # Load stats
+        self.inflight_requests = 0
+        self.bytes_read = 0
+        self.bytes_written = 0
+        self.load_sample = (time.monotonic(), 0, 0)  # (time, bytes_read, bytes_written) at the last heartbeat
+        self.chunk_dir = os.path.join("chunks", self.id.replace(":", "_").replace("/", "_"))
+        self.io_block_size = 256 * 1024  # bytes per read/write when streaming chunk data
+        self.capacity = int(os.getenv("CHUNKSERVER_CAPACITY", "0")) or None  # optional cap on chunk bytes, defaults to the disk size
+        self.used_bytes = 0  # bytes taken by stored chunks
+        # Addresses clients use for other chunkservers may not be reachable from here (e.g. inside
+        # Docker), PEER_ADDRESSES maps them: "http://localhost:8002=http://chunkserver2:8000,..."
+        self.peer_addresses = dict(
+            pair.split("=", 1) for pair in os.getenv("PEER_ADDRESSES", "").split(",") if "=" in pair
+        )
+        # Failure domains the master spreads replicas over: "rack=r1,zone=z1"
+        self.labels = dict(
+            pair.split("=", 1) for pair in os.getenv("CHUNKSERVER_LABELS", "").split(",") if "=" in pair
+        )
+        self.forward_queue_size = 8  # blocks buffered per downstream replica before backpressure
+        self.http_client: httpx.AsyncClient | None = None  # shared client for chunkserver-to-chunkserver traffic
+        self.copy_tasks: set[asyncio.Task] = set()  # running copies requested by the master
+        self.appends: dict[int, AppendChunk] = {}  # Record append state of chunks appended to since startup
+        self.append_tasks: set[asyncio.Task] = set()  # Running batch writers, one per chunk with queued records
+        # Hot chunk contents kept in memory, 0 disables the cache
+        max_entry_bytes = os.getenv("CHUNK_CACHE_MAX_ENTRY_BYTES")
+        self.cache = ChunkCache(int(os.getenv("CHUNK_CACHE_BYTES", str(256 * 1024 * 1024))),
+                                int(max_entry_bytes) if max_entry_bytes else None)
+        self.scrub_rate = int(os.getenv("SCRUB_BYTES_PER_SECOND", str(8 * 1024 * 1024)))  # disk read budget of the scrubber, 0 disables it
+        self.scrub_interval = float(os.getenv("SCRUB_INTERVAL_SECONDS", "3600"))  # pause between scrubber passes
+        self.scrub_stats = {
+            "passes": 0,
+            "last_pass_seconds": None,
+            "scrubbed_chunks": 0,
+            "scrubbed_bytes": 0,
+            "corrupt_found": 0,  # By the scrubber and by reads
+        }
+        self.loop: asyncio.AbstractEventLoop | None = None
+        self.report_now: asyncio.Event | None = None  # Cuts the heartbeat wait short to report corruption
+        self.last_heartbeat_ack: float | None = None  # Monotonic time the master last acknowledged a heartbeat
+        self.metrics = Registry()  # Served on GET /metrics
+        self.init_metrics()
+        # Opt-in sampling profiler, stacks are only sampled while GET /debug/profile runs
+        self.profiler = StackSampler() if os.getenv("PROFILER_ENABLED", "") in ("1", "true") else None
 
         self.app = FastAPI()
 
@@ -37,17 +165,19 @@ class ChunkServer:
             allow_methods=["*"],
             allow_headers=["*"],
         )
+        self.app.add_middleware(RequestCounter, server=self)
+        self.app.add_middleware(RequestMetrics, histogram=self.request_seconds)
 
         @self.app.post("/write_chunk")
         async def write_chunk(chunk: ChunkPayload):
-            dir_path = os.path.join("chunks", self.id.replace(":", "_").replace("/", "_"))
-            os.makedirs(dir_path, exist_ok=True)
+            os.makedirs(self.chunk_dir, exist_ok=True)
 
-            file_path = os.path.join(dir_path, f"{chunk.chunk_id}.chunk")
-            with open(file_path, "w") as f:
-                f.write(chunk.data)
+            data = chunk.data.encode()
+            tmp_path = self.chunk_path(chunk.chunk_id) + ".tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(data)
 
-            self.stored_chunks.add(chunk.chunk_id)
+            self.commit_chunk(chunk.chunk_id, tmp_path, len(data), checksums=ChunkChecksums.of(data))
             return {"status": "success", "address": self.address}
 
         @self.app.get("/read_chunk/{chunk_id}")
@@ -55,32 +185,942 @@ class ChunkServer:
             if chunk_id not in self.stored_chunks:
                 return {"status": "error", "message": "Chunk not found"}
 
-            dir_path = os.path.join("chunks", self.id.replace(":", "_").replace("/", "_"))
-            file_path = os.path.join(dir_path, f"{chunk_id}.chunk")
-            with open(file_path, "r") as f:
-                data = f.read()
+            file_path = self.chunk_path(chunk_id)
+            size = self.checked_size(chunk_id, file_path)
+            data = await self.cached_chunk(chunk_id, file_path, size)
+            if data is None:
+                data = await asyncio.to_thread(self.read_verified, chunk_id, file_path, 0, size, size)
+            self.bytes_read += len(data)
+
+            return {"status": "success", "data": data.decode()}
+
+        @self.app.post("/write_chunk_binary/{chunk_id}")
+        async def write_chunk_binary(chunk_id: int, request: Request, forward: list[str] = Query(default=[]),
+                                     version: int | None = None):
+            """
+            Stores the raw request body as the chunk, streaming it to disk.
+
+            `forward` is the rest of the replica chain as "<chunk_id>@<address>" entries.
+            Incoming blocks are passed on to the first of them while they are written
+            locally, and the write only succeeds once every downstream replica has acked.
+            `version` is the chunk version from the master's file layout.
+            Block checksums are computed as the data streams through.
+            """
+            os.makedirs(self.chunk_dir, exist_ok=True)
+            file_path = self.chunk_path(chunk_id)
+            tmp_path = file_path + ".tmp"
+            size = 0
+            checksums = ChunkChecksums()
+
+            downstream = None
+            if forward:
+                queue: asyncio.Queue = asyncio.Queue(maxsize=self.forward_queue_size)
+                downstream = asyncio.create_task(self.forward_chunk(forward, queue, version))
+
+            try:
+                with open(tmp_path, "wb") as f:
+                    async for block in request.stream():
+                        if not block:
+                            continue
+                        if downstream is not None:
+                            await self.put_block(queue, downstream, block)
+                        with self.disk_seconds.timer("write"):
+                            f.write(block)
+                        checksums.update(block)
+                        size += len(block)
+                if downstream is not None:
+                    await self.put_block(queue, downstream, None)
+                    replicas = await downstream
+                else:
+                    replicas = []
+            except Exception as e:
+                if downstream is not None:
+                    downstream.cancel()
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                if isinstance(e, HTTPException):
+                    raise
+                raise HTTPException(status_code=502, detail=f"Replica chain failed: {e}")
+
+            self.commit_chunk(chunk_id, tmp_path, size, version, checksums.finish())
+            return {"status": "success", "address": self.address, "size": size, "replicas": [self.address] + replicas}
+
+        @self.app.get("/read_chunk_binary/{chunk_id}")
+        async def read_chunk_binary(chunk_id: int, offset: int = 0, length: int | None = None, version: int | None = None):
+            """
+            Serves the raw chunk bytes, or only `length` bytes from `offset`.
+            Cached chunks are served from memory, and whole reads of chunks small
+            enough for the cache fill it; ranges of chunks not in the cache are read
+            from disk on their own and streamed. Every block read from disk is checked against its
+            checksum first; a corrupt chunk gets a 500 so the client tries another
+            replica, and is reported to the master. A `version` other than the stored
+            one means the caller's cached location is stale and gets a 409.
+            """
+            if chunk_id not in self.stored_chunks:
+                raise HTTPException(status_code=404, detail="Chunk not found")
+            stored_version = self.chunk_versions.get(chunk_id)
+            if version and stored_version and version != stored_version:
+                raise HTTPException(status_code=409, detail=f"Stale chunk version {version}, chunk has version {stored_version}")
+
+            file_path = self.chunk_path(chunk_id)
+            size = self.checked_size(chunk_id, file_path)
+            if offset < 0 or offset > size or (length is not None and length < 0):
+                raise HTTPException(status_code=416, detail="Requested range not satisfiable")
+            end = size if length is None else min(size, offset + length)
+            self.bytes_read += end - offset
 
-            return {"status": "success", "data": data}
+            data = None
+            if offset == 0 and end == size:
+                data = await self.cached_chunk(chunk_id, file_path, size)
+            elif self.cache.admits(size):
+                data = self.cache.get(chunk_id)
+            if data is not None:
+                return Response(data[offset:end], media_type="application/octet-stream")
+            if end - offset <= self.io_block_size:
+                # Small reads are cheaper as a single pread than as a file stream
+                data = await asyncio.to_thread(self.read_verified, chunk_id, file_path, offset, end, size)
+                return Response(data, media_type="application/octet-stream")
 
-        @self.app.post("/replicate_chunk")
-        async def replicate_chunk(source_chunkserver_id: str, source_chunk_id: int, target_chunk_id: int):
+            return StreamingResponse(
+                self.iter_chunk(chunk_id, file_path, offset, end),
+                media_type="application/octet-stream",
+                headers={"Content-Length": str(end - offset)},
+            )
+
+        @self.app.post("/delete_chunks")
+        async def delete_chunks(req: DeleteChunksRequest):
+            """
+            Deletes the given chunks from disk. Unknown ids are ignored, so deletes can be retried.
+            """
+            freed_bytes = 0
+            for chunk_id in req.chunk_ids:
+                freed_bytes += self.delete_chunk(chunk_id)
+            return {"status": "success", "freed_bytes": freed_bytes}
+
+        @self.app.post("/replicate_chunk", status_code=202)
+        async def replicate_chunk(req: ReplicateChunkRequest):
+            """
+            Starts pulling a chunk from another chunkserver and returns right away.
+            The outcome is reported to the master's /replication_complete.
+            """
+            task = asyncio.create_task(self.copy_from_peer(req))
+            self.copy_tasks.add(task)
+            task.add_done_callback(self.copy_tasks.discard)
+            return {"status": "accepted"}
+
+        @self.app.post("/reconstruct_chunk", status_code=202)
+        async def reconstruct_chunk(req: ReconstructChunkRequest):
+            """
+            Starts rebuilding a lost erasure coded shard from the surviving shards of its
+            stripe and returns right away. Reported to the master like a copy.
+            """
+            task = asyncio.create_task(self.rebuild_shard(req))
+            self.copy_tasks.add(task)
+            task.add_done_callback(self.copy_tasks.discard)
+            return {"status": "accepted"}
+
+        @self.app.post("/encode_stripe")
+        async def encode_stripe(req: EncodeStripeRequest):
+            """
+            Reads the data shards of a stripe from their replicas, computes the parity
+            shards and stores them on their targets. Answers once every parity shard is stored.
+            """
+            try:
+                await self.encode_stripe(req)
+            except Exception as e:
+                raise HTTPException(status_code=502, detail=f"Encoding failed: {e}")
+            return {"status": "success", "parity_size": req.shard_size}
+
+        @self.app.post("/grant_lease")
+        async def grant_lease(req: GrantLeaseRequest):
+            """
+            Makes this replica the primary of a chunk for `lease_seconds`: it orders the
+            record appends to the chunk and forwards them to the secondaries.
+            """
+            state = self.append_state(req.chunk_id, req.version, req.chunk_size)
+            state.secondaries = req.secondaries
+            state.lease_expires = time.monotonic() + req.lease_seconds
+            return {"status": "success", "size": state.size, "sealed": state.sealed}
+
+        @self.app.post("/append_record/{chunk_id}")
+        async def append_record(chunk_id: int, request: Request):
+            """
+            Appends the request body as one record at an offset this primary picks, and
+            answers once every replica wrote it. "chunk_full" means the record does not
+            fit and has to go to the file's next chunk.
+            """
+            data = await request.body()
+            state = self.appends.get(chunk_id)
+            if state is None or not state.has_lease():
+                raise HTTPException(status_code=410, detail="No lease on this chunk")
+            if not data or len(data) > state.max_record():
+                raise HTTPException(status_code=413, detail=f"Records must have 1 to {state.max_record()} bytes")
+            try:
+                offset = await self.enqueue_append(chunk_id, state, data)
+            except Exception as e:
+                raise HTTPException(status_code=502, detail=f"Append failed: {e}")
+            if offset is None:
+                return {"status": "chunk_full"}
+            return {"status": "success", "offset": offset}
+
+        @self.app.post("/seal_chunk/{chunk_id}")
+        async def seal_chunk(chunk_id: int, req: SealChunkRequest):
+            """
+            Pads this replica and the given secondaries to the full chunk size, after the
+            appends already queued here. Returns the replicas that are sealed now.
+            """
+            state = self.append_state(chunk_id, req.version, req.chunk_size)
+            state.secondaries = req.secondaries
+            state.lease_expires = 0.0
             try:
-                async with httpx.AsyncClient() as client:
-                    resp = await client.get(f"{source_chunkserver_id}/read_chunk/{source_chunk_id}")
-                    if resp.status_code != 200 or resp.json().get("status") != "success":
-                        return {"status": "error", "message": "Failed to fetch chunk from source"}
-                    data = resp.json()["data"]
+                replicas = await self.enqueue_append(chunk_id, state, None)
             except Exception as e:
-                return {"status": "error", "message": f"Error contacting source chunkserver: {e}"}
+                raise HTTPException(status_code=502, detail=f"Sealing failed: {e}")
+            return {"status": "success", "replicas": replicas}
+
+        @self.app.post("/append_batch/{chunk_id}")
+        async def append_batch(chunk_id: int, request: Request, offset: int, chunk_size: int,
+                               version: int | None = None, seal: bool = False):
+            """
+            Writes a batch of records the primary placed at `offset`, then pads the chunk
+            to `chunk_size` if `seal`.
+            """
+            data = await request.body()
+            state = self.append_state(chunk_id, version, chunk_size)
+            if not seal and (state.sealed or state.has_lease()):
+                # Only the primary orders appends, a sealed chunk takes none
+                raise HTTPException(status_code=409, detail="Chunk is sealed or has another primary")
+            self.write_appended(chunk_id, state, offset, data, seal)
+            return {"status": "success", "size": state.size}
+
+        @self.app.get("/metrics")
+        def metrics():
+            return PlainTextResponse(self.metrics.render(), media_type="text/plain; version=0.0.4")
+
+        @self.app.get("/debug/profile")
+        def profile(seconds: float = 10.0, interval: float = 0.005, limit: int = 200, idle: bool = False):
+            """
+            Samples every thread's stack for `seconds` and returns the hottest ones in
+            collapsed (flame graph) format, waiting threads only with `idle`. Only with PROFILER_ENABLED=1.
+            """
+            if self.profiler is None:
+                raise HTTPException(status_code=404, detail="Profiling is off, start the chunkserver with PROFILER_ENABLED=1")
+            if not 0 < seconds <= 300 or not 0.001 <= interval <= 1:
+                raise HTTPException(status_code=400, detail="seconds must be in (0, 300], interval in [0.001, 1]")
+            try:
+                return PlainTextResponse(self.profiler.profile(seconds, interval, limit, idle))
+            except RuntimeError as e:
+                raise HTTPException(status_code=409, detail=str(e))
+
+        @self.app.get("/stats")
+        async def stats():
+            return {
+                "chunkserver_id": self.address,
+                "stored_chunks": len(self.stored_chunks),
+                "corrupt_chunks": len(self.corrupt_chunks),
+                "unverifiable_chunks": len(self.unverifiable),  # Checksummed with an algorithm this server lacks
+                **self.disk_report(),
+                "cache": self.cache.stats(),
+                "scrubber": self.scrub_stats,
+            }
+
+    def init_metrics(self):
+        """
+        Histograms are updated where the work happens, everything else is read from the
+        chunkserver's counters when the metrics are scraped.
+        """
+        metrics = self.metrics
+        self.request_seconds = metrics.histogram(
+            "gfs_chunkserver_request_seconds", "Latency of API requests, streamed responses until the last byte.",
+            ("method", "endpoint", "status"))
+        self.disk_seconds = metrics.histogram(
+            "gfs_chunkserver_disk_seconds", "Time of single disk operations: block reads, block writes, chunk commits.",
+            ("op",), buckets=(0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.5, 1.0))
+        self.heartbeat_seconds = metrics.histogram(
+            "gfs_chunkserver_heartbeat_seconds", "Round trip time of heartbeats to the master.")
+
+        metrics.counter("gfs_chunkserver_read_bytes_total", "Chunk bytes served to readers.", fn=lambda: self.bytes_read)
+        metrics.counter("gfs_chunkserver_written_bytes_total", "Chunk bytes written.", fn=lambda: self.bytes_written)
+        metrics.gauge("gfs_chunkserver_heartbeat_age_seconds", "Seconds since the master last acknowledged a heartbeat.",
+                      fn=lambda: time.monotonic() - self.last_heartbeat_ack if self.last_heartbeat_ack is not None else float("nan"))
+        metrics.gauge("gfs_chunkserver_inflight_requests", "Requests being served.", fn=lambda: self.inflight_requests)
+        metrics.gauge("gfs_chunkserver_copy_queue", "Copies the master requested that are still running.",
+                      fn=lambda: len(self.copy_tasks))
+        metrics.gauge("gfs_chunkserver_stored_chunks", "Chunks on disk.", fn=lambda: len(self.stored_chunks))
+        metrics.gauge("gfs_chunkserver_corrupt_chunks", "Chunks that failed verification.", fn=lambda: len(self.corrupt_chunks))
+        metrics.gauge("gfs_chunkserver_used_bytes", "Bytes taken by stored chunks.", fn=lambda: self.used_bytes)
+        metrics.counter("gfs_chunkserver_cache_hits_total", "Reads served from the chunk cache.", fn=lambda: self.cache.hits)
+        metrics.counter("gfs_chunkserver_cache_misses_total", "Cacheable reads that went to disk.", fn=lambda: self.cache.misses)
+        metrics.counter("gfs_chunkserver_scrubbed_bytes_total", "Bytes the scrubber verified.",
+                        fn=lambda: self.scrub_stats["scrubbed_bytes"])
+
+    def client(self) -> httpx.AsyncClient:
+        if self.http_client is None:
+            self.http_client = httpx.AsyncClient(timeout=httpx.Timeout(60.0, connect=5.0))
+        return self.http_client
+
+    def peer_url(self, address: str) -> str:
+        return self.peer_addresses.get(address, address)
+
+    async def put_block(self, queue: asyncio.Queue, downstream: asyncio.Task, block: bytes | None):
+        """
+        Hands a block to the forwarding task, failing fast if the downstream replica already failed.
+        """
+        put = asyncio.ensure_future(queue.put(block))
+        done, _ = await asyncio.wait({put, downstream}, return_when=asyncio.FIRST_COMPLETED)
+        if put not in done:
+            put.cancel()
+            downstream.result()  # Raises the downstream error
+            raise Exception("Downstream replica closed the stream early")
+
+    async def forward_chunk(self, chain: list[str], queue: asyncio.Queue, version: int | None = None) -> list[str]:
+        """
+        Streams the blocks put on `queue` (None ends the stream) to the next replica in
+        `chain`, which forwards them along the rest. Returns the addresses that acked.
+        """
+        next_chunk_id, next_address = chain[0].split("@", 1)
+
+        async def blocks():
+            while True:
+                block = await queue.get()
+                if block is None:
+                    return
+                yield block
+
+        resp = await self.client().post(
+            f"{self.peer_url(next_address)}/write_chunk_binary/{int(next_chunk_id)}",
+            params=[("forward", entry) for entry in chain[1:]] + ([("version", version)] if version is not None else []),
+            content=blocks(),
+            headers={"Content-Type": "application/octet-stream"},
+        )
+        if resp.status_code != 200 or resp.json().get("status") != "success":
+            raise Exception(f"{next_address} answered {resp.status_code}: {resp.text}")
+        return resp.json()["replicas"]
+
+    async def copy_from_peer(self, req: ReplicateChunkRequest):
+        """
+        Streams a chunk from the source chunkserver to a temp file, checks its size and
+        reports to the master. The copy is only moved into place if the master accepts it.
+        """
+        os.makedirs(self.chunk_dir, exist_ok=True)
+        tmp_path = self.chunk_path(req.chunk_id) + ".copy"
+        size = 0
+        checksums = ChunkChecksums()
+        try:
+            source_url = f"{self.peer_url(req.source_chunkserver_id)}/read_chunk_binary/{req.source_chunk_id}"
+            async with self.client().stream("GET", source_url) as resp:
+                if resp.status_code != 200:
+                    raise Exception(f"source answered {resp.status_code}")
+                with open(tmp_path, "wb") as f:
+                    async for block in resp.aiter_bytes(self.io_block_size):
+                        with self.disk_seconds.timer("write"):
+                            f.write(block)
+                        checksums.update(block)
+                        size += len(block)
+                content_length = resp.headers.get("Content-Length")
+            if content_length is not None and int(content_length) != size:
+                raise Exception(f"received {size} of {content_length} bytes")
+            if req.expected_size is not None and req.expected_size != size:
+                raise Exception(f"copy has {size} bytes, expected {req.expected_size}")
+            report = {"status": "success", "size": size}
+        except Exception as e:
+            print(f"❌ Copy of chunk {req.source_chunk_id} from {req.source_chunkserver_id} failed: {e}")
+            report = {"status": "error", "message": str(e)}
 
-            dir_path = os.path.join("chunks", self.id.replace(":", "_").replace("/", "_"))
-            os.makedirs(dir_path, exist_ok=True)
-            file_path = os.path.join(dir_path, f"{target_chunk_id}.chunk")
-            with open(file_path, "w") as f:
+        await self.report_copy(req.chunk_id, tmp_path, size, req.version, checksums, report)
+
+    async def report_copy(self, chunk_id: int, tmp_path: str, size: int, version: int | None,
+                          checksums: ChunkChecksums, report: dict):
+        """
+        Tells the master how a copy went and moves it into place if the master accepts it.
+        """
+        try:
+            resp = await self.client().post(
+                f"{self.master_url}/replication_complete",
+                json={"chunkserver_id": self.address, "chunk_id": chunk_id, **report},
+            )
+            accepted = resp.status_code == 200 and resp.json().get("status") == "accepted"
+        except Exception as e:
+            print(f"❌ Could not report copy of chunk {chunk_id} to master: {e}")
+            accepted = False
+
+        if report["status"] == "success" and accepted:
+            self.commit_chunk(chunk_id, tmp_path, size, version, checksums.finish())
+        elif os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+    # -------- Erasure coding --------
+
+    async def fetch_shard(self, address: str, chunk_id: int, version: int | None) -> bytes:
+        resp = await self.client().get(f"{self.peer_url(address)}/read_chunk_binary/{chunk_id}",
+                                       params={"version": version} if version else None)
+        if resp.status_code != 200:
+            raise Exception(f"{address} answered {resp.status_code} for chunk {chunk_id}")
+        return resp.content
+
+    async def gather_shards(self, sources: list[tuple[int, str, int]], needed: int, version: int | None) -> dict[int, bytes]:
+        """
+        Reads `needed` distinct shards out of `sources` ((shard, address, chunk_id), in order of
+        preference), all at once, moving on to the next source whenever a read fails.
+        """
+        shards: dict[int, bytes] = {}
+        pending = list(sources)
+        running: dict[asyncio.Task, int] = {}
+        errors = []
+        try:
+            while len(shards) < needed:
+                wanted = {shard for shard in running.values()} | set(shards)
+                while pending and len(running) + len(shards) < needed:
+                    shard, address, chunk_id = pending.pop(0)
+                    if shard not in wanted:
+                        running[asyncio.create_task(self.fetch_shard(address, chunk_id, version))] = shard
+                        wanted.add(shard)
+                if not running:
+                    raise Exception(f"only {len(shards)} of {needed} shards readable: {'; '.join(errors)}")
+                done, _ = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    shard = running.pop(task)
+                    try:
+                        shards[shard] = task.result()
+                    except Exception as e:
+                        errors.append(str(e))
+        finally:
+            for task in running:
+                task.cancel()
+        return shards
+
+    async def store_chunk(self, target: str, data: bytes, version: int | None):
+        """
+        Stores `data` as the chunk "<chunk_id>@<address>", here or on another chunkserver.
+        """
+        chunk_id, address = target.split("@", 1)
+        if address == self.address:
+            os.makedirs(self.chunk_dir, exist_ok=True)
+            tmp_path = self.chunk_path(int(chunk_id)) + ".tmp"
+            with open(tmp_path, "wb") as f, self.disk_seconds.timer("write"):
+                f.write(data)
+            self.commit_chunk(int(chunk_id), tmp_path, len(data), version, ChunkChecksums.of(data))
+            return
+        resp = await self.client().post(
+            f"{self.peer_url(address)}/write_chunk_binary/{int(chunk_id)}",
+            params={"version": version} if version else None,
+            content=data,
+            headers={"Content-Type": "application/octet-stream"},
+        )
+        if resp.status_code != 200:
+            raise Exception(f"{address} answered {resp.status_code}: {resp.text}")
+
+    async def encode_stripe(self, req: EncodeStripeRequest):
+        codec = ReedSolomon(len(req.data), len(req.parity))
+        sources = [(shard, address, int(chunk_id))
+                   for shard, replicas in enumerate(req.data)
+                   for chunk_id, address in (replica.split("@", 1) for replica in replicas)]
+        present = sum(1 for replicas in req.data if replicas)
+        shards = await self.gather_shards(sources, present, req.version)
+        data = [shards.get(shard, b"") for shard in range(len(req.data))]
+        if len(data[0]) != req.shard_size:
+            raise Exception(f"first data shard has {len(data[0])} bytes, expected {req.shard_size}")
+        parity = await asyncio.to_thread(codec.encode, data)
+        await asyncio.gather(*(self.store_chunk(target, shard, req.version) for target, shard in zip(req.parity, parity)))
+
+    async def rebuild_shard(self, req: ReconstructChunkRequest):
+        """
+        Reads enough surviving shards, decodes the lost one into a temp file and reports
+        to the master, which only then adds it to the stripe.
+        """
+        os.makedirs(self.chunk_dir, exist_ok=True)
+        tmp_path = self.chunk_path(req.chunk_id) + ".copy"
+        checksums = ChunkChecksums()
+        size = 0
+        try:
+            codec = ReedSolomon(req.data_shards, req.parity_shards)
+            needed = req.data_shards - len(req.empty_shards)
+            sources = [(source.shard, source.chunkserver_id, source.chunk_id) for source in req.sources]
+            shards = await self.gather_shards(sources, needed, req.version)
+            shards.update((shard, b"") for shard in req.empty_shards)
+            rebuilt = await asyncio.to_thread(codec.reconstruct, shards, req.shard_size, [req.shard])
+            data = rebuilt[req.shard][:req.expected_size]
+            with open(tmp_path, "wb") as f, self.disk_seconds.timer("write"):
                 f.write(data)
+            checksums.update(data)
+            size = len(data)
+            report = {"status": "success", "size": size}
+        except Exception as e:
+            print(f"❌ Rebuilding shard {req.shard} as chunk {req.chunk_id} failed: {e}")
+            report = {"status": "error", "message": str(e)}
+        await self.report_copy(req.chunk_id, tmp_path, size, req.version, checksums, report)
+
+    # -------- Record appends --------
+
+    def append_state(self, chunk_id: int, version: int | None, chunk_size: int) -> AppendChunk:
+        """
+        Append state of a chunk, continuing the chunk on disk or starting it empty.
+        """
+        state = self.appends.get(chunk_id)
+        if state is not None:
+            return state
+        if chunk_id not in self.stored_chunks:
+            os.makedirs(self.chunk_dir, exist_ok=True)
+            tmp_path = self.chunk_path(chunk_id) + ".tmp"
+            open(tmp_path, "wb").close()
+            self.commit_chunk(chunk_id, tmp_path, 0, version, ChunkChecksums().finish())
+            size, checksums = 0, ChunkChecksums()
+        else:
+            file_path = self.chunk_path(chunk_id)
+            size = self.checked_size(chunk_id, file_path)
+            published = self.chunk_checksums(chunk_id)
+            with open(file_path, "rb") as f:
+                if published is None:
+                    # Written before checksums existed
+                    checksums = ChunkChecksums()
+                    checksums.update(f.read())
+                else:
+                    checksums = published.copy()
+                    checksums.reopen(os.pread(f.fileno(), size % BLOCK_SIZE, size - size % BLOCK_SIZE))
+        state = self.appends[chunk_id] = AppendChunk(version, chunk_size, size, checksums)
+        return state
+
+    async def enqueue_append(self, chunk_id: int, state: AppendChunk, data: bytes | None):
+        """
+        Queues a record, or None to seal the chunk, and waits until its batch is on every
+        replica. Returns the record's offset in the chunk, None if it did not fit, or for
+        a seal the addresses of the replicas that are sealed now.
+        """
+        future = asyncio.get_running_loop().create_future()
+        state.pending.append((data, future))
+        if not state.draining:
+            state.draining = True
+            task = asyncio.create_task(self.drain_appends(chunk_id, state))
+            self.append_tasks.add(task)
+            task.add_done_callback(self.append_tasks.discard)
+        return await future
+
+    async def drain_appends(self, chunk_id: int, state: AppendChunk):
+        """
+        Writes the queued records batch by batch. Records arriving while a batch is
+        being written go into the next one.
+        """
+        try:
+            while state.pending:
+                batch, state.pending = state.pending, []
+                try:
+                    results = await self.write_append_batch(chunk_id, state, batch)
+                except Exception as e:
+                    results = [e] * len(batch)
+                for (_, future), result in zip(batch, results):
+                    if future.done():
+                        continue  # The client went away
+                    if isinstance(result, Exception):
+                        future.set_exception(result)
+                    else:
+                        future.set_result(result)
+        finally:
+            state.draining = False
+
+    async def write_append_batch(self, chunk_id: int, state: AppendChunk, batch: list) -> list:
+        """
+        Lays out a batch at the end of the chunk, writes it here and on every secondary.
+        A record only succeeds if all replicas wrote it; the client retries the others,
+        so a record may end up in the file more than once, but never partially.
+        """
+        start = state.size
+        was_sealed = state.sealed
+        offsets, data, seal = state.assign(batch)
+        self.write_appended(chunk_id, state, start, data, seal)
+
+        replicas = [self.address]
+        failures = []
+        seal_requested = any(record is None for record, _ in batch)
+        if data or (seal and not was_sealed) or seal_requested:
+            secondaries = list(state.secondaries)
+            results = await asyncio.gather(*(self.forward_append(entry, state, start, data, seal) for entry in secondaries),
+                                           return_exceptions=True)
+            for entry, result in zip(secondaries, results):
+                if isinstance(result, BaseException):
+                    failures.append(f"{entry}: {result}")
+                else:
+                    replicas.append(result)
+
+        results = []
+        for (record, _), offset in zip(batch, offsets):
+            if record is None:
+                results.append(replicas)
+            elif offset is not None and failures:
+                results.append(Exception(f"Secondaries failed: {'; '.join(failures)}"))
+            else:
+                results.append(offset)
+        return results
+
+    async def forward_append(self, entry: str, state: AppendChunk, offset: int, data: bytes, seal: bool) -> str:
+        chunk_id, address = entry.split("@", 1)
+        params = {"offset": offset, "chunk_size": state.chunk_size, "seal": seal}
+        if state.version is not None:
+            params["version"] = state.version
+        resp = await self.client().post(
+            f"{self.peer_url(address)}/append_batch/{int(chunk_id)}",
+            params=params,
+            content=data,
+            headers={"Content-Type": "application/octet-stream"},
+        )
+        if resp.status_code != 200:
+            raise Exception(f"{address} answered {resp.status_code}: {resp.text}")
+        return address
+
+    def write_appended(self, chunk_id: int, state: AppendChunk, offset: int, data: bytes, seal: bool):
+        """
+        Writes appended bytes at `offset` and pads the chunk to its full size if `seal`.
+        A replica that missed earlier batches fills the gap with zeros; one that kept a
+        batch the others lost is cut back first, nobody was told that batch succeeded.
+        The manifest learns the chunk's size once it is sealed.
+        """
+        if state.sealed:
+            return
+        if chunk_id not in self.stored_chunks:
+            raise Exception(f"Chunk {chunk_id} is not stored here")
+        file_path = self.chunk_path(chunk_id)
+        old_size = state.size
+        if offset < state.size:
+            with open(file_path, "rb") as f:
+                prefix = os.pread(f.fileno(), offset, 0)
+            os.truncate(file_path, offset)
+            state.checksums = ChunkChecksums()
+            state.checksums.update(prefix)
+            state.size = offset
+        elif offset > state.size:
+            data = bytes(offset - state.size) + data
+            offset = state.size
+        if seal:
+            data += bytes(max(0, state.chunk_size - offset - len(data)))
+
+        if data:
+            fd = os.open(file_path, os.O_WRONLY)
+            try:
+                with self.disk_seconds.timer("write"):
+                    os.pwrite(fd, data, offset)
+            finally:
+                os.close(fd)
+            state.checksums.update(data)
+            state.size = offset + len(data)
+        state.sealed = seal
+
+        # Readers verify against the published copy, which is replaced, never changed
+        checksums = state.checksums.copy().finish()
+        tmp_path = self.checksum_path(chunk_id) + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(checksums.to_bytes())
+        os.replace(tmp_path, self.checksum_path(chunk_id))
+        self.checksums[chunk_id] = checksums
+        self.cache.invalidate(chunk_id)
+        self.used_bytes += state.size - old_size
+        self.bytes_written += len(data)
+        self.appended_sizes[chunk_id] = state.size
+        if seal and self.manifest is not None:
+            self.manifest.add(chunk_id, state.size, state.version)
+
+    def chunk_path(self, chunk_id: int) -> str:
+        return os.path.join(self.chunk_dir, f"{chunk_id}.chunk")
 
-            self.stored_chunks.add(target_chunk_id)
-            return {"status": "success", "message": f"Chunk {source_chunk_id} replicated as {target_chunk_id}"}
+    def checksum_path(self, chunk_id: int) -> str:
+        return self.chunk_path(chunk_id) + ".crc"
+
+    async def cached_chunk(self, chunk_id: int, file_path: str, size: int) -> bytes | None:
+        """
+        Returns the whole chunk from the cache, reading and verifying it from disk into
+        the cache on a miss, off the event loop. None if the chunk is too big to cache.
+        """
+        if not self.cache.admits(size):
+            return None
+        data = self.cache.get(chunk_id)
+        if data is None:
+            generation = self.cache.generation
+            data = await asyncio.to_thread(self.read_verified, chunk_id, file_path, 0, size, size)
+            self.cache.put(chunk_id, data, generation)
+        return data
+
+    def chunk_checksums(self, chunk_id: int) -> ChunkChecksums | None:
+        """
+        Checksums of a stored chunk, read from its checksum file on first use after a restart.
+        """
+        if chunk_id in self.checksums or chunk_id not in self.stored_chunks:
+            return self.checksums.get(chunk_id)
+        checksums = None
+        try:
+            with open(self.checksum_path(chunk_id), "rb") as f:
+                checksums = ChunkChecksums.from_bytes(f.read())
+        except FileNotFoundError:
+            pass  # Written before checksums existed
+        except UnsupportedChecksum as e:
+            # Not corrupt, other replicas serve it until the server runs with the library
+            if chunk_id not in self.unverifiable:
+                print(f"❌ Chunk {chunk_id} cannot be verified: {e}")
+                self.unverifiable.add(chunk_id)
+            raise HTTPException(status_code=503, detail=f"Chunk {chunk_id} cannot be verified: {e}")
+        except ChecksumError as e:
+            self.report_corrupt(chunk_id, str(e))
+        self.checksums[chunk_id] = checksums
+        return checksums
+
+    def checked_size(self, chunk_id: int, file_path: str) -> int:
+        """
+        Returns the chunk's size on disk, refusing chunks known to be corrupt or
+        whose size does not match their checksums (e.g. truncated files).
+        """
+        checksums = self.chunk_checksums(chunk_id)
+        size = os.path.getsize(file_path)
+        if checksums is not None and checksums.size != size:
+            self.mark_corrupt(chunk_id, checksums, f"has {size} bytes, expected {checksums.size}")
+        if chunk_id in self.corrupt_chunks:
+            raise HTTPException(status_code=500, detail=f"Chunk {chunk_id} is corrupt")
+        return size
+
+    def read_verified(self, chunk_id: int, file_path: str, start: int, end: int, size: int) -> bytes:
+        """
+        Reads bytes start..end of a chunk. The read is widened to whole checksum
+        blocks, which are verified before the requested range is cut out.
+        """
+        checksums = self.chunk_checksums(chunk_id)
+        first_block = start // BLOCK_SIZE
+        block_start = first_block * BLOCK_SIZE if checksums is not None else start
+        block_end = min(size, -(-end // BLOCK_SIZE) * BLOCK_SIZE) if checksums is not None else end
+        with open(file_path, "rb") as f, self.disk_seconds.timer("read"):
+            data = os.pread(f.fileno(), block_end - block_start, block_start)
+        if checksums is not None and not self.verify_blocks(chunk_id, checksums, data, first_block):
+            raise HTTPException(status_code=500, detail=f"Chunk {chunk_id} is corrupt")
+        if block_start == start and block_end == end:
+            return data
+        return data[start - block_start:end - block_start]
+
+    def verify_blocks(self, chunk_id: int, checksums: ChunkChecksums, data: bytes, first_block: int) -> bool:
+        try:
+            checksums.verify(data, first_block)
+            return True
+        except ChecksumError as e:
+            self.mark_corrupt(chunk_id, checksums, str(e))
+            return False
+
+    def mark_corrupt(self, chunk_id: int, checksums: ChunkChecksums, reason: str):
+        """
+        Flags a chunk as corrupt unless it was rewritten since `checksums` were taken.
+        May be called from the threads that stream responses.
+        """
+        if self.checksums.get(chunk_id) is checksums:
+            self.report_corrupt(chunk_id, reason)
+
+    def report_corrupt(self, chunk_id: int, reason: str):
+        if chunk_id in self.corrupt_chunks:
+            return
+        print(f"❌ Chunk {chunk_id} is corrupt: {reason}")
+        self.corrupt_chunks.add(chunk_id)
+        self.scrub_stats["corrupt_found"] += 1
+        if self.loop is not None and self.report_now is not None:
+            self.loop.call_soon_threadsafe(self.report_now.set)
+
+    def commit_chunk(self, chunk_id: int, tmp_path: str, size: int, version: int | None = None,
+                     checksums: ChunkChecksums | None = None):
+        """
+        Moves a fully written temp file and its checksums into place as the chunk
+        and updates disk accounting.
+        """
+        file_path = self.chunk_path(chunk_id)
+        self.cache.invalidate(chunk_id)
+        self.appends.pop(chunk_id, None)  # Replaced as a whole, appends start over from the new contents
+        if chunk_id in self.stored_chunks:
+            self.used_bytes -= os.path.getsize(file_path)
+        with self.disk_seconds.timer("commit"):
+            if checksums is not None:
+                with open(tmp_path + ".crc", "wb") as f:
+                    f.write(checksums.to_bytes())
+            os.replace(tmp_path, file_path)
+            if checksums is not None:
+                os.replace(tmp_path + ".crc", self.checksum_path(chunk_id))
+            elif os.path.exists(self.checksum_path(chunk_id)):
+                os.remove(self.checksum_path(chunk_id))
+        self.checksums[chunk_id] = checksums
+        self.corrupt_chunks.discard(chunk_id)
+        self.unverifiable.discard(chunk_id)
+        self.stored_chunks.add(chunk_id)
+        if version:
+            self.chunk_versions[chunk_id] = version
+        else:
+            self.chunk_versions.pop(chunk_id, None)
+        self.used_bytes += size
+        self.bytes_written += size
+        if self.manifest is not None:
+            self.manifest.add(chunk_id, size, version)
+        self.added_chunks[chunk_id] = version or 0
+        self.removed_chunks.discard(chunk_id)
+
+    def delete_chunk(self, chunk_id: int) -> int:
+        """
+        Removes a stored chunk and returns the bytes it freed.
+        """
+        if chunk_id not in self.stored_chunks:
+            return 0
+        file_path = self.chunk_path(chunk_id)
+        try:
+            size = os.path.getsize(file_path)
+            os.remove(file_path)
+        except FileNotFoundError:
+            size = 0
+        if os.path.exists(self.checksum_path(chunk_id)):
+            os.remove(self.checksum_path(chunk_id))
+        self.forget_chunk(chunk_id, size)
+        # The master asked for the delete, it needs no report
+        self.removed_chunks.discard(chunk_id)
+        return size
+
+    def forget_chunk(self, chunk_id: int, size: int):
+        """
+        Drops a chunk from the in-memory state and the manifest, reporting it as removed.
+        """
+        self.cache.invalidate(chunk_id)
+        self.appends.pop(chunk_id, None)
+        self.appended_sizes.pop(chunk_id, None)
+        self.stored_chunks.discard(chunk_id)
+        self.chunk_versions.pop(chunk_id, None)
+        self.checksums.pop(chunk_id, None)
+        self.corrupt_chunks.discard(chunk_id)
+        self.unverifiable.discard(chunk_id)
+        self.reported_corrupt.discard(chunk_id)
+        self.used_bytes -= size
+        if self.manifest is not None:
+            self.manifest.remove(chunk_id)
+        self.added_chunks.pop(chunk_id, None)
+        self.removed_chunks.add(chunk_id)
+
+    def load_chunks(self):
+        """
+        Restores the stored chunks after a restart from the manifest, falling back to
+        scanning the chunk directory if there is none. Checksums are loaded lazily.
+        """
+        os.makedirs(self.chunk_dir, exist_ok=True)
+        start = time.perf_counter()
+        self.manifest = ChunkManifest(self.chunk_dir)
+        chunks = self.manifest.load()
+        source = "manifest"
+        if chunks is None:
+            chunks = self.scan_chunk_dir()
+            source = "directory scan"
+        self.stored_chunks = set(chunks)
+        self.chunk_versions = {chunk_id: version for chunk_id, (_, version) in chunks.items() if version}
+        self.used_bytes = sum(size for size, _ in chunks.values())
+        self.checksums = {}
+        self.corrupt_chunks = set()
+        self.unverifiable = set()
+        # The full chunk report sent on registration covers everything loaded here
+        self.added_chunks, self.removed_chunks, self.reported_corrupt = {}, set(), set()
+        self.manifest.open(chunks)
+        print(f"✅ Loaded {len(chunks)} chunks from {source} in {time.perf_counter() - start:.2f}s")
+        if chunks and 1 not in ALGORITHMS:
+            print("⚠️ The crc32c package is not installed: chunks checksummed with CRC32C are not served, "
+                  "new chunks are checksummed with CRC-32")
+
+    def scan_chunk_dir(self) -> dict[int, tuple[int, int]]:
+        """
+        Finds the chunks in the chunk directory by listing it, removing leftovers of
+        interrupted writes and copies. Chunk versions are not on disk, they come back as 0.
+        """
+        chunks = {}
+        with os.scandir(self.chunk_dir) as entries:
+            for entry in entries:
+                name = entry.name
+                if ".tmp" in name or ".copy" in name:
+                    os.remove(entry.path)
+                elif name.endswith(".chunk") and name[:-len(".chunk")].isdigit():
+                    chunks[int(name[:-len(".chunk")])] = (entry.stat().st_size, 0)
+        return chunks
+
+    def chunk_report(self) -> dict:
+        """
+        Every stored chunk with its version, as parallel lists, for the master to reconcile.
+        """
+        chunk_ids = list(self.stored_chunks)
+        return {"chunk_ids": chunk_ids, "chunk_versions": [self.chunk_versions.get(chunk_id, 0) for chunk_id in chunk_ids]}
+
+    def disk_report(self) -> dict:
+        os.makedirs(self.chunk_dir, exist_ok=True)
+        free_bytes = shutil.disk_usage(self.chunk_dir).free
+        if self.capacity is not None:
+            free_bytes = min(free_bytes, max(0, self.capacity - self.used_bytes))
+        return {"used_bytes": self.used_bytes, "free_bytes": free_bytes}
+
+    def verify_step(self) -> int:
+        # Bytes per disk read when verifying, a whole number of checksum blocks
+        return max(BLOCK_SIZE, self.io_block_size - self.io_block_size % BLOCK_SIZE)
+
+    def iter_chunk(self, chunk_id: int, file_path: str, start: int, end: int):
+        """
+        Yields bytes start..end of a chunk, verifying whole checksum blocks as they are
+        read. A bad block ends the stream early, so the client sees a short response.
+        """
+        checksums = self.chunk_checksums(chunk_id)
+        if checksums is None:
+            step, position = self.io_block_size, start
+        else:
+            step, position = self.verify_step(), start - start % BLOCK_SIZE
+        with open(file_path, "rb") as f:
+            while position < end:
+                with self.disk_seconds.timer("read"):
+                    block = os.pread(f.fileno(), step if checksums is not None else min(step, end - position), position)
+                if not block:
+                    break
+                if checksums is not None and not self.verify_blocks(chunk_id, checksums, block, position // BLOCK_SIZE):
+                    raise Exception(f"Chunk {chunk_id} is corrupt")
+                yield block[max(0, start - position):end - position]
+                position += len(block)
+
+    # -------- Scrubbing --------
+
+    async def scrub_loop(self):
+        """
+        Re-verifies every stored chunk against its checksums in the background, so
+        corruption of rarely read chunks is found and repaired before it is needed.
+        """
+        while True:
+            started = time.monotonic()
+            for chunk_id in list(self.stored_chunks):
+                try:
+                    await self.scrub_chunk(chunk_id)
+                except Exception as e:
+                    print(f"❌ Scrubbing chunk {chunk_id} failed: {e}")
+            self.scrub_stats["passes"] += 1
+            self.scrub_stats["last_pass_seconds"] = time.monotonic() - started
+            await asyncio.sleep(self.scrub_interval)
+
+    async def scrub_chunk(self, chunk_id: int):
+        """
+        Reads one chunk off disk block by block in a worker thread, sleeping between
+        reads so the scrubber reads at most scrub_rate bytes per second.
+        """
+        if chunk_id in self.unverifiable:
+            return
+        checksums = self.chunk_checksums(chunk_id)
+        if checksums is None or chunk_id in self.corrupt_chunks:
+            return
+        try:
+            f = open(self.chunk_path(chunk_id), "rb")
+        except FileNotFoundError:
+            if self.checksums.get(chunk_id) is checksums:
+                print(f"❌ Chunk {chunk_id} is missing from disk")
+                self.forget_chunk(chunk_id, checksums.size)
+            return
+        with f:
+            size = os.fstat(f.fileno()).st_size
+            if size != checksums.size:
+                self.mark_corrupt(chunk_id, checksums, f"has {size} bytes, expected {checksums.size}")
+                return
+            position = 0
+            step = self.verify_step()
+            while position < size:
+                block = await asyncio.to_thread(os.pread, f.fileno(), step, position)
+                if self.checksums.get(chunk_id) is not checksums:
+                    return  # Rewritten or deleted while scrubbing
+                if not self.verify_blocks(chunk_id, checksums, block, position // BLOCK_SIZE):
+                    return
+                position += len(block)
+                self.scrub_stats["scrubbed_bytes"] += len(block)
+                await asyncio.sleep(len(block) / self.scrub_rate)
+        self.scrub_stats["scrubbed_chunks"] += 1
 
     def find_free_port(self):
         with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
@@ -88,15 +1128,20 @@ class ChunkServer:
             return s.getsockname()[1]
 
     async def register_with_master(self):
-        async with httpx.AsyncClient() as client:
+        """
+        Registers with the master, sending the full chunk report so the master keeps
+        the replicas this server still has instead of re-replicating them.
+        """
+        async with httpx.AsyncClient(timeout=httpx.Timeout(300.0, connect=5.0)) as client:
             while True:
                 try:
                     resp = await client.post(
                         f"{self.master_url}/register_chunkserver",
-                        json={"chunkserver_id": self.address}
+                        json={"chunkserver_id": self.address, "labels": self.labels,
+                              **self.disk_report(), **self.chunk_report()}
                     )
                     if resp.status_code == 200:
-                        print(f"✅ Registered with master at {self.master_url}")
+                        print(f"✅ Registered with master at {self.master_url}: {resp.json()}")
                         break
                     else:
                         print(f"⚠️ Failed to register with master, status: {resp.status_code}")
@@ -104,21 +1149,88 @@ class ChunkServer:
                     print(f"⚠️ Could not connect to master ({self.master_url}), retrying in 2 seconds... ({e})")
                 await asyncio.sleep(2)
 
+    def load_report(self) -> dict:
+        """
+        Requests in flight, pending copies and read/write throughput since the last report.
+        """
+        now = time.monotonic()
+        sampled_at, bytes_read, bytes_written = self.load_sample
+        elapsed = max(now - sampled_at, 1e-3)
+        self.load_sample = (now, self.bytes_read, self.bytes_written)
+        return {
+            "inflight_requests": self.inflight_requests,
+            "copy_queue": len(self.copy_tasks),
+            "read_bytes_per_second": int((self.bytes_read - bytes_read) / elapsed),
+            "write_bytes_per_second": int((self.bytes_written - bytes_written) / elapsed),
+        }
+
+    def heartbeat_payload(self) -> tuple[dict, dict[int, int], set[int], set[int], dict[int, int]]:
+        """
+        Builds the next heartbeat. Chunk changes are taken out of the pending sets, the
+        caller hands them back with restore_delta() if the master does not acknowledge them.
+        """
+        added, self.added_chunks = self.added_chunks, {}
+        removed, self.removed_chunks = self.removed_chunks, set()
+        appended, self.appended_sizes = self.appended_sizes, {}
+        corrupt = self.corrupt_chunks - self.reported_corrupt
+        payload = {"chunkserver_id": self.address, **self.disk_report(), "load": self.load_report()}
+        # Empty deltas are left out, an idle chunkserver's heartbeat stays a few dozen bytes
+        if added:
+            payload["added_ids"] = list(added)
+            payload["added_versions"] = list(added.values())
+        if removed:
+            payload["removed_ids"] = list(removed)
+        if corrupt:
+            payload["corrupt_chunks"] = list(corrupt)
+        if appended:
+            payload["appended_ids"] = list(appended)
+            payload["appended_sizes"] = list(appended.values())
+        return payload, added, removed, corrupt, appended
+
+    def restore_delta(self, added: dict[int, int], removed: set[int], appended: dict[int, int]):
+        # Changes made since the payload was built are newer and win
+        for chunk_id, version in added.items():
+            if chunk_id not in self.added_chunks and chunk_id not in self.removed_chunks:
+                self.added_chunks[chunk_id] = version
+        for chunk_id in removed:
+            if chunk_id not in self.added_chunks:
+                self.removed_chunks.add(chunk_id)
+        for chunk_id, size in appended.items():
+            if chunk_id in self.stored_chunks and chunk_id not in self.appended_sizes:
+                self.appended_sizes[chunk_id] = size
+
     async def send_heartbeat_loop(self):
+        self.loop = asyncio.get_running_loop()
+        self.report_now = asyncio.Event()
         async with httpx.AsyncClient() as client:
             while True:
+                self.report_now.clear()
+                payload, added, removed, corrupt, appended = self.heartbeat_payload()
                 try:
-                    await client.post(
-                        f"{self.master_url}/heartbeat",
-                        json={"chunkserver_id": self.address}
-                    )
+                    with self.heartbeat_seconds.timer():
+                        resp = await client.post(f"{self.master_url}/heartbeat", json=payload)
+                    if resp.status_code != 200:
+                        raise Exception(f"master answered {resp.status_code}")
+                    self.last_heartbeat_ack = time.monotonic()
+                    self.reported_corrupt |= corrupt & self.corrupt_chunks
+                    if resp.json().get("chunk_report"):
+                        # The master lost track of this server (e.g. it timed out), tell it what is on disk
+                        await self.register_with_master()
                 except Exception as e:
+                    self.restore_delta(added, removed, appended)
                     print(f"❌ Heartbeat failed: {e}")
-                await asyncio.sleep(self.heartbeat_interval)
+                try:
+                    # Newly found corruption is reported right away
+                    await asyncio.wait_for(self.report_now.wait(), self.heartbeat_interval)
+                except asyncio.TimeoutError:
+                    pass
 
     async def run(self):
+        self.load_chunks()
         await self.register_with_master()
         asyncio.create_task(self.send_heartbeat_loop())
+        if self.scrub_rate > 0:
+            asyncio.create_task(self.scrub_loop())
 
         config = uvicorn.Config(self.app, host=self.host, port=self.port, log_level="info")
         server = uvicorn.Server(config)
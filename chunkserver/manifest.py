@@ -0,0 +1,75 @@
+import os
+
+
+class ChunkManifest:
+    """
+    Append-only record of the chunks in a chunk directory, so a restarting
+    chunkserver learns its chunks from one sequential read instead of listing
+    and stat'ing every file.
+
+    Lines are "+ <chunk_id> <size> <version>" when a chunk is committed and
+    "- <chunk_id>" when it is deleted. On open the file is rewritten as a
+    snapshot of the live chunks once it has grown well past them.
+    """
+
+    FILE_NAME = "MANIFEST"
+
+    def __init__(self, chunk_dir: str):
+        self.path = os.path.join(chunk_dir, self.FILE_NAME)
+        self.file = None
+        self.records = 0  # Lines in the file, compared to live chunks to decide on compaction
+
+    def load(self) -> dict[int, tuple[int, int]] | None:
+        """
+        Returns chunk_id -> (size, version) of the live chunks, None if there is no manifest.
+        """
+        try:
+            f = open(self.path, "r")
+        except FileNotFoundError:
+            return None
+        chunks = {}
+        with f:
+            for line in f:
+                fields = line.split()
+                try:
+                    if len(fields) == 4 and fields[0] == "+":
+                        chunks[int(fields[1])] = (int(fields[2]), int(fields[3]))
+                    elif len(fields) == 2 and fields[0] == "-":
+                        chunks.pop(int(fields[1]), None)
+                    else:
+                        continue  # Torn last line of a crash
+                except ValueError:
+                    continue
+                self.records += 1
+        return chunks
+
+    def open(self, chunks: dict[int, tuple[int, int]]):
+        """
+        Starts appending, first writing `chunks` as a fresh snapshot if the manifest
+        is missing or mostly made of superseded records.
+        """
+        if self.records == 0 or self.records > 2 * len(chunks) + 1024:
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "w") as f:
+                f.writelines(f"+ {chunk_id} {size} {version}\n" for chunk_id, (size, version) in chunks.items())
+            os.replace(tmp_path, self.path)
+            self.records = len(chunks)
+        self.file = open(self.path, "a")
+
+    def add(self, chunk_id: int, size: int, version: int | None):
+        self.append(f"+ {chunk_id} {size} {version or 0}\n")
+
+    def remove(self, chunk_id: int):
+        self.append(f"- {chunk_id}\n")
+
+    def append(self, line: str):
+        if self.file is None:
+            return
+        self.file.write(line)
+        self.file.flush()
+        self.records += 1
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
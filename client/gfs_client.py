@@ -0,0 +1,702 @@
+import json
+import os
+import random
+import sys
+import threading
+import time
+from collections import OrderedDict, defaultdict, deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Deque, Dict, Iterator, List, Optional, Tuple
+
+import httpx
+
+# The erasure codec is shared with the chunkservers and lives in common/
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "common"))
+
+from erasure import ReedSolomon, stripe_lengths
+
+
+class StaleLocationError(Exception):
+    """
+    A chunkserver rejected a read because the cached chunk version is outdated.
+    """
+
+
+class LocationCache:
+    """
+    File layouts by path, each kept until the lease the master granted with it runs out.
+    Least recently used entries are evicted beyond `max_entries`. Thread safe, so
+    several clients of one process can share it.
+    """
+
+    def __init__(self, max_entries: int = 10_000):
+        self.max_entries = max_entries
+        self.entries: "OrderedDict[str, Tuple[float, dict]]" = OrderedDict()  # path -> (expires_at, layout)
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, path: str) -> Optional[dict]:
+        with self.lock:
+            entry = self.entries.get(path)
+            if entry is None or entry[0] <= time.monotonic():
+                if entry is not None:
+                    del self.entries[path]
+                self.misses += 1
+                return None
+            self.entries.move_to_end(path)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, path: str, layout: dict, requested_at: float):
+        # The lease counts from when the request was sent, the answer may have taken a while
+        with self.lock:
+            self.entries[path] = (requested_at + layout.get("lease_seconds", 0), layout)
+            self.entries.move_to_end(path)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def invalidate(self, path: str):
+        with self.lock:
+            self.entries.pop(path, None)
+
+    def invalidate_prefix(self, prefix: str):
+        # Scans every entry, prefix deletes are rare
+        directory = prefix.rstrip("/") + "/"
+        with self.lock:
+            for path in [path for path in self.entries if path.startswith(directory) or path == prefix]:
+                del self.entries[path]
+
+
+class PartRead:
+    """
+    State of one chunk being read: the replicas still to try and the requests in flight.
+    """
+    __slots__ = ("replicas", "started_at", "outstanding", "hedge", "stale")
+
+    def __init__(self, replicas: List[Tuple[str, int]]):
+        self.replicas = replicas  # Untried replicas, preferred first
+        self.started_at = time.monotonic()
+        self.outstanding = 0  # Requests in flight
+        self.hedge: Optional[Future] = None  # The hedged request, once sent
+        self.stale = False  # A replica answered 404 or 409
+
+
+class StripeRead:
+    """
+    State of one stripe of an erasure coded file being read: the shards still to try,
+    the requests in flight and the shards that arrived.
+    """
+    __slots__ = ("lengths", "candidates", "futures", "shards", "needed", "stale")
+
+    def __init__(self, lengths: List[int], candidates: List[Tuple[int, str, int]], needed: int):
+        self.lengths = lengths  # Bytes of each data shard, parity shards are as long as the first
+        self.candidates = candidates  # Untried (shard, chunkserver_id, chunk_id), data shards first
+        self.futures: Dict[Future, int] = {}  # Request -> shard
+        self.shards: Dict[int, bytes] = {}  # Shards that arrived, plus the empty ones past the end of the file
+        self.needed = needed  # Shards to decode the stripe from, empty ones included
+        self.stale = False
+
+
+class GFSClient:
+    """
+    Python client for the file system. Chunk locations are fetched from the master
+    once per lease and reads go straight to the chunkservers while the lease is valid.
+    A chunkserver answering 409 (stale version) or unreachable replicas trigger a
+    single refresh of the file's locations.
+
+    Reads fetch up to `read_window` chunks at once over pooled connections, starting
+    each on the replica expected to answer first (recent latency of the chunkserver
+    times its requests in flight). If a chunk takes longer
+    than the `hedge_percentile` of recent chunk latencies, the next replica is asked
+    as well and the first answer wins. Chunks are handed out in file order.
+
+    Erasure coded files are read a stripe at a time from their data shards. If a data
+    shard cannot be read, parity shards are fetched instead and the missing data is
+    decoded on the fly (a degraded read).
+
+        with GFSClient("http://localhost:8000") as client:
+            client.write_file("/docs/a.txt", b"hello")
+            data = client.read_file("/docs/a.txt")
+    """
+
+    def __init__(self, master_url: str = "http://localhost:8000", use_cache: bool = True,
+                 cache: Optional[LocationCache] = None, peer_addresses: Optional[Dict[str, str]] = None,
+                 timeout: float = 60.0, read_window: int = 8, hedge: bool = True, hedge_percentile: float = 95.0,
+                 balance: bool = True):
+        self.master_url = master_url.rstrip("/")
+        self.cache: Optional[LocationCache] = (cache or LocationCache()) if use_cache else None  # Pass `cache` to share one
+        self.peer_addresses = peer_addresses or {}  # Chunkserver id -> address reachable from here
+        self.read_window = read_window  # Chunks fetched concurrently per read
+        self.http = httpx.Client(
+            timeout=httpx.Timeout(timeout, connect=5.0),
+            limits=httpx.Limits(max_connections=4 * read_window, max_keepalive_connections=4 * read_window),
+        )
+        # Every chunk has at most its request and one hedge in flight
+        self.executor = ThreadPoolExecutor(max_workers=2 * read_window, thread_name_prefix="gfs-read")
+
+        self.hedge = hedge
+        self.hedge_percentile = hedge_percentile
+        self.hedge_initial_delay = 0.05  # Seconds before hedging while there are too few latency samples
+        self.latencies: deque = deque(maxlen=1000)  # Recent chunk read latencies, in seconds
+        self.balance = balance  # Pick replicas by expected latency, otherwise in layout order
+        self.inflight: Dict[str, int] = defaultdict(int)  # Chunk requests in flight per chunkserver
+        self.server_latency: Dict[str, float] = {}  # Moving average of each chunkserver's chunk latency
+        self.explore_rate = 0.05  # Share of chunks read in random replica order, keeps latencies of avoided servers fresh
+        self.lock = threading.Lock()
+        self.rand = random.Random()
+        self.append_targets: Dict[str, Tuple[float, dict]] = {}  # path -> (expires_at, target) of the last chunk to append to
+        self.append_attempts = 8  # Tries per record before giving up
+        self.stream_threshold = 1000  # Batches of more paths are streamed by the master page by page
+
+        # Metrics
+        self.master_requests = 0
+        self.chunk_requests = 0
+        self.stale_reads = 0
+        self.hedged_requests = 0
+        self.hedge_wins = 0  # Chunks the hedged request delivered first
+        self.appended_records = 0
+        self.append_retries = 0  # Record sends that failed and were repeated
+        self.degraded_reads = 0  # Stripes that had to be decoded from parity shards
+        self.codecs: Dict[Tuple[int, int], ReedSolomon] = {}
+
+    def close(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        self.http.close()
+
+    def __enter__(self) -> "GFSClient":
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # -------- Master --------
+
+    def master_call(self, method: str, endpoint: str, **kwargs) -> httpx.Response:
+        self.master_requests += 1
+        resp = self.http.request(method, f"{self.master_url}{endpoint}", **kwargs)
+        if resp.status_code != 200:
+            raise Exception(f"Master answered {resp.status_code} on {endpoint}: {resp.text}")
+        return resp
+
+    def get_layout(self, path: str, refresh: bool = False) -> dict:
+        """
+        Returns the file's FileLayout, from the cache while its lease is valid.
+        """
+        if self.cache is not None and not refresh:
+            layout = self.cache.get(path)
+            if layout is not None:
+                return layout
+
+        requested_at = time.monotonic()
+        layout = self.master_call("GET", "/get_file_layout", params={"path": path}).json()
+        if self.cache is not None:
+            self.cache.put(path, layout, requested_at)
+        return layout
+
+    def invalidate(self, path: str):
+        if self.cache is not None:
+            self.cache.invalidate(path)
+
+    def get_layouts(self, paths: List[str]) -> Dict[str, dict]:
+        """
+        Returns the FileLayout of every path, from the cache where its lease is valid and
+        from one batch request for the rest. Paths that cannot be read map to
+        {"path", "error"} instead.
+        """
+        layouts: Dict[str, dict] = {}
+        missing = []
+        for path in paths:
+            layout = self.cache.get(path) if self.cache is not None else None
+            if layout is not None:
+                layouts[path] = layout
+            else:
+                missing.append(path)
+        if missing:
+            for path, layout in zip(missing, self.batch_layouts({"paths": missing}, stream=len(missing) > self.stream_threshold)):
+                layouts[path] = layout
+        return layouts
+
+    def get_layouts_under(self, prefix: str) -> Dict[str, dict]:
+        """
+        Returns the FileLayout of every live file below the directory `prefix`, by path.
+        """
+        return {layout["path"]: layout for layout in self.batch_layouts({"prefix": prefix}, stream=True)}
+
+    def batch_layouts(self, body: dict, stream: bool) -> Iterator[dict]:
+        """
+        Fetches layouts from /get_file_layouts and yields them one file at a time, caching
+        the readable ones. Streamed batches arrive as one BatchLayout per line.
+        """
+        requested_at = time.monotonic()
+        self.master_requests += 1
+        if stream:
+            with self.http.stream("POST", f"{self.master_url}/get_file_layouts", json={**body, "stream": True}) as resp:
+                if resp.status_code != 200:
+                    resp.read()
+                    raise Exception(f"Master answered {resp.status_code} on /get_file_layouts: {resp.text}")
+                for line in resp.iter_lines():
+                    if line:
+                        yield from self.unpack_layouts(json.loads(line), requested_at)
+        else:
+            resp = self.http.post(f"{self.master_url}/get_file_layouts", json=body)
+            if resp.status_code != 200:
+                raise Exception(f"Master answered {resp.status_code} on /get_file_layouts: {resp.text}")
+            yield from self.unpack_layouts(resp.json(), requested_at)
+
+    def unpack_layouts(self, batch: dict, requested_at: float) -> Iterator[dict]:
+        for entry in batch["files"]:
+            if "error" in entry:
+                yield entry
+                continue
+            # The shared servers table works for each file, its server_indexes point into it
+            layout = {**entry, "chunk_size": batch["chunk_size"], "offset": 0,
+                      "servers": batch["servers"], "lease_seconds": batch["lease_seconds"]}
+            if self.cache is not None:
+                self.cache.put(layout["path"], layout, requested_at)
+            yield layout
+
+    def stat(self, path: str) -> dict:
+        return self.master_call("GET", "/stat", params={"path": path}).json()
+
+    def list_directory(self, path: str = "/", start_after: Optional[str] = None, limit: int = 1000) -> dict:
+        params = {"path": path, "limit": limit}
+        if start_after is not None:
+            params["start_after"] = start_after
+        return self.master_call("GET", "/list_directory", params=params).json()
+
+    def delete_file(self, path: str):
+        self.invalidate(path)
+        self.master_call("POST", "/delete_file", json={"path": path})
+
+    def delete_files(self, paths: List[str]) -> List[dict]:
+        """
+        Deletes many files in one request. Returns {"path", "deleted"} or {"path", "error"} per path.
+        """
+        for path in paths:
+            self.invalidate(path)
+        return self.master_call("POST", "/delete_files", json={"paths": paths}).json()
+
+    def delete_prefix(self, prefix: str) -> int:
+        """
+        Deletes every file below the directory `prefix` in one operation, returns how many.
+        """
+        if self.cache is not None:
+            self.cache.invalidate_prefix(prefix)
+        return self.master_call("POST", "/delete_files", json={"prefix": prefix}).json()["deleted"]
+
+    # -------- Data --------
+
+    def chunkserver_url(self, chunkserver_id: str) -> str:
+        return self.peer_addresses.get(chunkserver_id, chunkserver_id)
+
+    @staticmethod
+    def replicas(layout: dict, part: int) -> List[Tuple[str, int]]:
+        """
+        (chunkserver_id, chunk_id) of every replica of the part `layout['offset'] + part`.
+        """
+        start, end = layout["replica_offsets"][part], layout["replica_offsets"][part + 1]
+        return [(layout["servers"][layout["server_indexes"][i]], layout["chunk_ids"][i]) for i in range(start, end)]
+
+    @staticmethod
+    def shards(layout: dict, part: int) -> List[Tuple[int, str, int]]:
+        """
+        (shard, chunkserver_id, chunk_id) of every shard of the stripe `layout['offset'] + part`.
+        """
+        start, end = layout["replica_offsets"][part], layout["replica_offsets"][part + 1]
+        return [(layout["shards"][i], layout["servers"][layout["server_indexes"][i]], layout["chunk_ids"][i])
+                for i in range(start, end)]
+
+    def codec(self, layout: dict) -> ReedSolomon:
+        key = tuple(layout["ec"])
+        if key not in self.codecs:
+            self.codecs[key] = ReedSolomon(*key)
+        return self.codecs[key]
+
+    def write_file(self, path: str, data: bytes, ec: Optional[Tuple[int, int]] = None):
+        """
+        Creates the file and writes every chunk once, to its first replica,
+        which forwards it along the rest of the replica chain. With `ec` =
+        (data shards, parity shards) the file is erasure coded instead: the
+        client computes each stripe's parity and writes every shard to its
+        chunkserver.
+        """
+        self.invalidate(path)
+        requested_at = time.monotonic()
+        body = {"path": path, "size": len(data), "compact": True}
+        if ec is not None:
+            body["ec"] = list(ec)
+        layout = self.master_call("POST", "/create_file", json=body).json()
+        if ec is not None:
+            self.write_stripes(layout, data)
+            if self.cache is not None:
+                self.cache.put(path, layout, requested_at)
+            return
+        chunk_size = layout["chunk_size"]
+        for part in range(layout["chunk_count"]):
+            (primary_id, primary_chunk), *rest = self.replicas(layout, part)
+            params = [("forward", f"{chunk_id}@{chunkserver_id}") for chunkserver_id, chunk_id in rest]
+            params.append(("version", layout["version"]))
+            self.chunk_requests += 1
+            resp = self.http.post(
+                f"{self.chunkserver_url(primary_id)}/write_chunk_binary/{primary_chunk}",
+                params=params,
+                content=data[part * chunk_size:(part + 1) * chunk_size],
+                headers={"Content-Type": "application/octet-stream"},
+            )
+            if resp.status_code != 200:
+                raise Exception(f"Failed to write chunk {part} of {path} to {primary_id}: {resp.text}")
+        if self.cache is not None:
+            self.cache.put(path, layout, requested_at)
+
+    def write_stripes(self, layout: dict, data: bytes):
+        """
+        Encodes and writes the stripes of a new erasure coded file, all shards of a stripe at once.
+        """
+        codec = self.codec(layout)
+        chunk_size = layout["chunk_size"]
+        stripe_bytes = codec.data_shards * chunk_size
+        for part in range(layout["chunk_count"]):
+            stripe = data[part * stripe_bytes:(part + 1) * stripe_bytes]
+            shards = [stripe[i * chunk_size:(i + 1) * chunk_size] for i in range(codec.data_shards)]
+            shards += codec.encode(shards)
+            futures = [self.executor.submit(self.put_chunk, chunkserver_id, chunk_id, shards[shard], layout["version"])
+                       for shard, chunkserver_id, chunk_id in self.shards(layout, part)]
+            for future in futures:
+                future.result()
+
+    def put_chunk(self, chunkserver_id: str, chunk_id: int, data: bytes, version: int):
+        self.chunk_requests += 1
+        resp = self.http.post(
+            f"{self.chunkserver_url(chunkserver_id)}/write_chunk_binary/{chunk_id}",
+            params={"version": version},
+            content=data,
+            headers={"Content-Type": "application/octet-stream"},
+        )
+        if resp.status_code != 200:
+            raise Exception(f"Failed to write chunk {chunk_id} to {chunkserver_id}: {resp.text}")
+
+    def append_target(self, path: str, full_part: Optional[int] = None, refresh: bool = False) -> dict:
+        """
+        Returns the primary replica of the file's last chunk, from the cache while its
+        lease is valid. `full_part` tells the master that part has no room left.
+        """
+        if not refresh and full_part is None:
+            with self.lock:
+                entry = self.append_targets.get(path)
+            if entry is not None and entry[0] > time.monotonic():
+                return entry[1]
+
+        requested_at = time.monotonic()
+        resp = self.http.post(f"{self.master_url}/append_target", json={"path": path, "full_part": full_part})
+        self.master_requests += 1
+        if resp.status_code == 503:
+            raise ConnectionError(f"Master is busy with {path}: {resp.text}")
+        if resp.status_code != 200:
+            raise Exception(f"Master answered {resp.status_code} on /append_target: {resp.text}")
+        target = resp.json()
+        with self.lock:
+            self.append_targets[path] = (requested_at + target["lease_seconds"], target)
+        return target
+
+    def record_append(self, path: str, data: bytes) -> int:
+        """
+        Appends `data` as one record to the file, creating it if needed, and returns the
+        record's offset in the file. The primary replica picks the offset, so concurrent
+        appenders never overwrite each other. A record whose send failed is sent again,
+        so it may appear in the file more than once, but always whole.
+        """
+        full_part = None
+        refresh = False
+        for attempt in range(self.append_attempts):
+            try:
+                target = self.append_target(path, full_part=full_part, refresh=refresh)
+                full_part = None
+                self.chunk_requests += 1
+                resp = self.http.post(
+                    f"{self.chunkserver_url(target['primary'])}/append_record/{target['chunk_id']}",
+                    content=data,
+                    headers={"Content-Type": "application/octet-stream"},
+                )
+            except (httpx.TransportError, ConnectionError):
+                refresh = True
+            else:
+                if resp.status_code == 413:
+                    raise ValueError(f"Record of {len(data)} bytes is too large for {path}: {resp.text}")
+                if resp.status_code == 200:
+                    result = resp.json()
+                    if result["status"] == "chunk_full":
+                        full_part = target["part_index"]
+                        continue
+                    self.appended_records += 1
+                    self.invalidate(path)
+                    return target["part_index"] * target["chunk_size"] + result["offset"]
+                # 410: the lease moved on, 502: a secondary failed, the master sorts out both
+                refresh = True
+            self.append_retries += 1
+            time.sleep(min(1.0, 0.02 * 2 ** attempt) * (0.5 + self.rand.random()))
+        raise Exception(f"Could not append a record to {path} after {self.append_attempts} attempts")
+
+    def read_file(self, path: str) -> bytes:
+        return b"".join(self.iter_file(path))
+
+    def iter_file(self, path: str) -> Iterator[bytes]:
+        """
+        Yields the file's chunks (whole stripes of erasure coded files) in order as soon
+        as each one and all before it arrived. Cached locations are used first; if they
+        turn out stale the rest of the file is read with fresh locations, as long as the
+        file was not replaced meanwhile.
+        """
+        layout = self.get_layout(path)
+        part = 0
+        refreshed = False
+        while True:
+            try:
+                parts = self.read_stripes(layout, part) if "ec" in layout else self.read_parts(layout, part)
+                for data in parts:
+                    yield data
+                    part += 1
+                return
+            except StaleLocationError:
+                if refreshed:
+                    raise
+                refreshed = True
+                self.stale_reads += 1
+                fresh = self.get_layout(path, refresh=True)
+                if part and fresh["version"] != layout["version"]:
+                    raise Exception(f"{path} was replaced while it was read")
+                if part and ("ec" in fresh) != ("ec" in layout):
+                    # Conversion keeps the version, but the parts become stripes
+                    raise Exception(f"{path} was converted to erasure coding while it was read")
+                layout = fresh
+
+    def read_parts(self, layout: dict, first: int) -> Iterator[bytes]:
+        """
+        Fetches the layout's parts from `first` on with up to read_window of them in
+        flight (fetched but not yet handed out included), yielding them in order.
+        """
+        part_count = len(layout["replica_offsets"]) - 1
+        hedge_after = self.hedge_delay()
+        reads: Dict[int, PartRead] = {}  # Parts in flight
+        fetched: Dict[int, bytes] = {}  # Parts that arrived before an earlier one
+        owners: Dict[Future, int] = {}  # Request -> part, losers of a hedge stay until they finish
+        next_part = next_yield = first
+        try:
+            while next_yield < part_count:
+                while next_part < part_count and len(reads) + len(fetched) < self.read_window:
+                    read = reads[next_part] = PartRead(self.order_replicas(self.replicas(layout, next_part)))
+                    self.send(read, next_part, layout, owners)
+                    next_part += 1
+
+                if next_yield in fetched:
+                    yield fetched.pop(next_yield)
+                    next_yield += 1
+                    continue
+
+                timeout = None
+                if self.hedge:
+                    deadlines = [read.started_at + hedge_after for read in reads.values() if read.hedge is None and read.replicas]
+                    if deadlines:
+                        timeout = max(0.0, min(deadlines) - time.monotonic())
+                finished, _ = wait(list(owners), timeout=timeout, return_when=FIRST_COMPLETED)
+
+                for future in finished:
+                    part = owners.pop(future)
+                    read = reads.get(part)
+                    if read is None:
+                        continue  # The part already arrived from another replica
+                    read.outstanding -= 1
+                    try:
+                        status, content, elapsed = future.result()
+                    except httpx.HTTPError:
+                        status = None
+                    if status == 200:
+                        fetched[part] = content
+                        del reads[part]
+                        with self.lock:
+                            self.latencies.append(elapsed)
+                        if future is read.hedge:
+                            self.hedge_wins += 1
+                        continue
+                    read.stale = read.stale or status in (404, 409)
+                    if read.replicas:
+                        self.send(read, part, layout, owners)  # Fail over to the next replica
+                    elif not read.outstanding:
+                        # A cached layout may point at replicas that moved since; a fresh one is worth a retry
+                        if read.stale or self.cache is not None:
+                            raise StaleLocationError(f"No replica of chunk {layout['offset'] + part} of {layout['path']} is readable")
+                        raise Exception(f"Failed to read chunk {layout['offset'] + part} of {layout['path']} from all replicas")
+
+                if self.hedge:
+                    now = time.monotonic()
+                    for part, read in reads.items():
+                        if read.hedge is None and read.replicas and now >= read.started_at + hedge_after:
+                            read.hedge = self.send(read, part, layout, owners)
+                            self.hedged_requests += 1
+        finally:
+            for future in owners:
+                future.cancel()
+
+    def read_stripes(self, layout: dict, first: int) -> Iterator[bytes]:
+        """
+        Yields the stripes of an erasure coded file from `first` on, each as the bytes of
+        the file it holds. Stripes are requested ahead so that about read_window shard
+        requests are in flight.
+        """
+        codec = self.codec(layout)
+        stripe_count = len(layout["replica_offsets"]) - 1
+        ahead = max(1, self.read_window // codec.data_shards)
+        reads: Deque[Tuple[int, StripeRead]] = deque()
+        next_stripe = first
+        try:
+            while reads or next_stripe < stripe_count:
+                while next_stripe < stripe_count and len(reads) < ahead:
+                    reads.append((next_stripe, self.start_stripe(layout, next_stripe)))
+                    next_stripe += 1
+                stripe, read = reads.popleft()
+                yield self.finish_stripe(layout, stripe, read)
+        finally:
+            for _, read in reads:
+                for future in read.futures:
+                    future.cancel()
+
+    def start_stripe(self, layout: dict, stripe: int) -> StripeRead:
+        """
+        Requests the data shards of a stripe, one replica each, and a parity shard in
+        place of each data shard the layout has no location for.
+        """
+        data_shards = self.codec(layout).data_shards
+        lengths = stripe_lengths(layout["size"], layout["chunk_size"], data_shards, layout["offset"] + stripe)
+        candidates = sorted(self.shards(layout, stripe), key=lambda candidate: candidate[0])
+        read = StripeRead(lengths, candidates, data_shards)
+        read.shards.update((shard, b"") for shard, length in enumerate(lengths) if not length)
+        lost = 0
+        for shard in range(data_shards):
+            if lengths[shard] and not self.send_shard(read, layout, shard):
+                lost += 1
+        for _ in range(lost):
+            self.send_shard(read, layout)
+        return read
+
+    def send_shard(self, read: StripeRead, layout: dict, shard: int | None = None) -> bool:
+        """
+        Requests the next untried replica of `shard`, or of the next shard not yet asked
+        for if None. Returns False if there is nothing left to try.
+        """
+        asked = set(read.shards) | set(read.futures.values())
+        for index, (candidate, chunkserver_id, chunk_id) in enumerate(read.candidates):
+            if (shard is None and candidate not in asked) or candidate == shard:
+                del read.candidates[index]
+                future = self.executor.submit(self.fetch_chunk, chunkserver_id, chunk_id, layout["version"])
+                read.futures[future] = candidate
+                self.chunk_requests += 1
+                return True
+        return False
+
+    def finish_stripe(self, layout: dict, stripe: int, read: StripeRead) -> bytes:
+        """
+        Waits for enough shards of the stripe, asking for parity shards in place of data
+        shards that fail, and decodes the data shards that are missing.
+        """
+        codec = self.codec(layout)
+        data_shards = codec.data_shards
+        shard_size = read.lengths[0]
+        while len(read.shards) < read.needed:
+            if not read.futures:
+                # A cached layout may point at shards that moved since; a fresh one is worth a retry
+                if read.stale or self.cache is not None:
+                    raise StaleLocationError(f"Too few shards of stripe {layout['offset'] + stripe} of {layout['path']} are readable")
+                raise Exception(f"Failed to read stripe {layout['offset'] + stripe} of {layout['path']}")
+            finished, _ = wait(list(read.futures), return_when=FIRST_COMPLETED)
+            for future in finished:
+                shard = read.futures.pop(future)
+                try:
+                    status, content, elapsed = future.result()
+                except httpx.HTTPError:
+                    status = None
+                expected = read.lengths[shard] if shard < data_shards else shard_size
+                if status == 200 and len(content) == expected:
+                    if shard not in read.shards:
+                        read.shards[shard] = content
+                    with self.lock:
+                        self.latencies.append(elapsed)
+                    continue
+                read.stale = read.stale or status in (404, 409)
+                # Another replica of the same shard if there is one, else any shard not asked for yet
+                if not self.send_shard(read, layout, shard):
+                    self.send_shard(read, layout)
+        for future in read.futures:
+            future.cancel()
+
+        missing = [shard for shard in range(data_shards) if shard not in read.shards]
+        if missing:
+            self.degraded_reads += 1
+            read.shards.update(codec.reconstruct(read.shards, shard_size, missing))
+        return b"".join(read.shards[shard][:read.lengths[shard]] for shard in range(data_shards))
+
+    def send(self, read: PartRead, part: int, layout: dict, owners: Dict[Future, int]) -> Future:
+        chunkserver_id, chunk_id = read.replicas.pop(0)
+        future = self.executor.submit(self.fetch_chunk, chunkserver_id, chunk_id, layout["version"])
+        owners[future] = part
+        read.outstanding += 1
+        self.chunk_requests += 1
+        return future
+
+    def fetch_chunk(self, chunkserver_id: str, chunk_id: int, version: int) -> Tuple[int, bytes, float]:
+        """
+        Runs on the executor. Returns (status code, body, seconds taken).
+        """
+        with self.lock:
+            self.inflight[chunkserver_id] += 1
+        start = time.monotonic()
+        try:
+            resp = self.http.get(
+                f"{self.chunkserver_url(chunkserver_id)}/read_chunk_binary/{chunk_id}",
+                params={"version": version},
+            )
+        finally:
+            elapsed = time.monotonic() - start
+            with self.lock:
+                self.inflight[chunkserver_id] -= 1
+                average = self.server_latency.get(chunkserver_id, elapsed)
+                self.server_latency[chunkserver_id] = 0.8 * average + 0.2 * elapsed
+        return resp.status_code, resp.content, elapsed
+
+    def order_replicas(self, replicas: List[Tuple[str, int]]) -> List[Tuple[str, int]]:
+        """
+        Replica expected to answer first goes first: recent latency times requests already
+        queued on the chunkserver. Unmeasured chunkservers count as fast, ties are broken
+        randomly so load spreads over replicas.
+        """
+        if not self.balance:
+            return list(replicas)
+        with self.lock:
+            if self.rand.random() < self.explore_rate:
+                return self.rand.sample(replicas, len(replicas))
+            return sorted(replicas, key=lambda replica: (
+                self.server_latency.get(replica[0], 0.0) * (1 + self.inflight[replica[0]]), self.rand.random()))
+
+    def hedge_delay(self) -> float:
+        """
+        Seconds after which a chunk request gets hedged: the hedge_percentile of recent
+        latencies of answered requests.
+        """
+        with self.lock:
+            samples = sorted(self.latencies)
+        if len(samples) < 20:
+            return self.hedge_initial_delay
+        return samples[min(len(samples) - 1, int(len(samples) * self.hedge_percentile / 100))]
+
+    def stats(self) -> dict:
+        return {
+            "master_requests": self.master_requests,
+            "chunk_requests": self.chunk_requests,
+            "stale_reads": self.stale_reads,
+            "hedged_requests": self.hedged_requests,
+            "hedge_wins": self.hedge_wins,
+            "appended_records": self.appended_records,
+            "append_retries": self.append_retries,
+            "degraded_reads": self.degraded_reads,
+            "cache_hits": self.cache.hits if self.cache is not None else 0,
+            "cache_misses": self.cache.misses if self.cache is not None else 0,
+        }
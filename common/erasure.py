@@ -0,0 +1,186 @@
+"""
+Reed-Solomon erasure coding over GF(256), vectorized with NumPy.
+
+A stripe of `data_shards` data shards gets `parity_shards` parity shards, and any
+`data_shards` of the stripe's shards are enough to rebuild the others. The code is
+systematic, data shards are stored as they are. Parity rows come from a Cauchy
+matrix, every square submatrix of which is invertible, so any choice of surviving
+shards decodes.
+
+Shared by the client, which encodes and decodes its writes and reads, and the
+chunkservers, which encode stripes and rebuild lost shards: both must agree on
+every byte.
+"""
+from typing import Dict, Iterable, List, Sequence
+
+import numpy as np
+
+POLYNOMIAL = 0x11d  # x^8 + x^4 + x^3 + x^2 + 1, 2 generates the multiplicative group
+BLOCK_SIZE = 32 * 1024  # Bytes multiplied at a time, small enough for inputs and tables to stay in cache
+
+
+def build_tables():
+    exp = np.zeros(512, dtype=np.int32)
+    log = np.zeros(256, dtype=np.int32)
+    value = 1
+    for power in range(255):
+        exp[power] = value
+        log[value] = power
+        value <<= 1
+        if value & 0x100:
+            value ^= POLYNOMIAL
+    exp[255:510] = exp[:255]  # Products index up to 254 + 254 without a modulo
+    # MUL[a][b] = a * b, row a is the lookup table for multiplying by a
+    products = exp[(log[:, None] + log[None, :])]
+    products[0, :] = 0
+    products[:, 0] = 0
+    return exp, log, products.astype(np.uint8)
+
+
+EXP, LOG, MUL = build_tables()
+WIDE: Dict[int, np.ndarray] = {}  # Coefficient -> products with every pair of bytes, built on first use
+
+
+def wide_table(coefficient: int) -> np.ndarray:
+    """
+    Multiplies two bytes at once: entry v holds both bytes of the 16 bit value v times
+    the coefficient, which halves the lookups (the slow part) over byte-wise tables.
+    """
+    table = WIDE.get(coefficient)
+    if table is None:
+        row = MUL[coefficient].astype(np.uint16)
+        values = np.arange(65536, dtype=np.uint32)
+        table = WIDE[coefficient] = (row[values >> 8] << 8) | row[values & 0xff]
+    return table
+
+
+def gf_mul(a: int, b: int) -> int:
+    return int(MUL[a, b])
+
+
+def gf_inv(a: int) -> int:
+    if a == 0:
+        raise ZeroDivisionError("0 has no inverse in GF(256)")
+    return int(EXP[255 - LOG[a]])
+
+
+def invert(matrix: List[List[int]]) -> List[List[int]]:
+    """
+    Inverts a square matrix over GF(256) by Gauss-Jordan elimination.
+    """
+    size = len(matrix)
+    rows = [list(row) + [int(i == j) for j in range(size)] for i, row in enumerate(matrix)]
+    for column in range(size):
+        pivot = next((r for r in range(column, size) if rows[r][column]), None)
+        if pivot is None:
+            raise ValueError("Matrix is singular")
+        rows[column], rows[pivot] = rows[pivot], rows[column]
+        scale = gf_inv(rows[column][column])
+        rows[column] = [gf_mul(scale, value) for value in rows[column]]
+        for r in range(size):
+            factor = rows[r][column]
+            if r != column and factor:
+                rows[r] = [value ^ gf_mul(factor, pivot_value) for value, pivot_value in zip(rows[r], rows[column])]
+    return [row[size:] for row in rows]
+
+
+def stripe_lengths(file_size: int, chunk_size: int, data_shards: int, stripe: int) -> List[int]:
+    """
+    Bytes of each data shard of a stripe. Data shard i of stripe s holds the file's
+    chunk s * data_shards + i; shards past the end of the file are empty. Parity
+    shards are as long as the first, longest data shard.
+    """
+    start = stripe * data_shards * chunk_size
+    return [max(0, min(chunk_size, file_size - start - i * chunk_size)) for i in range(data_shards)]
+
+
+class ReedSolomon:
+    def __init__(self, data_shards: int, parity_shards: int):
+        if data_shards < 1 or parity_shards < 1 or data_shards + parity_shards > 256:
+            raise ValueError("Need at least one data and one parity shard, at most 256 shards in total")
+        self.data_shards = data_shards
+        self.parity_shards = parity_shards
+        # Rows of the generator matrix: identity for the data shards, then 1 / (x_i + y_j)
+        # with x_i = data_shards + i and y_j = j, which never coincide
+        self.matrix = [[int(i == j) for j in range(data_shards)] for i in range(data_shards)] + [
+            [gf_inv((data_shards + i) ^ j) for j in range(data_shards)] for i in range(parity_shards)
+        ]
+
+    @property
+    def total_shards(self) -> int:
+        return self.data_shards + self.parity_shards
+
+    def encode(self, data: Sequence[bytes]) -> List[bytes]:
+        """
+        Returns the parity shards of `data_shards` data shards, which may be shorter than
+        the first one (the end of the file) and count as zero-padded to its length.
+        """
+        if len(data) != self.data_shards:
+            raise ValueError(f"Expected {self.data_shards} data shards, got {len(data)}")
+        size = len(data[0])
+        inputs = [self.padded(shard, size) for shard in data]
+        return [out.tobytes() for out in self.multiply(self.matrix[self.data_shards:], inputs, size)]
+
+    def reconstruct(self, shards: Dict[int, bytes], size: int, wanted: Iterable[int]) -> Dict[int, bytes]:
+        """
+        Rebuilds the shards `wanted` (data or parity indexes) from at least `data_shards`
+        known shards by index, each zero-padded to `size`. Returns them at `size` bytes.
+        """
+        wanted = list(wanted)
+        if len(shards) < self.data_shards:
+            raise ValueError(f"Need {self.data_shards} shards to reconstruct, have {len(shards)}")
+        # Data shards first, decoding them is free
+        known = sorted(shards)[:self.data_shards]
+        inputs = [self.padded(shards[index], size) for index in known]
+        decode = invert([self.matrix[index] for index in known])
+        # Row of shard w in terms of the known shards: its generator row times the decode matrix
+        rows = [[self.dot(self.matrix[index], [decode[r][c] for r in range(self.data_shards)])
+                 for c in range(self.data_shards)] for index in wanted]
+        return {index: out.tobytes() for index, out in zip(wanted, self.multiply(rows, inputs, size))}
+
+    @staticmethod
+    def dot(row: List[int], column: List[int]) -> int:
+        result = 0
+        for a, b in zip(row, column):
+            result ^= gf_mul(a, b)
+        return result
+
+    @staticmethod
+    def padded(shard: bytes, size: int) -> np.ndarray:
+        """
+        The shard as 16 bit words, zero-padded to `size` bytes rounded up to a whole word.
+        """
+        array = np.frombuffer(shard, dtype=np.uint8)
+        if len(array) > size:
+            raise ValueError(f"Shard of {len(array)} bytes is longer than the stripe's {size}")
+        if len(array) == size and size % 2 == 0:
+            return array.view(np.uint16)
+        out = np.zeros(size + size % 2, dtype=np.uint8)
+        out[:len(array)] = array
+        return out.view(np.uint16)
+
+    @staticmethod
+    def multiply(rows: List[List[int]], inputs: List[np.ndarray], size: int) -> List[np.ndarray]:
+        """
+        Computes every output row as the GF(256) sum (XOR) of the inputs times the row's
+        coefficients, block by block. Returns the rows as `size` bytes each.
+        """
+        words = (size + 1) // 2
+        step = BLOCK_SIZE // 2
+        outputs = [np.zeros(words, dtype=np.uint16) for _ in rows]
+        scratch = np.empty(min(words, step), dtype=np.uint16)
+        for start in range(0, words, step):
+            end = min(words, start + step)
+            product = scratch[:end - start]
+            for row, out in zip(rows, outputs):
+                target = out[start:end]
+                for coefficient, source in zip(row, inputs):
+                    if coefficient == 0:
+                        continue
+                    block = source[start:end]
+                    if coefficient == 1:
+                        np.bitwise_xor(target, block, out=target)
+                    else:
+                        np.take(wide_table(coefficient), block, out=product)
+                        np.bitwise_xor(target, product, out=target)
+        return [out.view(np.uint8)[:size] for out in outputs]
@@ -0,0 +1,245 @@
+"""
+Metrics in the Prometheus text format, and an on-demand stack sampler.
+
+Shared by master and chunkserver. Metrics belong to a Registry owned by the
+server, not to the module, so servers sharing a process (benchmarks) keep
+separate metrics. An update takes a lock and a couple of dict and list
+operations, cheap enough to leave on for every request and disk read.
+"""
+import bisect
+import os
+import sys
+import threading
+import time
+from collections import Counter as Tally
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+# Innermost frames of threads that are waiting for work, left out of profiles by default
+IDLE_FRAMES = ("select (selectors.py)", "wait (threading.py)", "_worker (thread.py)")
+
+# Seconds, from a cached metadata lookup to a slow chunk copy
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def format_labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Metric:
+    """
+    A counter or gauge with labels. With `fn` the values are read from it when the
+    metrics are rendered instead: a number, or a dict of label value tuples to numbers.
+    """
+    kind = "untyped"
+
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = (), fn: Optional[Callable] = None):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.fn = fn
+        self.lock = threading.Lock()
+        self.values: Dict[Tuple[str, ...], float] = {}
+
+    def samples(self) -> Iterable[Tuple[str, Tuple[str, ...], str, float]]:
+        values = self.values
+        if self.fn is not None:
+            values = self.fn()
+            if not isinstance(values, dict):
+                values = {(): values}
+        else:
+            with self.lock:
+                values = dict(values)
+        for label_values, value in values.items():
+            if not isinstance(label_values, tuple):
+                label_values = (label_values,)
+            yield self.name, label_values, "", value
+
+
+class CounterMetric(Metric):
+    kind = "counter"
+
+    def inc(self, *labels: str, amount: float = 1.0):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0.0) + amount
+
+
+class GaugeMetric(Metric):
+    kind = "gauge"
+
+    def set(self, value: float, *labels: str):
+        with self.lock:
+            self.values[labels] = value
+
+
+class HistogramMetric:
+    """
+    Counts observations into cumulative buckets per label values, plus their sum and count.
+    """
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = (), buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        self.lock = threading.Lock()
+        self.series: Dict[Tuple[str, ...], list] = {}  # label values -> [bucket counts (last is +Inf), sum]
+
+    def observe(self, value: float, *labels: str):
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            series = self.series.get(labels)
+            if series is None:
+                series = self.series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    @contextmanager
+    def timer(self, *labels: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *labels)
+
+    def samples(self) -> Iterable[Tuple[str, Tuple[str, ...], str, float]]:
+        with self.lock:
+            series = {labels: (list(counts), total) for labels, (counts, total) in self.series.items()}
+        for label_values, (counts, total) in series.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                yield f"{self.name}_bucket", label_values, f'le="{le}"', cumulative
+            yield f"{self.name}_sum", label_values, "", total
+            yield f"{self.name}_count", label_values, "", cumulative
+
+
+class Registry:
+    """
+    The metrics of one server, rendered for GET /metrics.
+    """
+
+    def __init__(self):
+        self.metrics: List = []
+
+    def counter(self, name: str, help: str, labels: Tuple[str, ...] = (), fn: Optional[Callable] = None) -> CounterMetric:
+        return self.add(CounterMetric(name, help, labels, fn))
+
+    def gauge(self, name: str, help: str, labels: Tuple[str, ...] = (), fn: Optional[Callable] = None) -> GaugeMetric:
+        return self.add(GaugeMetric(name, help, labels, fn))
+
+    def histogram(self, name: str, help: str, labels: Tuple[str, ...] = (),
+                  buckets: Tuple[float, ...] = LATENCY_BUCKETS) -> HistogramMetric:
+        return self.add(HistogramMetric(name, help, labels, buckets))
+
+    def add(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            try:
+                for name, label_values, extra, value in metric.samples():
+                    lines.append(f"{name}{format_labels(metric.labels, label_values, extra)} {float(value)!r}")
+            except Exception as e:  # A failing callback must not take the other metrics down
+                lines.append(f"# {metric.name} failed: {escape(str(e))}")
+        return "\n".join(lines) + "\n"
+
+
+class RequestMetrics:
+    """
+    ASGI middleware recording the latency of every request by method, route and status.
+    Routes are the path templates ("/read_chunk_binary/{chunk_id}"), so ids in the URL
+    do not create new series. Streamed responses count until their last byte was sent.
+    """
+
+    def __init__(self, app, histogram: HistogramMetric):
+        self.app = app
+        self.histogram = histogram
+        self.routes: Dict[Callable, str] = {}  # Endpoint function -> path template
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        start = time.perf_counter()
+        status = 500
+
+        async def record_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, record_status)
+        finally:
+            self.histogram.observe(time.perf_counter() - start, scope["method"], self.route(scope), str(status))
+
+    def route(self, scope) -> str:
+        endpoint = scope.get("endpoint")  # Set by the router once a route matched
+        if endpoint is None:
+            return "unmatched"
+        route = self.routes.get(endpoint)
+        if route is None:
+            route = next((route.path for route in scope["app"].routes if getattr(route, "endpoint", None) is endpoint),
+                         getattr(endpoint, "__name__", "unknown"))
+            self.routes[endpoint] = route
+        return route
+
+
+class StackSampler:
+    """
+    Sampling profiler, off until asked for a profile. Samples the stack of every
+    thread at a fixed interval and counts identical stacks in the collapsed format
+    flame graph tools read: "outer;inner;leaf count" per line, hottest first.
+    Threads waiting on I/O or locks show up as stacks ending in the wait; idle
+    threads (an event loop in select, pool workers waiting for tasks) only with `idle`.
+    """
+
+    def __init__(self):
+        self.running = threading.Lock()  # One profile at a time
+
+    def profile(self, seconds: float, interval: float = 0.005, limit: int = 200, idle: bool = False) -> str:
+        if not self.running.acquire(blocking=False):
+            raise RuntimeError("A profile is already being taken.")
+        try:
+            stacks = Tally()
+            me = threading.get_ident()
+            samples = 0
+            deadline = time.monotonic() + seconds
+            while time.monotonic() < deadline:
+                for thread_id, frame in sys._current_frames().items():
+                    if thread_id == me:
+                        continue
+                    stack = self.collapse(frame)
+                    if idle or not stack.endswith(IDLE_FRAMES):
+                        stacks[stack] += 1
+                samples += 1
+                time.sleep(interval)
+        finally:
+            self.running.release()
+        lines = [f"# {samples} samples every {interval * 1000:g}ms over {seconds:g}s, {len(stacks)} distinct stacks"]
+        lines += [f"{stack} {count}" for stack, count in stacks.most_common(limit)]
+        return "\n".join(lines) + "\n"
+
+    @staticmethod
+    def collapse(frame) -> str:
+        names = []
+        while frame is not None:
+            code = frame.f_code
+            names.append(f"{code.co_name} ({os.path.basename(code.co_filename)})")
+            frame = frame.f_back
+        return ";".join(reversed(names))
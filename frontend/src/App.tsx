@@ -110,7 +110,7 @@ export default function App() {
                     <Button onClick={handleSize}>Size</Button>
                 </Flex>
                 {sizeQuery.data !== undefined && (
-                    <Text size="2">Size: {sizeQuery.data}</Text>
+                    <Text size="2">Size: {sizeQuery.data} bytes</Text>
                 )}
                 {readQueryError && (
                     <Text size="2" color="red">
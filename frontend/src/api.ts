@@ -1,61 +1,173 @@
 const BASE_URL = import.meta.env.VITE_NAME_SERVER ?? 'http://localhost:8000'
 
-export async function uploadFileRequest(filename: string, data: string): Promise<string> {
+type ChunkEntry = {
+  chunkserver_id: string
+  chunk_id: number
+  is_deleted: boolean
+  deleted_at: number | null
+}
+
+// Compact chunk placement returned by the master when `compact` is requested.
+// Replicas of part `offset + i` are at replica_offsets[i]..replica_offsets[i + 1]
+// in server_indexes/chunk_ids, and server_indexes point into `servers`.
+export type FileLayout = {
+  path: string
+  size: number
+  chunk_size: number
+  chunk_count: number
+  offset: number
+  servers: string[]
+  replica_offsets: number[]
+  server_indexes: number[]
+  chunk_ids: number[]
+  version: number // chunkservers answer 409 to reads asking for another version
+  lease_seconds: number // how long the locations may be used without asking the master again
+  // Erasure coded files only: [data shards, parity shards], and the shard index of every
+  // entry of chunk_ids. Their parts are stripes, data shard i of stripe s is chunk s * data shards + i.
+  ec?: [number, number]
+  shards?: number[]
+}
+
+// Layouts by path until their lease runs out, so repeated reads skip the master
+const layoutCache = new Map<string, { layout: FileLayout; expiresAt: number }>()
+
+function cacheLayout(filename: string, layout: FileLayout, requestedAt: number) {
+  layoutCache.set(filename, { layout, expiresAt: requestedAt + layout.lease_seconds * 1000 })
+}
+
+export function invalidateLayout(filename: string) {
+  layoutCache.delete(filename)
+}
+
+async function getCachedLayout(filename: string, refresh = false): Promise<FileLayout> {
+  const cached = layoutCache.get(filename)
+  if (!refresh && cached && cached.expiresAt > performance.now()) {
+    return cached.layout
+  }
+  const requestedAt = performance.now()
+  const layout = await getFileLayoutRequest(filename)
+  cacheLayout(filename, layout, requestedAt)
+  return layout
+}
+
+class StaleLocationError extends Error {}
+
+export function layoutToChunkSets(layout: FileLayout): ChunkEntry[][] {
+  const chunkSets: ChunkEntry[][] = []
+  for (let part = 0; part + 1 < layout.replica_offsets.length; part++) {
+    const replicas: ChunkEntry[] = []
+    for (let i = layout.replica_offsets[part]; i < layout.replica_offsets[part + 1]; i++) {
+      replicas.push({
+        chunkserver_id: layout.servers[layout.server_indexes[i]],
+        chunk_id: layout.chunk_ids[i],
+        is_deleted: false,
+        deleted_at: null,
+      })
+    }
+    chunkSets.push(replicas)
+  }
+  return chunkSets
+}
+
+// Replicas of each data shard of an erasure coded file in file order, with the bytes of the
+// file each holds. Shards past the end of the file are empty and stored nowhere.
+function layoutToDataShards(layout: FileLayout): { replicas: ChunkEntry[]; length: number }[] {
+  const [dataShards] = layout.ec!
+  const stripes = layoutToChunkSets(layout)
+  const result: { replicas: ChunkEntry[]; length: number }[] = []
+  stripes.forEach((entries, part) => {
+    const first = layout.replica_offsets[part]
+    const stripeStart = (layout.offset + part) * dataShards * layout.chunk_size
+    for (let shard = 0; shard < dataShards; shard++) {
+      const length = Math.max(0, Math.min(layout.chunk_size, layout.size - stripeStart - shard * layout.chunk_size))
+      if (length === 0) continue
+      const replicas = entries.filter((_, i) => layout.shards![first + i] === shard)
+      if (replicas.length === 0) {
+        // Being rebuilt, a fresh layout may have it back
+        throw new StaleLocationError(`Data shard ${shard} of stripe ${layout.offset + part} has no location`)
+      }
+      result.push({ replicas, length })
+    }
+  })
+  return result
+}
+
+export async function getFileLayoutRequest(filename: string, offset = 0, limit?: number): Promise<FileLayout> {
+  const params = new URLSearchParams({ path: filename, offset: String(offset) })
+  if (limit !== undefined) params.set('limit', String(limit))
+  const res = await fetch(`${BASE_URL}/get_file_layout?${params}`)
+  if (!res.ok) throw new Error(await (await res.json()).detail)
+  return res.json()
+}
+
+export async function uploadFileRequest(
+  filename: string,
+  data: string,
+  { compactLayout = true }: { compactLayout?: boolean } = {},
+): Promise<string> {
+  const bytes = new TextEncoder().encode(data)
+  invalidateLayout(filename)
+
   // 1. Create file and get chunk allocation
+  const requestedAt = performance.now()
   const res = await fetch(`${BASE_URL}/create_file`, {
     method: 'POST',
     headers: { 'Content-Type': 'application/json' },
     body: JSON.stringify({
       path: filename,
-      size: data.length,
+      size: bytes.length,
+      compact: compactLayout,
     }),
   })
   if (!res.ok) throw new Error(await res.text())
 
-  // 2. Get the chunk allocation
-  const chunksRes = await fetch(`${BASE_URL}/get_file_chunks?path=${encodeURIComponent(filename)}`)
-  if (!chunksRes.ok) throw new Error(await (await chunksRes.json()).detail)
-  const chunkSets: Array<
-    Array<{
-      chunkserver_id: string
-      chunk_id: number
-      is_deleted: boolean
-      deleted_at: number | null
-    }>
-  > = await chunksRes.json()
-
-  // 3. Split data into chunks (max 1000 chars each)
-  const MAX_CHUNK_SIZE = 1000
+  // 2. Get the chunk allocation, the compact layout already carries it
+  let chunkSets: ChunkEntry[][]
+  let chunkSize: number
+  let version: number
+  if (compactLayout) {
+    const layout: FileLayout = await res.json()
+    chunkSets = layoutToChunkSets(layout)
+    chunkSize = layout.chunk_size
+    version = layout.version
+    cacheLayout(filename, layout, requestedAt)
+  } else {
+    const chunksRes = await fetch(`${BASE_URL}/get_file_chunks?path=${encodeURIComponent(filename)}`)
+    if (!chunksRes.ok) throw new Error(await (await chunksRes.json()).detail)
+    chunkSets = await chunksRes.json()
+    const layout = await getFileLayoutRequest(filename, 0, 0)
+    chunkSize = layout.chunk_size
+    version = layout.version
+  }
+
+  // 3. Split data into chunks of chunkSize bytes, the last one holds the remainder
   const totalChunks = chunkSets.length
-  const chunks: string[] = []
+  const chunks: Uint8Array[] = []
 
   for (let i = 0; i < totalChunks; i++) {
-    const start = i * MAX_CHUNK_SIZE
-    const end = Math.min(start + MAX_CHUNK_SIZE, data.length)
-    chunks.push(data.slice(start, end))
+    const start = i * chunkSize
+    const end = Math.min(start + chunkSize, bytes.length)
+    chunks.push(bytes.subarray(start, end))
   }
 
-  // 4. Write each chunk to all its replicas
+  // 4. Write each chunk once; the first replica forwards it along the rest of the chain
   const writePromises = chunkSets.map(async (replicas, chunkIndex) => {
     const chunkData = chunks[chunkIndex]
+    const [primary, ...rest] = replicas
+    const params = new URLSearchParams({ version: String(version) })
+    for (const replica of rest) {
+      params.append('forward', `${replica.chunk_id}@${replica.chunkserver_id}`)
+    }
 
-    // Write to all replicas in parallel
-    const replicaPromises = replicas.map(async (replica) => {
-      const writeRes = await fetch(`${replica.chunkserver_id}/write_chunk`, {
-        method: 'POST',
-        headers: { 'Content-Type': 'application/json' },
-        body: JSON.stringify({
-          chunk_id: replica.chunk_id,
-          data: chunkData,
-        }),
-      })
-      if (!writeRes.ok) {
-        throw new Error(`Failed to write to ${replica.chunkserver_id}: ${await writeRes.text()}`)
-      }
-      return writeRes.json()
+    const writeRes = await fetch(`${primary.chunkserver_id}/write_chunk_binary/${primary.chunk_id}?${params}`, {
+      method: 'POST',
+      headers: { 'Content-Type': 'application/octet-stream' },
+      body: chunkData,
     })
-
-    await Promise.all(replicaPromises)
+    if (!writeRes.ok) {
+      throw new Error(`Failed to write to ${primary.chunkserver_id}: ${await writeRes.text()}`)
+    }
+    return writeRes.json()
   })
 
   // 5. Wait for all chunks to be written
@@ -64,65 +176,158 @@ export async function uploadFileRequest(filename: string, data: string): Promise
 }
 
 export async function readFileRequest(filename: string): Promise<string> {
-  // 1. Get chunk metadata from master
-  const res = await fetch(`${BASE_URL}/get_file_chunks?path=${encodeURIComponent(filename)}`)
-  if (!res.ok) throw new Error(await (await res.json()).detail)
-  const chunkSets: Array<
-    Array<{
-      chunkserver_id: string
-      chunk_id: number
-      is_deleted: boolean
-      deleted_at: number | null
-    }>
-  > = await res.json()
-
-  // 2. Helper function to resolve chunkserver URL
-  const resolveChunkserverUrl = (chunkserver_id: string): string => {
-    if (chunkserver_id.startsWith('http://') || chunkserver_id.startsWith('https://')) {
-      return chunkserver_id
-    }
-    return `http://${chunkserver_id}`
+  // 1. Get chunk locations, from the cache while the master's lease is valid.
+  //    Stale cached locations are refreshed once.
+  try {
+    return await readLayout(await getCachedLayout(filename))
+  } catch (error) {
+    if (!(error instanceof StaleLocationError)) throw error
+    return readLayout(await getCachedLayout(filename, true))
   }
+}
 
-  // 3. Fetch data from each chunk synchronously to preserve order
-  const chunkData: string[] = []
-  
-  for (let index = 0; index < chunkSets.length; index++) {
-    const replicas = chunkSets[index]
-    let chunkContent: string | null = null
-    
-    // Try each replica until one succeeds
-    for (const replica of replicas) {
-      if (replica.is_deleted) continue
-
-      try {
-        const chunkserverUrl = resolveChunkserverUrl(replica.chunkserver_id)
-        const chunkRes = await fetch(`${chunkserverUrl}/read_chunk/${replica.chunk_id}`)
-        if (chunkRes.ok) {
-          const data = await chunkRes.json()
-          console.log(`[DEBUG] Chunk ${index}:`, data)
-          chunkContent = data.data
-          break // Success, exit replica loop
-        }
-      } catch (error) {
-        console.log(`[DEBUG] Failed to read chunk ${index} from ${replica.chunkserver_id}:`, error)
-        // Try next replica
-        continue
-      }
+// Parts fetched concurrently per read, and the delay before a slow part is also requested from another replica
+const READ_WINDOW = 8
+const DEFAULT_HEDGE_DELAY_MS = 50
+const HEDGE_PERCENTILE = 0.95
+
+// Recent chunk read latencies, and per chunkserver a latency estimate and the reads in flight
+const readLatencies: number[] = []
+const serverLatency = new Map<string, number>()
+const serverInflight = new Map<string, number>()
+
+function resolveChunkserverUrl(chunkserver_id: string): string {
+  if (chunkserver_id.startsWith('http://') || chunkserver_id.startsWith('https://')) {
+    return chunkserver_id
+  }
+  return `http://${chunkserver_id}`
+}
+
+function hedgeDelay(): number {
+  if (readLatencies.length < 20) return DEFAULT_HEDGE_DELAY_MS
+  const sorted = [...readLatencies].sort((a, b) => a - b)
+  return sorted[Math.floor(sorted.length * HEDGE_PERCENTILE)]
+}
+
+// Cheapest replicas first: expected latency scaled by the reads already queued on the server
+function orderReplicas(replicas: ChunkEntry[]): ChunkEntry[] {
+  const cost = (replica: ChunkEntry) =>
+    (serverLatency.get(replica.chunkserver_id) ?? 0) * (1 + (serverInflight.get(replica.chunkserver_id) ?? 0))
+  return replicas.filter((replica) => !replica.is_deleted).sort((a, b) => cost(a) - cost(b))
+}
+
+async function fetchReplica(replica: ChunkEntry, version: number, signal: AbortSignal): Promise<Uint8Array> {
+  const server = replica.chunkserver_id
+  serverInflight.set(server, (serverInflight.get(server) ?? 0) + 1)
+  const started = performance.now()
+  try {
+    const url = `${resolveChunkserverUrl(server)}/read_chunk_binary/${replica.chunk_id}?version=${version}`
+    const res = await fetch(url, { signal })
+    if (!res.ok) throw new Error(`Chunkserver ${server} answered ${res.status}`)
+    const data = new Uint8Array(await res.arrayBuffer())
+    const elapsed = performance.now() - started
+    readLatencies.push(elapsed)
+    if (readLatencies.length > 1000) readLatencies.shift()
+    const previous = serverLatency.get(server)
+    serverLatency.set(server, previous === undefined ? elapsed : previous * 0.8 + elapsed * 0.2)
+    return data
+  } finally {
+    serverInflight.set(server, (serverInflight.get(server) ?? 1) - 1)
+  }
+}
+
+// Reads one part from the best replica. If it has not answered after the hedge delay the
+// next replica is asked too and the first answer wins; failures move on to the next replica.
+function readPart(replicas: ChunkEntry[], version: number, index: number): Promise<Uint8Array> {
+  const candidates = orderReplicas(replicas)
+  const controller = new AbortController()
+  return new Promise((resolve, reject) => {
+    let next = 0
+    let outstanding = 0
+    let settled = false
+    let hedgeTimer: ReturnType<typeof setTimeout> | undefined
+
+    const finish = () => {
+      settled = true
+      clearTimeout(hedgeTimer)
+      controller.abort() // Cancel the losing request
     }
-    
-    if (chunkContent === null) {
-      throw new Error(`Failed to read chunk ${index} from all replicas`)
+    const launch = () => {
+      const replica = candidates[next++]
+      outstanding++
+      fetchReplica(replica, version, controller.signal).then(
+        (data) => {
+          if (settled) return
+          finish()
+          resolve(data)
+        },
+        (error) => {
+          outstanding--
+          if (settled) return
+          console.log(`[DEBUG] Failed to read chunk ${index} from ${replica.chunkserver_id}:`, error)
+          if (next < candidates.length) {
+            launch()
+          } else if (outstanding === 0) {
+            finish()
+            // Replicas may have moved or the chunk version changed since the layout was cached
+            reject(new StaleLocationError(`Failed to read chunk ${index} from all replicas`))
+          }
+        },
+      )
+    }
+
+    if (candidates.length === 0) {
+      reject(new StaleLocationError(`No replicas of chunk ${index}`))
+      return
+    }
+    launch()
+    hedgeTimer = setTimeout(() => {
+      if (!settled && next < candidates.length) launch()
+    }, hedgeDelay())
+  })
+}
+
+async function readLayout(layout: FileLayout): Promise<string> {
+  // Erasure coded files are read from their data shards, cut to the bytes of the file they hold
+  const dataShards = layout.ec ? layoutToDataShards(layout) : null
+  const chunkSets = dataShards ? dataShards.map(({ replicas }) => replicas) : layoutToChunkSets(layout)
+
+  // Keep up to READ_WINDOW parts in flight and decode them in order as the head of the window arrives
+  const pending: Promise<Uint8Array>[] = []
+  let nextPart = 0
+  const fill = () => {
+    while (nextPart < chunkSets.length && pending.length < READ_WINDOW) {
+      const index = nextPart
+      let part = readPart(chunkSets[index], layout.version, index)
+      if (dataShards) {
+        // Decoding lost data shards from parity needs the GF(256) codec of the Python client
+        part = part.then(
+          (data) => data.subarray(0, dataShards[index].length),
+          (error) => {
+            throw new StaleLocationError(`${error.message}, erasure coded files need the Python client for degraded reads`)
+          },
+        )
+      }
+      part.catch(() => {}) // Awaited below, avoid unhandled rejections while it waits its turn
+      pending.push(part)
+      nextPart++
     }
-    
-    chunkData.push(chunkContent)
   }
 
-  // 4. Concatenate chunks in order
-  return chunkData.join('')
+  // Stream decoding keeps multi-byte characters that span chunks intact
+  const decoder = new TextDecoder()
+  let content = ''
+  fill()
+  while (pending.length > 0) {
+    const data = await pending.shift()!
+    fill()
+    content += decoder.decode(data, { stream: true })
+  }
+  return content + decoder.decode()
 }
 
 export async function deleteFileRequest(filename: string): Promise<string> {
+  invalidateLayout(filename)
   const res = await fetch(`${BASE_URL}/delete_file`, {
     method: 'POST',
     headers: { 'Content-Type': 'application/json' },
@@ -135,52 +340,12 @@ export async function deleteFileRequest(filename: string): Promise<string> {
 }
 
 export async function fileSizeRequest(filename: string): Promise<number> {
-  // 1. Get chunk metadata from master
-  const res = await fetch(`${BASE_URL}/get_file_chunks?path=${encodeURIComponent(filename)}`)
+  // The master tracks file sizes in bytes, no need to read the chunks
+  const res = await fetch(`${BASE_URL}/stat?path=${encodeURIComponent(filename)}`)
   if (!res.ok) throw new Error(await (await res.json()).detail)
-  const chunkSets: Array<
-    Array<{
-      chunkserver_id: string
-      chunk_id: number
-      is_deleted: boolean
-      deleted_at: number | null
-    }>
-  > = await res.json()
-
-  // 2. Helper function to resolve chunkserver URL
-  const resolveChunkserverUrl = (chunkserver_id: string): string => {
-    if (chunkserver_id.startsWith('http://') || chunkserver_id.startsWith('https://')) {
-      return chunkserver_id
-    }
-    return `http://${chunkserver_id}`
+  const stat: { type: string; size: number; is_deleted: boolean } = await res.json()
+  if (stat.type !== 'file' || stat.is_deleted) {
+    throw new Error(`File "${filename}" not found`)
   }
-
-  // 3. Fetch data from each chunk in parallel
-  const chunkPromises = chunkSets.map(async (replicas, index) => {
-    // Try each replica until one succeeds
-    for (const replica of replicas) {
-      if (replica.is_deleted && replica.deleted_at) {
-        const deletedAtDate = new Date(replica.deleted_at * 1000)
-        throw new Error(`File "${filename}" was deleted from replica ${replica.chunk_id} at ${deletedAtDate.toLocaleString()}`)
-      }
-
-      try {
-        const chunkserverUrl = resolveChunkserverUrl(replica.chunkserver_id)
-        const chunkRes = await fetch(`${chunkserverUrl}/read_chunk/${replica.chunk_id}`)
-        if (chunkRes.ok) {
-          const response = await chunkRes.json()
-          return response.data
-        }
-      } catch (error) {
-        // Try next replica
-        continue
-      }
-    }
-    throw new Error(`Failed to read chunk ${index} from all replicas`)
-  })
-
-  // 4. Wait for all chunks, concatenate, and return total length
-  const chunkData = await Promise.all(chunkPromises)
-  const fullContent = chunkData.join('')
-  return fullContent.length
+  return stat.size
 }
@@ -0,0 +1,191 @@
+import asyncio
+import time
+from collections import defaultdict, deque
+from typing import TYPE_CHECKING, Deque, Dict, List, Optional, Set, Tuple
+
+import httpx
+
+if TYPE_CHECKING:
+    from master import ChunkEntry, Master
+
+
+class ConversionPlan:
+    """
+    How a replicated file becomes stripes of `ec` = (data shards, parity shards). Data
+    shard i of stripe s is the file's chunk s * data_shards + i: one of its replicas is
+    kept as the shard, or copied to a fresh slot if every replica's chunkserver already
+    holds another shard of the stripe. Parity shards get fresh slots.
+    """
+    __slots__ = ("path", "version", "size", "ec", "stripes", "kept", "copies", "sources", "shard_sizes", "new_slots")
+
+    def __init__(self, path: str, version: int, size: int, ec: Tuple[int, int]):
+        self.path = path
+        self.version = version  # Version of the file when planned, the conversion is dropped if it changes
+        self.size = size
+        self.ec = ec
+        self.stripes: List[List[Tuple[int, str, int]]] = []  # (shard, chunkserver_id, chunk_id) of every shard per stripe
+        self.kept: Dict[Tuple[str, int], int] = {}  # Replicas kept as data shards -> their part index
+        self.copies: List[Tuple["ChunkEntry", str, int, int]] = []  # (source, target_chunkserver_id, target_chunk_id, part_index)
+        self.sources: List[List[List[str]]] = []  # Replicas of each data shard per stripe as "<chunk_id>@<address>", to encode from
+        self.shard_sizes: List[int] = []  # Bytes of each stripe's first data shard, and of its parity shards
+        self.new_slots: List[Tuple[str, int]] = []  # Slots of copies and parity shards, freed again if the conversion fails
+
+
+class ErasureConverter:
+    """
+    Converts files whose storage policy asks for erasure coding from replicated chunks
+    to Reed-Solomon stripes in the background.
+
+    A conversion plans the stripes and reserves slots under the file's lock, copies the
+    data shards that need to move, has a chunkserver of each stripe read its data shards,
+    compute the parity shards and store them, and only then swaps the file's parts for
+    the stripes. Until that swap the file is read from its replicas as before; the
+    replicas the stripes do not keep are deleted by the garbage collector after the
+    retention period, which outlasts the locations clients may have cached. Files being
+    written, deleted or replaced meanwhile are planned again from scratch.
+    """
+
+    def __init__(self, master: "Master", max_concurrent: int = 2, stripes_in_flight: int = 4,
+                 max_attempts: int = 5, base_backoff: float = 5.0, max_backoff: float = 300.0):
+        self.master = master
+        self.max_concurrent = max_concurrent  # Files converted at once
+        self.stripes_in_flight = stripes_in_flight  # Stripes of a file encoded at once
+        self.max_attempts = max_attempts
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+
+        self.queue: Deque[str] = deque()
+        self.queued: Set[str] = set()
+        self.attempts: Dict[str, int] = defaultdict(int)
+        self.wakeup: Optional[asyncio.Event] = None
+        self.workers: List[asyncio.Task] = []
+        self.client: Optional[httpx.AsyncClient] = None
+
+        # Metrics
+        self.in_flight = 0
+        self.completed = 0
+        self.failed_attempts = 0
+        self.gave_up = 0
+        self.stripes_encoded = 0
+        self.bytes_converted = 0  # File bytes now stored as stripes
+        self.last_conversion_seconds: Optional[float] = None
+
+    # -------- Lifecycle --------
+
+    def start(self):
+        """
+        Starts the worker tasks, must be called from the running event loop.
+        """
+        if self.workers:
+            return
+        self.wakeup = asyncio.Event()
+        self.client = httpx.AsyncClient(timeout=httpx.Timeout(600.0, connect=5.0))
+        self.workers = [asyncio.create_task(self.worker()) for _ in range(self.max_concurrent)]
+        if self.queue:
+            self.wakeup.set()
+
+    async def stop(self):
+        for worker in self.workers:
+            worker.cancel()
+        await asyncio.gather(*self.workers, return_exceptions=True)
+        self.workers = []
+        if self.client is not None:
+            await self.client.aclose()
+            self.client = None
+
+    # -------- Queue --------
+
+    def enqueue(self, path: str):
+        """
+        Queues a file for conversion. Called from the event loop, or before it runs.
+        """
+        if path in self.queued:
+            return
+        self.queued.add(path)
+        self.queue.append(path)
+        if self.wakeup is not None:
+            self.wakeup.set()
+
+    def retry_later(self, path: str):
+        self.attempts[path] += 1
+        if self.attempts[path] >= self.max_attempts:
+            print(f"Giving up converting {path} to erasure coding after {self.attempts[path]} attempts")
+            self.gave_up += 1
+            del self.attempts[path]
+            return
+        delay = min(self.max_backoff, self.base_backoff * 2 ** (self.attempts[path] - 1))
+        asyncio.get_running_loop().call_later(delay, self.enqueue, path)
+
+    # -------- Workers --------
+
+    async def worker(self):
+        while True:
+            if not self.queue:
+                self.wakeup.clear()
+                await self.wakeup.wait()
+                continue
+
+            path = self.queue.popleft()
+            self.queued.discard(path)
+            self.in_flight += 1
+            try:
+                await self.convert(path)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Converting {path} to erasure coding failed: {e}")
+                self.failed_attempts += 1
+                self.retry_later(path)
+            finally:
+                self.in_flight -= 1
+
+    async def convert(self, path: str):
+        master = self.master
+        started = time.perf_counter()
+        # Metadata calls take blocking locks, so they run in worker threads
+        plan = await asyncio.to_thread(master.plan_conversion, path)
+        if plan is None:
+            self.attempts.pop(path, None)
+            return  # Deleted, already converted or no longer asked for
+        # Copies and encoding read the same replicas, encoding does not wait for the copies
+        limit = asyncio.Semaphore(self.stripes_in_flight)
+
+        async def bounded(step):
+            async with limit:
+                await step
+
+        tasks = [asyncio.create_task(bounded(master.copy_chunk(self.client, source, target_chunkserver_id,
+                                                               target_chunk_id, path, part_index)))
+                 for source, target_chunkserver_id, target_chunk_id, part_index in plan.copies]
+        tasks += [asyncio.create_task(bounded(master.encode_stripe(self.client, plan, stripe)))
+                  for stripe in range(len(plan.stripes))]
+        try:
+            await asyncio.gather(*tasks)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            await asyncio.to_thread(master.abort_conversion, plan)
+            raise
+        if not await asyncio.to_thread(master.finish_conversion, plan):
+            await asyncio.to_thread(master.abort_conversion, plan)
+            raise Exception("File changed while it was converted")
+        self.attempts.pop(path, None)
+        self.completed += 1
+        self.stripes_encoded += len(plan.stripes)
+        self.bytes_converted += plan.size
+        self.last_conversion_seconds = time.perf_counter() - started
+
+    # -------- Metrics --------
+
+    def status(self) -> dict:
+        return {
+            "queued": len(self.queue),
+            "in_flight": self.in_flight,
+            "completed": self.completed,
+            "failed_attempts": self.failed_attempts,
+            "gave_up": self.gave_up,
+            "stripes_encoded": self.stripes_encoded,
+            "bytes_converted": self.bytes_converted,
+            "last_conversion_seconds": self.last_conversion_seconds,
+        }
@@ -0,0 +1,235 @@
+import asyncio
+import time
+from typing import TYPE_CHECKING, Dict, List, Optional, Tuple
+
+import httpx
+
+if TYPE_CHECKING:
+    from master import Master
+
+
+class AppendBusy(Exception):
+    """
+    The last chunk of the file is being copied, the client should retry shortly.
+    """
+
+
+class Lease:
+    """
+    A primary's right to order the appends to one chunk, until `expires_at` (master's monotonic clock).
+    """
+    __slots__ = ("primary", "chunk_id", "replicas", "expires_at")
+
+    def __init__(self, primary: str, chunk_id: int, replicas: Tuple[Tuple[str, int], ...], expires_at: float):
+        self.primary = primary
+        self.chunk_id = chunk_id
+        self.replicas = replicas  # (chunkserver_id, chunk_id) of every replica the primary forwards to, primary first
+        self.expires_at = expires_at
+
+
+class AppendCoordinator:
+    """
+    Record appends, GFS style: clients send records to the primary replica of a file's
+    last chunk, which picks the offset of each record and forwards it to the other
+    replicas. The master only hands out leases that make a replica primary.
+
+    A lease is only granted on a chunk whose replicas are all live, with the first
+    replica as primary. Whenever that no longer holds (a replica was lost, the chunk
+    is full, the primary is unreachable) the chunk is sealed instead: one replica pads
+    every replica to the full chunk size, and a fresh last chunk is allocated. So all
+    chunks but the last keep their fixed size, and a replica set never changes while
+    a primary may still be appending to it. Leased chunks are neither re-replicated
+    nor moved, and no lease is granted while a chunk is being copied.
+
+    Leases live in memory only. After a restart the master picks the same primary
+    again, so a lease the primary still holds is simply renewed.
+    """
+
+    def __init__(self, master: "Master", lease_seconds: float = 60.0):
+        self.master = master
+        self.lease_seconds = lease_seconds
+        self.leases: Dict[Tuple[str, int], Lease] = {}  # (path, part_index) -> lease on the part
+        self.locks: Dict[str, asyncio.Lock] = {}  # Serializes lease changes per file
+        self.lock_users: Dict[str, int] = {}
+        self.client: Optional[httpx.AsyncClient] = None
+
+        # Metrics
+        self.granted = 0
+        self.renewed = 0  # Targets answered from a valid lease
+        self.sealed = 0
+        self.failed_grants = 0
+
+    # -------- Lifecycle --------
+
+    def start(self):
+        if self.client is None:
+            self.client = httpx.AsyncClient(timeout=httpx.Timeout(30.0, connect=5.0))
+
+    async def stop(self):
+        if self.client is not None:
+            await self.client.aclose()
+            self.client = None
+
+    # -------- Leases --------
+
+    def leased(self, path: str, part_index: int) -> bool:
+        lease = self.leases.get((path, part_index))
+        return lease is not None and lease.expires_at > time.monotonic()
+
+    async def expire(self):
+        """
+        Drops expired leases and re-replicates their chunks if they lost replicas meanwhile.
+        """
+        now = time.monotonic()
+        expired = [key for key, lease in self.leases.items() if lease.expires_at <= now]
+        for key in expired:
+            del self.leases[key]
+        if expired:
+            # Checking the replicas takes the metadata locks, the loop must not wait on them
+            await asyncio.to_thread(self.replicate_short, expired)
+
+    def replicate_short(self, keys: List[Tuple[str, int]]):
+        for key in keys:
+            if self.master.needs_replication(*key):
+                self.master.replication.enqueue(*key)
+
+    def copying(self, path: str, part_index: int) -> bool:
+        key = (path, part_index)
+        return key in self.master.replication.active or key in self.master.rebalancer.moving
+
+    async def target(self, path: str, full_part: int | None = None) -> dict:
+        """
+        Returns where to append to the file: its last chunk, the primary replica and its
+        chunk id. Creates the file if it does not exist. `full_part` is the part the
+        client found full, the file then gets a new last chunk unless it already has one.
+        """
+        path = self.master.format_path(path)
+        lock = self.locks.setdefault(path, asyncio.Lock())
+        self.lock_users[path] = self.lock_users.get(path, 0) + 1
+        try:
+            async with lock:
+                return await self.find_target(path, full_part)
+        finally:
+            self.lock_users[path] -= 1
+            if not self.lock_users[path]:
+                del self.lock_users[path]
+                del self.locks[path]
+
+    async def find_target(self, path: str, full_part: int | None) -> dict:
+        master = self.master
+        for _ in range(4):  # Every failed lease seals the chunk and moves on to a fresh one
+            # Metadata calls take blocking locks, so they run in worker threads
+            last = await asyncio.to_thread(master.append_snapshot, path)
+            if last is None:
+                try:
+                    await asyncio.to_thread(master.create_file, path, 0, appendable=True)
+                except ValueError:
+                    if not master.file_exists(path):
+                        raise
+                await asyncio.to_thread(master.sync_log)
+                continue
+            part_index, replicas, live, version = last
+            key = (path, part_index)
+
+            if full_part == part_index:
+                await self.seal(path, part_index, live, version)
+                continue
+            lease = self.leases.get(key)
+            if lease is not None and lease.replicas == replicas and self.leased(path, part_index):
+                self.renewed += 1
+                return self.describe(path, part_index, lease, version)
+            if self.copying(path, part_index):
+                raise AppendBusy(f"The last chunk of {path} is being copied.")
+            if (lease is not None and lease.replicas != replicas) or len(live) < max(len(replicas), master.replication_factor):
+                # The replicas changed under a lease, or the chunk is short of replicas
+                await self.seal(path, part_index, live, version)
+                continue
+
+            lease = await self.grant(path, part_index, replicas, version)
+            if lease is not None:
+                return self.describe(path, part_index, lease, version)
+            await self.seal(path, part_index, live, version)
+        raise Exception(f"Could not get a lease on the last chunk of {path}.")
+
+    async def grant(self, path: str, part_index: int, replicas: Tuple[Tuple[str, int], ...], version: int) -> Lease | None:
+        """
+        Makes the first replica primary. The lease is held from before the request is
+        sent, so no copy of the chunk can start meanwhile, and counts from when the
+        primary answered, so it never ends before the primary's own.
+        """
+        master = self.master
+        key = (path, part_index)
+        primary, chunk_id = replicas[0]
+        lease = self.leases[key] = Lease(primary, chunk_id, replicas, time.monotonic() + self.lease_seconds)
+        try:
+            resp = await self.client.post(f"{master.chunkserver_url(primary)}/grant_lease", json={
+                "chunk_id": chunk_id,
+                "version": version,
+                "chunk_size": master.max_chunk_size,
+                "lease_seconds": self.lease_seconds,
+                "secondaries": [f"{replica_chunk_id}@{chunkserver_id}" for chunkserver_id, replica_chunk_id in replicas[1:]],
+            })
+            if resp.status_code != 200:
+                raise Exception(f"{resp.status_code} {resp.text}")
+        except Exception as e:
+            print(f"Granting {primary} the lease on {path}[{part_index}] failed: {e}")
+            self.failed_grants += 1
+            return None
+        lease.expires_at = time.monotonic() + self.lease_seconds
+        self.granted += 1
+        return lease
+
+    async def seal(self, path: str, part_index: int, live: Tuple[Tuple[str, int], ...], version: int):
+        """
+        Pads every replica of the part to the full chunk size through one of them and
+        gives the file a new last chunk. Replicas that missed the padding are dropped.
+        """
+        master = self.master
+        lease = self.leases.pop((path, part_index), None)
+        # The primary orders the padding after the appends it has queued
+        sealers = sorted(live, key=lambda replica: lease is None or replica[0] != lease.primary)
+        sealed_on = None
+        for chunkserver_id, chunk_id in sealers:
+            others = [f"{other_chunk_id}@{other_id}" for other_id, other_chunk_id in live if other_id != chunkserver_id]
+            try:
+                resp = await self.client.post(f"{master.chunkserver_url(chunkserver_id)}/seal_chunk/{chunk_id}", json={
+                    "version": version,
+                    "chunk_size": master.max_chunk_size,
+                    "secondaries": others,
+                })
+                if resp.status_code == 200:
+                    sealed_on = set(resp.json()["replicas"])
+                    break
+                print(f"Sealing {path}[{part_index}] on {chunkserver_id} failed: {resp.status_code} {resp.text}")
+            except Exception as e:
+                print(f"Sealing {path}[{part_index}] on {chunkserver_id} failed: {e}")
+        if sealed_on is None:
+            raise Exception(f"No replica of {path}[{part_index}] could be sealed.")
+        await asyncio.to_thread(master.add_part, path, part_index, sealed_on)
+        await asyncio.to_thread(master.sync_log)
+        self.sealed += 1
+
+    def describe(self, path: str, part_index: int, lease: Lease, version: int) -> dict:
+        return {
+            "path": path,
+            "part_index": part_index,
+            "chunk_size": self.master.max_chunk_size,
+            "version": version,
+            "primary": lease.primary,
+            "chunk_id": lease.chunk_id,
+            "replicas": [chunkserver_id for chunkserver_id, _ in lease.replicas],
+            "lease_seconds": max(0.0, lease.expires_at - time.monotonic()),
+        }
+
+    # -------- Metrics --------
+
+    def status(self) -> dict:
+        now = time.monotonic()
+        return {
+            "active_leases": sum(lease.expires_at > now for lease in self.leases.values()),
+            "lease_seconds": self.lease_seconds,
+            "granted": self.granted,
+            "renewed": self.renewed,
+            "sealed": self.sealed,
+            "failed_grants": self.failed_grants,
+        }
@@ -0,0 +1,135 @@
+import threading
+import zlib
+from contextlib import contextmanager
+from typing import Iterable, List
+
+
+class RWLock:
+    """
+    Readers-writer lock. Any number of threads may read at once, a writer runs alone.
+    Waiting writers go first, so a stream of readers cannot starve them.
+
+    A thread may take a lock again that it already holds, and read under its own
+    write lock. It may not write while it only holds the lock for reading, that
+    could deadlock against another reader doing the same.
+    """
+
+    def __init__(self):
+        self.cond = threading.Condition(threading.Lock())
+        self.readers = 0
+        self.writer: int | None = None  # Thread holding the write lock
+        self.write_depth = 0
+        self.waiting_writers = 0
+        self.local = threading.local()  # Per thread: read depth, and whether this thread counts in `readers`
+
+    def acquire_read(self):
+        local = self.local
+        depth = getattr(local, "depth", 0)
+        if depth or self.writer == threading.get_ident():
+            if not depth:
+                local.counted = False  # Reading under its own write lock
+            local.depth = depth + 1
+            return
+        with self.cond:
+            while self.writer is not None or self.waiting_writers:
+                self.cond.wait()
+            self.readers += 1
+        local.depth = 1
+        local.counted = True
+
+    def release_read(self):
+        local = self.local
+        local.depth -= 1
+        if local.depth == 0 and local.counted:
+            with self.cond:
+                self.readers -= 1
+                if not self.readers:
+                    self.cond.notify_all()
+
+    def acquire_write(self):
+        me = threading.get_ident()
+        if self.writer == me:
+            self.write_depth += 1
+            return
+        if getattr(self.local, "depth", 0):
+            raise RuntimeError("Cannot take a write lock while holding the read lock")
+        with self.cond:
+            self.waiting_writers += 1
+            try:
+                while self.writer is not None or self.readers:
+                    self.cond.wait()
+            finally:
+                self.waiting_writers -= 1
+            self.writer = me
+            self.write_depth = 1
+
+    def release_write(self):
+        self.write_depth -= 1
+        if not self.write_depth:
+            with self.cond:
+                self.writer = None
+                self.cond.notify_all()
+
+    @contextmanager
+    def read(self):
+        self.acquire_read()
+        try:
+            yield
+        finally:
+            self.release_read()
+
+    @contextmanager
+    def write(self):
+        self.acquire_write()
+        try:
+            yield
+        finally:
+            self.release_write()
+
+
+class ShardedLock:
+    """
+    Readers-writer locks striped by path hash, so operations on different files
+    rarely wait for each other. Several shards are always taken in index order.
+    """
+
+    def __init__(self, shards: int = 64):
+        self.shards: List[RWLock] = [RWLock() for _ in range(shards)]
+
+    def index(self, path: str) -> int:
+        return zlib.crc32(path.encode()) % len(self.shards)
+
+    def read(self, path: str):
+        return self.shards[self.index(path)].read()
+
+    def write(self, path: str):
+        return self.shards[self.index(path)].write()
+
+    @contextmanager
+    def read_all(self):
+        with self.hold(range(len(self.shards)), write=False):
+            yield
+
+    @contextmanager
+    def write_all(self):
+        with self.hold(range(len(self.shards)), write=True):
+            yield
+
+    @contextmanager
+    def hold(self, indexes: Iterable[int], write: bool):
+        taken = []
+        try:
+            for index in sorted(set(indexes)):
+                shard = self.shards[index]
+                if write:
+                    shard.acquire_write()
+                else:
+                    shard.acquire_read()
+                taken.append(shard)
+            yield
+        finally:
+            for shard in reversed(taken):
+                if write:
+                    shard.release_write()
+                else:
+                    shard.release_read()
@@ -1,15 +1,37 @@
 import asyncio
+from contextlib import asynccontextmanager, contextmanager, nullcontext
 from fastapi import FastAPI
 from pydantic import BaseModel
-from typing import List, Dict, Set
+from typing import Callable, List, Dict, Set, Tuple, Deque
+from collections import defaultdict, deque
 import random
-from typing import TypedDict
+from typing import NotRequired, TypedDict
+import json
 import time
+import heapq
+import itertools
+import threading
 
 import uvicorn
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi import HTTPException
+from fastapi.responses import PlainTextResponse, StreamingResponse
 import httpx
+import os
+import sys
+
+# Modules shared between the services live in common/; images copy them next to this file
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "common"))
+
+from conversion import ConversionPlan, ErasureConverter
+from leases import AppendBusy, AppendCoordinator
+from locks import RWLock, ShardedLock
+from metrics import Registry, RequestMetrics, StackSampler
+from namespace import NamespaceNode, NamespaceTree
+from oplog import OperationLog
+from placement import PlacementPolicy, make_policy
+from rebalancer import Rebalancer
+from replication import ReplicationScheduler
 
 # GFS Master Node Implementation
 class ChunkEntry(TypedDict):
@@ -17,25 +39,657 @@ class ChunkEntry(TypedDict):
     chunk_id: int
     is_deleted: bool
     deleted_at: float | None
+    shard: NotRequired[int]  # Index in its stripe, only in the parts of erasure coded files
+
+class FileLayout(TypedDict):
+    # Compact, columnar view of a file's chunk placement. Replicas of part
+    # `offset + i` are at positions replica_offsets[i]..replica_offsets[i + 1]
+    # of server_indexes/chunk_ids; server_indexes point into `servers`.
+    # Parts of erasure coded files are stripes of `ec` = [data shards, parity
+    # shards] chunks, `shards` then holds each entry's index in its stripe.
+    path: str
+    size: int  # File size in bytes, the last chunk holds the remainder
+    chunk_size: int
+    chunk_count: int
+    offset: int
+    servers: List[str]
+    replica_offsets: List[int]
+    server_indexes: List[int]
+    chunk_ids: List[int]
+    version: int  # Chunk version, chunkservers reject reads that ask for another one
+    lease_seconds: float  # How long clients may use these locations without asking again
+    ec: NotRequired[List[int]]
+    shards: NotRequired[List[int]]
+
+class BatchLayout(TypedDict):
+    # Layouts of many files in FileLayout's columnar format, all sharing one `servers`
+    # table. Each entry of `files` has path, size, chunk_count, version, replica_offsets,
+    # server_indexes and chunk_ids (plus ec and shards if erasure coded), or only path
+    # and error if the file cannot be read.
+    chunk_size: int
+    lease_seconds: float
+    servers: List[str]
+    files: List[dict]
+
+class ChunkSlotAllocator:
+    """
+    Hands out chunk ids on a single chunkserver in O(1).
+    Ids below the high-water mark that were released are reused first.
+    Capacity is the number of full-size chunks the chunkserver's disk can hold.
+    """
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.next_free = 0  # Lowest id that has never been handed out
+        self.released: List[int] = []  # Ids below next_free that are free again
+        self.used = 0
+
+    @property
+    def free(self) -> int:
+        return max(0, self.capacity - self.used)
+
+    def allocate(self) -> int:
+        if self.used >= self.capacity:
+            raise Exception("No available chunk found on the chunkserver.")
+        if self.released:
+            chunk_id = self.released.pop()
+        else:
+            chunk_id = self.next_free
+            self.next_free += 1
+        self.used += 1
+        return chunk_id
+
+    def allocate_many(self, count: int) -> List[int]:
+        if count > self.free:
+            raise Exception("No available chunk found on the chunkserver.")
+        reused = min(count, len(self.released))
+        chunk_ids = self.released[len(self.released) - reused:]
+        del self.released[len(self.released) - reused:]
+        fresh = count - reused
+        chunk_ids.extend(range(self.next_free, self.next_free + fresh))
+        self.next_free += fresh
+        self.used += count
+        return chunk_ids
+
+    def release(self, chunk_id: int):
+        self.released.append(chunk_id)
+        self.used -= 1
+
+    def reserve(self, chunk_ids: Set[int]):
+        """
+        Marks specific free ids as used, e.g. chunks a chunkserver reports that nobody allocated.
+        """
+        if not chunk_ids:
+            return
+        high = max(chunk_ids) + 1
+        if high > self.next_free:
+            self.released.extend(range(high - 1, self.next_free - 1, -1))
+            self.next_free = high
+        self.released = [chunk_id for chunk_id in self.released if chunk_id not in chunk_ids]
+        self.used += len(chunk_ids)
+
+    @classmethod
+    def from_used(cls, capacity: int, used: Set[int]) -> "ChunkSlotAllocator":
+        allocator = cls(capacity)
+        allocator.next_free = max(used, default=-1) + 1
+        allocator.released = [chunk_id for chunk_id in range(allocator.next_free - 1, -1, -1) if chunk_id not in used]
+        allocator.used = len(used)
+        return allocator
+
+
+class ChunkserverPool:
+    """
+    Max-heap of chunkservers ordered by free slots. Entries are invalidated
+    lazily: an entry is only valid if it matches the latest free count.
+    Ties are served in insertion order so equally full servers take turns.
+    """
 
-class Master:
+    def __init__(self):
+        self.heap: List[Tuple[int, int, str]] = []
+        self.free: Dict[str, int] = {}
+        self.counter = itertools.count()
+
+    def update(self, chunkserver_id: str, free: int):
+        self.free[chunkserver_id] = free
+        if free > 0:
+            heapq.heappush(self.heap, (-free, next(self.counter), chunkserver_id))
+        if len(self.heap) > 4 * len(self.free) + 64:
+            self.rebuild()
+
+    def remove(self, chunkserver_id: str):
+        self.free.pop(chunkserver_id, None)
+
+    def rebuild(self):
+        self.heap = [(-free, next(self.counter), chunkserver_id)
+                     for chunkserver_id, free in self.free.items() if free > 0]
+        heapq.heapify(self.heap)
+
+    def take(self, count: int, exclude: Set[str] = frozenset()) -> List[str]:
+        """
+        Returns up to `count` distinct chunkservers with the most free slots.
+        The caller must call update() for every returned server.
+        """
+        chosen: List[str] = []
+        skipped = []
+        while self.heap and len(chosen) < count:
+            entry = heapq.heappop(self.heap)
+            neg_free, _, chunkserver_id = entry
+            if self.free.get(chunkserver_id) != -neg_free or chunkserver_id in chosen:
+                continue  # Stale entry
+            if chunkserver_id in exclude:
+                skipped.append(entry)
+                continue
+            chosen.append(chunkserver_id)
+        for entry in skipped:
+            heapq.heappush(self.heap, entry)
+        return chosen
 
 
-    def __init__(self):
+class Master:
+    """
+    Metadata of the file system. HTTP handlers call into it from the threadpool while
+    the event loop runs heartbeats, garbage collection, re-replication and rebalancing,
+    so shared state is guarded by locks, always taken in this order:
+
+    - `path_locks`, sharded by path: the replica lists of the files hashing to a shard.
+      Reads of a file take its shard shared, creates, deletes and replica changes exclusive.
+    - `namespace_lock`: the directory tree, which files exist and are deleted, and the
+      deletion queue. Listings and lookups share it.
+    - `allocation_lock`: chunk slots, the chunkserver tables and the reverse chunk index.
+      Held only for short sections, so allocation is atomic.
+
+    Nothing is awaited while holding a lock.
+    """
+
+    def __init__(self, data_dir: str | None = None):
         self.rand = random.Random(69)
         self.replication_factor: int = 3 # Number of replicas for each chunk
-        self.chunkserver_capacity: int = 5000 # The maximum number of characters a chunkserver can store
-        self.max_chunk_size: int = 1000 # The number of characters in a chunk
+        self.max_chunk_size: int = int(os.getenv("CHUNK_SIZE", 64 * 1024 * 1024)) # The number of bytes in a chunk
+        self.chunkserver_capacity: int = int(os.getenv("CHUNKSERVER_CAPACITY", 5000 * self.max_chunk_size)) # Bytes a chunkserver is assumed to hold until it reports its disk
 
         self.last_garbage_collection: float = 0.0  # Timestamp of the last garbage collection
-        self.garbage_collection_time: float = 2 * 60  # Time in seconds before deleted chunks are eligible for garbage collection (default: 2 minutes)
-
-        self.heartbeat_timeout: float = 5 * 60  # Time in seconds before a chunkserver is considered unresponsive
+        self.garbage_collection_time: float = float(os.getenv("GC_RETENTION_SECONDS", 2 * 60))  # Time in seconds before deleted chunks are eligible for garbage collection (default: 2 minutes)
+        self.background_interval: float = float(os.getenv("BACKGROUND_INTERVAL_SECONDS", 5))  # Pause between heartbeat checks and GC cycles
+        self.deletion_queue: Deque[Tuple[float, str | None, List[List[ChunkEntry]]]] = deque()  # (deleted_at, path, parts) of deleted files, oldest first
+        self.gc_cursor: int = 0  # Parts of the queue head that were already reclaimed
+        self.gc_batch_size: int = 10_000  # Chunks reclaimed per slice before yielding to the event loop
+        self.pending_deletes: Dict[str, Set[int]] = defaultdict(set)  # Chunks whose delete a chunkserver has not acked yet
+        self.gc_stats = {
+            "cycles": 0,
+            "last_cycle_seconds": None,
+            "last_cycle_slices": 0,
+            "last_max_slice_seconds": None,  # Longest time the event loop was held by one slice
+            "last_reclaimed_chunks": 0,
+            "last_reclaimed_bytes": 0,
+            "total_reclaimed_chunks": 0,
+            "total_reclaimed_bytes": 0,
+        }
+
+        self.heartbeat_timeout: float = float(os.getenv("HEARTBEAT_TIMEOUT", 30))  # Time in seconds before a chunkserver is considered unresponsive
 
         self.chunkserver_ids: Set[str] = set()  # Set of registered chunkserver IDs
+        self.chunkserver_list: List[str] = []  # The same chunkservers in a list, for random sampling
+        self.labels: Dict[str, Dict[str, str]] = {}  # Labels each chunkserver registered with, e.g. {"rack": "r1", "zone": "z1"}
         self.last_heartbeat: Dict[str, float] = {}  # Stores last heartbeat time for each chunkserver
+        self.disk_usage: Dict[str, Tuple[int, int]] = {}  # (used_bytes, free_bytes) last reported by each chunkserver
+        self.load: Dict[str, dict] = {}  # Load stats from each chunkserver's last heartbeat (requests in flight, throughput, copies)
         self.chunkservers: Dict[str, Set[int]] = {}  # Maps chunkserver_id to set of stored chunks
         self.files: Dict[str, List[List[ChunkEntry]]] = {}  # Maps file path to list of chunk replicas, each replica is a dict with 'chunkserver_id' and 'chunk_id'
+        self.namespace = NamespaceTree()  # Directory tree of every path in self.files
+        self.chunk_locations: Dict[Tuple[str, int], Tuple[str, int, ChunkEntry]] = {}  # Reverse index: (chunkserver_id, chunk_id) -> (path, part_index, replica)
+        self.allocators: Dict[str, ChunkSlotAllocator] = {}  # Free chunk slots per chunkserver
+        self.pool = ChunkserverPool()  # Chunkservers ordered by free slots, used to pick replica targets
+        self.path_locks = ShardedLock(int(os.getenv("METADATA_LOCK_SHARDS", 64)))
+        self.namespace_lock = RWLock()
+        self.allocation_lock = threading.RLock()
+        # Picks the chunkservers new replicas go to, e.g. "most_free", "p2c" or "p2c+rack"
+        self.placement: PlacementPolicy = make_policy(os.getenv("PLACEMENT_POLICY", "most_free"))
+
+        # Chunkserver ids are the addresses clients use, which may not be reachable from the master
+        # (e.g. inside Docker). PEER_ADDRESSES maps them: "http://localhost:8001=http://chunkserver1:8000,..."
+        self.peer_addresses: Dict[str, str] = dict(
+            pair.split("=", 1) for pair in os.getenv("PEER_ADDRESSES", "").split(",") if "=" in pair
+        )
+        self.replication = ReplicationScheduler(
+            self,
+            max_concurrent=int(os.getenv("REPLICATION_CONCURRENCY", 16)),
+            per_source=int(os.getenv("REPLICATION_PER_SOURCE", 4)),
+            per_target=int(os.getenv("REPLICATION_PER_TARGET", 4)),
+        )
+        self.rebalancer = Rebalancer(
+            self,
+            bytes_per_second=int(os.getenv("REBALANCE_BYTES_PER_SECOND", 32 * 1024 * 1024)),
+            max_concurrent=int(os.getenv("REBALANCE_CONCURRENCY", 4)),
+            threshold=float(os.getenv("REBALANCE_THRESHOLD", 0.1)),
+            interval=float(os.getenv("REBALANCE_INTERVAL_SECONDS", 60)),
+        )
+        self.appends = AppendCoordinator(self, lease_seconds=float(os.getenv("APPEND_LEASE_SECONDS", 60)))
+        self.converter = ErasureConverter(
+            self,
+            max_concurrent=int(os.getenv("EC_CONVERSION_CONCURRENCY", 2)),
+            stripes_in_flight=int(os.getenv("EC_STRIPES_IN_FLIGHT", 4)),
+        )
+        # Copies the master asked a chunkserver to pull, resolved when the target reports back
+        self.pending_copies: Dict[Tuple[str, int], asyncio.Future] = {}
+        self.copy_timeout = float(os.getenv("REPLICATION_COPY_TIMEOUT", 600))  # Seconds to wait for a copy report
+
+        self.next_version: int = 1  # Version given to the chunks of the next created file
+        self.location_lease: float = float(os.getenv("LOCATION_LEASE_SECONDS", 60))  # Seconds clients may cache chunk locations, keep below the GC retention
+        self.batch_page_size: int = 1000  # Files per page of a streamed batch response
+
+        self.checkpoint_interval: int = 50_000  # Number of logged operations between metadata checkpoints
+        self.oplog: OperationLog | None = None  # Write-ahead log of metadata changes, None keeps metadata in memory only
+        self.metrics = Registry()  # Served on GET /metrics
+        self.init_metrics()
+        if data_dir:
+            oplog = OperationLog(data_dir)
+            last_seq = self.recover(oplog)
+            oplog.start(last_seq)
+            self.oplog = oplog
+
+    # -------- Metrics --------
+
+    def init_metrics(self):
+        """
+        Histograms are updated where the work happens, everything else is read from the
+        master's state when the metrics are scraped and costs nothing in between.
+        """
+        metrics = self.metrics
+        self.request_seconds = metrics.histogram(
+            "gfs_master_request_seconds", "Latency of API requests.", ("method", "endpoint", "status"))
+        self.allocation_seconds = metrics.histogram(
+            "gfs_master_allocation_seconds", "Time to pick chunkservers and slots for new chunks, allocation lock held.",
+            ("kind",))
+        self.oplog_sync_seconds = metrics.histogram(
+            "gfs_master_oplog_sync_seconds", "Time requests wait for their metadata changes to be on disk.")
+        self.gc_cycle_seconds = metrics.histogram(
+            "gfs_master_gc_cycle_seconds", "Duration of garbage collection cycles, chunk deletes included.",
+            buckets=(0.001, 0.01, 0.1, 0.5, 1.0, 5.0, 15.0, 60.0, 300.0))
+        self.gc_slice_seconds = metrics.histogram(
+            "gfs_master_gc_slice_seconds", "Time the event loop is held by one garbage collection slice.")
+        self.heartbeat_interval_seconds = metrics.histogram(
+            "gfs_master_heartbeat_interval_seconds", "Time between two heartbeats of the same chunkserver.",
+            buckets=(1.0, 2.5, 5.0, 7.5, 10.0, 15.0, 20.0, 30.0, 60.0, 120.0))
+
+        def heartbeat_ages():
+            now = time.time()
+            with self.allocation_lock:
+                return {(chunkserver_id,): now - last for chunkserver_id, last in self.last_heartbeat.items()}
+
+        metrics.gauge("gfs_master_heartbeat_age_seconds", "Seconds since each chunkserver's last heartbeat.",
+                      ("chunkserver",), fn=heartbeat_ages)
+        metrics.gauge("gfs_master_chunkservers", "Registered chunkservers.", fn=lambda: len(self.chunkserver_ids))
+        metrics.gauge("gfs_master_files", "Files in the namespace, deleted ones not yet reclaimed included.",
+                      fn=lambda: len(self.files))
+        metrics.gauge("gfs_master_replication_queue_depth", "File parts waiting to be re-replicated.",
+                      fn=lambda: len(self.replication.queue))
+        metrics.gauge("gfs_master_replication_retrying", "File parts waiting out a retry backoff.",
+                      fn=lambda: self.replication.delayed)
+        metrics.gauge("gfs_master_replication_in_flight", "Re-replication copies in flight.",
+                      fn=lambda: self.replication.in_flight)
+        metrics.counter("gfs_master_replication_completed_total", "Re-replication copies that succeeded.",
+                        fn=lambda: self.replication.completed)
+        metrics.counter("gfs_master_replication_failed_total", "Re-replication copies that failed.",
+                        fn=lambda: self.replication.failed_attempts)
+        metrics.gauge("gfs_master_rebalance_in_flight", "Replica moves in flight.", fn=lambda: self.rebalancer.in_flight)
+        metrics.gauge("gfs_master_deletion_queue_files", "Deleted files waiting for the garbage collector.",
+                      fn=lambda: len(self.deletion_queue))
+        metrics.counter("gfs_master_gc_reclaimed_chunks_total", "Chunks the garbage collector reclaimed.",
+                        fn=lambda: self.gc_stats["total_reclaimed_chunks"])
+        metrics.counter("gfs_master_gc_reclaimed_bytes_total", "Bytes the garbage collector freed on chunkservers.",
+                        fn=lambda: self.gc_stats["total_reclaimed_bytes"])
+        metrics.gauge("gfs_master_append_leases", "Active record append leases.",
+                      fn=lambda: self.appends.status()["active_leases"])
+        metrics.gauge("gfs_master_ec_conversion_queue_depth", "Files waiting to be converted to erasure coding.",
+                      fn=lambda: len(self.converter.queue))
+        metrics.counter("gfs_master_ec_converted_files_total", "Files converted to erasure coding.",
+                        fn=lambda: self.converter.completed)
+
+    # -------- Operation log --------
+
+    def log_operation(self, op: str, **fields):
+        if self.oplog is not None:
+            self.oplog.append({"op": op, **fields})
+
+    def sync_log(self):
+        """
+        Blocks until every logged operation is on disk (shares the fsync with concurrent callers).
+        """
+        if self.oplog is not None:
+            with self.oplog_sync_seconds.timer():
+                self.oplog.wait()
+
+    def checkpoint_if_needed(self):
+        if self.oplog is not None and self.oplog.records_since_checkpoint >= self.checkpoint_interval:
+            self.checkpoint()
+
+    def checkpoint(self):
+        """
+        Writes a checkpoint of all metadata. Runs in a worker thread: the snapshot holds
+        every lock, the event loop keeps serving heartbeats meanwhile.
+        """
+        # The snapshot must match the log position exactly, so nothing may be logged in between
+        with self.path_locks.read_all(), self.namespace_lock.read(), self.allocation_lock:
+            state = self.export_state()
+            seq = self.oplog.begin_checkpoint()
+        self.oplog.finish_checkpoint(seq, state)
+
+    def export_state(self) -> dict:
+        """
+        Snapshots the metadata in one pass over the files, looking each path up once.
+        The caller holds every lock.
+        """
+        files: Dict[str, list] = {}
+        sizes: Dict[str, int] = {}
+        versions: Dict[str, int] = {}
+        appendable: List[str] = []
+        ec: Dict[str, List[int]] = {}
+        striped: List[str] = []
+        lookup = self.namespace.lookup
+        for path, parts in self.files.items():
+            node = lookup(path)
+            if node.striped:
+                files[path] = [[(chunk['chunkserver_id'], chunk['chunk_id'], chunk['is_deleted'], chunk['deleted_at'],
+                                 chunk['shard']) for chunk in replicas] for replicas in parts]
+            else:
+                files[path] = [[(chunk['chunkserver_id'], chunk['chunk_id'], chunk['is_deleted'], chunk['deleted_at'])
+                                for chunk in replicas] for replicas in parts]
+            sizes[path] = node.size
+            versions[path] = node.version
+            if node.appendable:
+                appendable.append(path)
+            if node.ec:
+                ec[path] = list(node.ec)
+            if node.striped:
+                striped.append(path)
+        return {
+            "chunkservers": {chunkserver_id: list(chunk_ids) for chunkserver_id, chunk_ids in self.chunkservers.items()},
+            "files": files,
+            "sizes": sizes,
+            "versions": versions,
+            "appendable": appendable,
+            "ec": ec,
+            "striped": striped,
+            "next_version": self.next_version,
+            "labels": {chunkserver_id: dict(labels) for chunkserver_id, labels in self.labels.items()},
+        }
+
+    def load_state(self, state: dict):
+        now = time.time()
+        self.chunkserver_ids = set(state["chunkservers"])
+        self.chunkserver_list = list(state["chunkservers"])
+        self.labels = {chunkserver_id: labels for chunkserver_id, labels in state.get("labels", {}).items()
+                       if chunkserver_id in self.chunkserver_ids}
+        self.chunkservers = {chunkserver_id: set(chunk_ids) for chunkserver_id, chunk_ids in state["chunkservers"].items()}
+        self.last_heartbeat = {chunkserver_id: now for chunkserver_id in self.chunkserver_ids}
+        self.files = {
+            path: [[self.chunk_entry(*row) for row in replicas] for replicas in parts]
+            for path, parts in state["files"].items()
+        }
+        self.chunk_locations = {}
+        self.namespace = NamespaceTree()
+        appendable = set(state.get("appendable", ()))
+        ec = state.get("ec", {})
+        striped = set(state.get("striped", ()))
+        for path in self.files:
+            self.index_file(path)
+            # Metadata written before versions existed has version 0 (unchecked) everywhere
+            self.namespace.add_file(path, state["sizes"][path], state.get("versions", {}).get(path, 0), path in appendable)
+            node = self.namespace.lookup(path)
+            node.deleted_at = self.deletion_time(self.files[path])
+            node.ec = tuple(ec[path]) if path in ec else None
+            node.striped = path in striped
+        self.next_version = state.get("next_version", 1)
+        self.rebuild_allocators()
+
+    def rebuild_allocators(self):
+        self.allocators = {
+            chunkserver_id: ChunkSlotAllocator.from_used(self.slot_capacity(chunkserver_id), chunk_ids)
+            for chunkserver_id, chunk_ids in self.chunkservers.items()
+        }
+        self.pool = ChunkserverPool()
+        for chunkserver_id in self.allocators:
+            self.update_pool(chunkserver_id)
+
+    # -------- Disk space --------
+
+    def slot_capacity(self, chunkserver_id: str) -> int:
+        """
+        Number of full-size chunks the chunkserver's disk can hold.
+        """
+        if chunkserver_id in self.disk_usage:
+            used_bytes, free_bytes = self.disk_usage[chunkserver_id]
+            return (used_bytes + free_bytes) // self.max_chunk_size
+        return self.chunkserver_capacity // self.max_chunk_size
+
+    def free_slots(self, chunkserver_id: str) -> int:
+        """
+        Chunks that can still be placed on the chunkserver. Every allocated chunk is
+        charged a full chunk, and the count never exceeds the bytes actually free on disk.
+        """
+        free = self.allocators[chunkserver_id].free
+        if chunkserver_id in self.disk_usage:
+            free = min(free, self.disk_usage[chunkserver_id][1] // self.max_chunk_size)
+        return free
+
+    def update_pool(self, chunkserver_id: str):
+        self.pool.update(chunkserver_id, self.free_slots(chunkserver_id))
+
+    def update_disk_usage(self, chunkserver_id: str, used_bytes: int | None, free_bytes: int | None):
+        if used_bytes is None or free_bytes is None:
+            return
+        self.disk_usage[chunkserver_id] = (used_bytes, free_bytes)
+        self.allocators[chunkserver_id].capacity = self.slot_capacity(chunkserver_id)
+        self.update_pool(chunkserver_id)
+
+    def recover(self, oplog: OperationLog) -> int:
+        """
+        Rebuilds metadata from the latest checkpoint plus the log tail.
+        Returns the sequence number of the last applied operation.
+        """
+        start = time.time()
+        seq, state = oplog.load_checkpoint()
+        if state is not None:
+            self.load_state(state)
+
+        replayed = 0
+        for record in oplog.read_records(seq):
+            self.apply_operation(record)
+            seq = record["seq"]
+            replayed += 1
+
+        self.rebuild_allocators()
+        self.rebuild_deletion_queue()
+        # Conversions to erasure coding that did not finish start over
+        for path in self.files:
+            node = self.namespace.lookup(path)
+            if node.ec and not node.striped and node.deleted_at is None:
+                self.converter.enqueue(path)
+
+        print(f"Recovered {len(self.files)} files and {len(self.chunkserver_ids)} chunkservers "
+              f"({replayed} logged operations) in {time.time() - start:.2f}s")
+        return seq
+
+    def apply_operation(self, record: dict):
+        """
+        Re-applies a logged operation during recovery. Operations carry their
+        results (chunk placement, timestamps), so replay never allocates.
+        """
+        op = record["op"]
+        if op == "register":
+            self.register_chunkserver(record["chunkserver_id"], labels=record.get("labels"))
+        elif op == "labels":
+            self.set_labels(record["chunkserver_id"], record["labels"])
+        elif op == "orphan":
+            self.chunkservers[record["chunkserver_id"]].update(record["chunks"])
+        elif op == "disconnect":
+            if record["chunkserver_id"] in self.chunkserver_ids:
+                self.disconnect_chunkserver(record["chunkserver_id"], replicate=False)
+        elif op == "create":
+            path = record["path"]
+            if path in self.files:
+                self.unindex_file(path)
+            # Chunks are (chunkserver_id, chunk_id), plus the shard index in erasure coded files
+            self.files[path] = [
+                [self.chunk_entry(row[0], row[1], shard=row[2] if len(row) > 2 else None) for row in replicas]
+                for replicas in record["chunks"]
+            ]
+            for replicas in record["chunks"]:
+                for chunkserver_id, chunk_id, *_ in replicas:
+                    self.chunkservers[chunkserver_id].add(chunk_id)
+            self.index_file(path)
+            self.namespace.add_file(path, record["size"], record.get("version", 0), record.get("appendable", False))
+            if record.get("ec"):
+                node = self.namespace.lookup(path)
+                node.ec = tuple(record["ec"])
+                node.striped = True
+            self.next_version = max(self.next_version, record.get("version", 0) + 1)
+        elif op == "extend":
+            path = record["path"]
+            if record.get("chunks"):
+                replicas = [ChunkEntry(chunkserver_id=chunkserver_id, chunk_id=chunk_id, is_deleted=False, deleted_at=None)
+                            for chunkserver_id, chunk_id in record["chunks"]]
+                self.files[path].append(replicas)
+                for chunk in replicas:
+                    self.chunkservers[chunk['chunkserver_id']].add(chunk['chunk_id'])
+                    self.index_chunk(path, len(self.files[path]) - 1, chunk)
+            self.namespace.lookup(path).size = record["size"]
+        elif op == "delete":
+            self.tombstone(record["path"], record["deleted_at"])
+        elif op == "delete_prefix":
+            self.tombstone_prefix(record["path"], record["deleted_at"])
+        elif op == "replicate":
+            if (record["chunkserver_id"], record["chunk_id"]) in self.chunk_locations:
+                return
+            chunk = self.chunk_entry(record["chunkserver_id"], record["chunk_id"], shard=record.get("shard"))
+            self.files[record["path"]][record["part_index"]].append(chunk)
+            self.chunkservers[chunk['chunkserver_id']].add(chunk['chunk_id'])
+            self.index_chunk(record["path"], record["part_index"], chunk)
+        elif op == "remove":
+            if (record["chunkserver_id"], record["chunk_id"]) in self.chunk_locations:
+                self.remove_chunkentry(ChunkEntry(chunkserver_id=record["chunkserver_id"], chunk_id=record["chunk_id"],
+                                                  is_deleted=False, deleted_at=None))
+        elif op == "reclaim":
+            for chunkserver_id, chunk_id in record["chunks"]:
+                location = self.chunk_locations.get((chunkserver_id, chunk_id))
+                if location is not None:
+                    self.files[location[0]][location[1]].remove(location[2])
+                    self.unindex_chunk(location[2])
+                if chunkserver_id in self.chunkservers:
+                    self.chunkservers[chunkserver_id].discard(chunk_id)
+            for path in record.get("paths", ()):
+                if path in self.files:
+                    self.unindex_file(path)
+                    del self.files[path]
+                    self.namespace.remove_file(path)
+        elif op == "policy":
+            self.namespace.lookup(record["path"]).ec = tuple(record["ec"])
+        elif op == "convert":
+            # Replicas the stripes do not keep stay allocated without a file, recovery reclaims them as orphans
+            path = record["path"]
+            self.unindex_file(path)
+            self.files[path] = [[self.chunk_entry(chunkserver_id, chunk_id, shard=shard) for chunkserver_id, chunk_id, shard in stripe]
+                                for stripe in record["stripes"]]
+            for stripe in record["stripes"]:
+                for chunkserver_id, chunk_id, _ in stripe:
+                    self.chunkservers[chunkserver_id].add(chunk_id)
+            self.index_file(path)
+            self.namespace.lookup(path).striped = True
+        else:
+            raise ValueError(f"Unknown operation in log: {op}")
+
+    def rebuild_deletion_queue(self):
+        """
+        Re-queues every deleted file after recovery, plus chunks that are allocated
+        but belong to no file (e.g. of a deleted file that was replaced) for immediate
+        reclaim. This is the only full scan, the GC itself only walks the queue.
+        """
+        deleted = []
+        for path, parts in self.files.items():
+            deleted_at = self.deletion_time(parts)
+            if deleted_at is not None:
+                deleted.append((deleted_at, path, parts))
+        deleted.sort(key=lambda entry: entry[0])
+
+        orphans = [
+            [ChunkEntry(chunkserver_id=chunkserver_id, chunk_id=chunk_id, is_deleted=True, deleted_at=0.0)]
+            for chunkserver_id, chunk_ids in self.chunkservers.items()
+            for chunk_id in chunk_ids
+            if (chunkserver_id, chunk_id) not in self.chunk_locations
+        ]
+        self.deletion_queue = deque(deleted)
+        if orphans:
+            self.deletion_queue.appendleft((0.0, None, orphans))
+        self.gc_cursor = 0
+
+    # -------- Chunk index --------
+
+    @contextmanager
+    def locked_location(self, chunkserver_id: str, chunk_id: int):
+        """
+        Yields the (path, part_index, replica) a chunk belongs to with the file's path
+        lock held exclusively, or None if it belongs to no file.
+        """
+        key = (chunkserver_id, chunk_id)
+        while True:
+            location = self.chunk_locations.get(key)
+            if location is None:
+                yield None
+                return
+            with self.path_locks.write(location[0]):
+                # The chunk may have moved to another file before the lock was taken
+                if self.chunk_locations.get(key) is location:
+                    yield location
+                    return
+
+    def index_chunk(self, path: str, part_index: int, chunk: ChunkEntry):
+        self.chunk_locations[(chunk['chunkserver_id'], chunk['chunk_id'])] = (path, part_index, chunk)
+
+    def unindex_chunk(self, chunk: ChunkEntry):
+        self.chunk_locations.pop((chunk['chunkserver_id'], chunk['chunk_id']), None)
+
+    def index_file(self, path: str):
+        self.chunk_locations.update(
+            ((chunk['chunkserver_id'], chunk['chunk_id']), (path, part_index, chunk))
+            for part_index, replicas in enumerate(self.files[path])
+            for chunk in replicas
+        )
+
+    def unindex_file(self, path: str):
+        for replicas in self.files[path]:
+            for chunk in replicas:
+                self.unindex_chunk(chunk)
+
+    def check_chunk_index(self) -> List[str]:
+        """
+        Verify that the reverse chunk index matches self.files exactly.
+        Returns a list of human-readable problems (empty if consistent).
+        """
+        with self.path_locks.read_all(), self.namespace_lock.read(), self.allocation_lock:
+            return self.chunk_index_problems()
+
+    def chunk_index_problems(self) -> List[str]:
+        problems = []
+        seen = 0
+        for path, parts in self.files.items():
+            for part_index, replicas in enumerate(parts):
+                for chunk in replicas:
+                    seen += 1
+                    key = (chunk['chunkserver_id'], chunk['chunk_id'])
+                    location = self.chunk_locations.get(key)
+                    if location is None:
+                        problems.append(f"Chunk {key} of {path}[{part_index}] is missing from the index.")
+                    elif location[0] != path or location[1] != part_index or location[2] is not chunk:
+                        problems.append(f"Chunk {key} of {path}[{part_index}] is indexed as {location[0]}[{location[1]}].")
+
+        if seen != len(self.chunk_locations):
+            problems.append(f"Index holds {len(self.chunk_locations)} entries but files reference {seen} chunks.")
+
+        for chunkserver_id, chunk_id in self.chunk_locations:
+            if chunk_id not in self.chunkservers.get(chunkserver_id, ()):
+                problems.append(f"Indexed chunk {(chunkserver_id, chunk_id)} is not allocated on its chunkserver.")
+
+        return problems
 
     def file_exists(self, path: str) -> bool:
         """
@@ -44,36 +698,55 @@ class Master:
         path = self.format_path(path)
         if path not in self.files:
             return False
+        node = self.namespace.lookup(path)
+        return node is not None and node.is_file and node.deleted_at is None
+
+    @staticmethod
+    def chunk_entry(chunkserver_id: str, chunk_id: int, is_deleted: bool = False, deleted_at: float | None = None,
+                    shard: int | None = None) -> ChunkEntry:
+        chunk = ChunkEntry(chunkserver_id=chunkserver_id, chunk_id=chunk_id, is_deleted=is_deleted, deleted_at=deleted_at)
+        if shard is not None:
+            chunk['shard'] = shard
+        return chunk
+
+    @staticmethod
+    def chunk_row(chunk: ChunkEntry) -> tuple:
+        """
+        The chunk as logged: (chunkserver_id, chunk_id), plus its shard index in erasure coded files.
+        """
+        if 'shard' in chunk:
+            return chunk['chunkserver_id'], chunk['chunk_id'], chunk['shard']
+        return chunk['chunkserver_id'], chunk['chunk_id']
 
-        for replicas in self.files[path]:
-            for chunk in replicas:
-                if chunk['is_deleted']:
-                    return False
-        return True
+    @staticmethod
+    def deletion_time(parts: List[List[ChunkEntry]]) -> float | None:
+        return next((chunk['deleted_at'] for replicas in parts for chunk in replicas if chunk['is_deleted']), None)
 
     def get_first_chunk(self, chunkserver_id: str) -> int:
-        for chunk_id in range(self.chunkserver_capacity):
-            if chunk_id not in self.chunkservers[chunkserver_id]:
-                return chunk_id
-        raise Exception("No available chunk found on the chunkserver.")   
-    
-    def get_random_chunkserver(self) -> str:
+        return self.allocators[chunkserver_id].allocate()
+
+    def get_random_chunkserver(self, exclude: Set[str] = frozenset(), holders: Set[str] = frozenset()) -> str:
+        """
+        Picks a chunkserver for one more replica of a chunk that `holders` already store.
+        The caller holds the allocation lock.
+        """
         if not self.chunkserver_ids:
             raise Exception("No chunkservers available.")
-        
-        chunkservers = list(self.chunkserver_ids)
-        self.rand.shuffle(chunkservers)
 
-        for chunkserver_id in chunkservers:
-            if len(self.chunkservers[chunkserver_id]) < self.chunkserver_capacity:
-                return chunkserver_id
-            
-        raise Exception("All chunkservers are at full capacity.")
+        chunkservers = self.placement.choose(self, 1, exclude, holders)
+        if not chunkservers:
+            raise Exception("All chunkservers are at full capacity.")
+        return chunkservers[0]
 
     def allocate_chunk(self, chunkserver_id: str) -> ChunkEntry:
+        """
+        Takes a free slot on the chunkserver. The caller holds the allocation lock.
+        """
         try:
             chunk_id = self.get_first_chunk(chunkserver_id)
             self.chunkservers[chunkserver_id].add(chunk_id)
+            self.update_pool(chunkserver_id)
+            self.placement.placed(chunkserver_id)
             chunk = ChunkEntry(
                 chunkserver_id=chunkserver_id,
                 chunk_id=chunk_id,
@@ -85,18 +758,39 @@ class Master:
             print(f"Error allocating chunk on server {chunkserver_id}: {e}")
             raise
 
+    def release_chunk(self, chunkserver_id: str, chunk_id: int):
+        """
+        Returns a chunk slot to its chunkserver's free pool.
+        """
+        with self.allocation_lock:
+            if chunk_id not in self.chunkservers.get(chunkserver_id, ()):
+                return
+            self.chunkservers[chunkserver_id].remove(chunk_id)
+            self.allocators[chunkserver_id].release(chunk_id)
+            self.update_pool(chunkserver_id)
+
+    def release_chunks(self, chunkserver_id: str, chunk_ids: List[int]) -> List[int]:
+        """
+        Returns many slots of one chunkserver at once. Returns the ids that were allocated.
+        """
+        with self.allocation_lock:
+            allocated = self.chunkservers.get(chunkserver_id)
+            if allocated is None:
+                return []
+            released = [chunk_id for chunk_id in chunk_ids if chunk_id in allocated]
+            allocated.difference_update(released)
+            allocator = self.allocators[chunkserver_id]
+            for chunk_id in released:
+                allocator.release(chunk_id)
+            self.update_pool(chunkserver_id)
+            return released
+
     def allocate_chunks(self) -> List[ChunkEntry]:
+        """
+        Takes a slot on `replication_factor` chunkservers. The caller holds the allocation lock.
+        """
         try:
-            allocated_servers = []
-
-            server_ids = list(self.chunkserver_ids)
-            self.rand.shuffle(server_ids)
-
-            for server_id in server_ids:
-                if len(self.chunkservers[server_id]) < self.chunkserver_capacity:
-                    allocated_servers.append(server_id)
-                if len(allocated_servers) == self.replication_factor:
-                    break            
+            allocated_servers = self.placement.choose(self, self.replication_factor)
 
             if len(allocated_servers) < self.replication_factor:
                 raise Exception("Not enough chunkservers available to allocate chunks.")
@@ -117,6 +811,200 @@ class Master:
             print(f"Error occurred while allocating chunks: {e}")
             raise
 
+    def allocate_chunk_batch(self, chunk_count: int) -> List[List[ChunkEntry]]:
+        """
+        Allocates `replication_factor` replicas for `chunk_count` chunks at once.
+        Replica slots are striped round-robin over the chunkservers ordered by free
+        space, so the replicas of a chunk always land on distinct servers. Falls back
+        to per-chunk allocation when the stripe does not fit the free space, or when
+        the placement policy looks at more than free space. The caller holds the
+        allocation lock, so the whole batch is allocated atomically.
+        """
+        replication_factor = self.replication_factor
+        servers = sorted(self.chunkserver_ids, key=lambda server_id: -self.free_slots(server_id))
+        server_count = len(servers)
+        if server_count < replication_factor:
+            raise Exception("Not enough chunkservers available to allocate chunks.")
+
+        needed = chunk_count * replication_factor
+        shares = [needed // server_count + (i < needed % server_count) for i in range(server_count)]
+
+        if not self.placement.stripes or any(self.free_slots(server_id) < share for server_id, share in zip(servers, shares)):
+            allocated_chunks = []
+            try:
+                for _ in range(chunk_count):
+                    allocated_chunks.append(self.allocate_chunks())
+            except Exception:
+                for replicas in allocated_chunks:
+                    for chunk in replicas:
+                        self.release_chunk(chunk['chunkserver_id'], chunk['chunk_id'])
+                raise Exception("Failed to allocate all required chunks.")
+            return allocated_chunks
+
+        slots = []
+        for server_id, share in zip(servers, shares):
+            chunk_ids = self.allocators[server_id].allocate_many(share)
+            self.chunkservers[server_id].update(chunk_ids)
+            self.update_pool(server_id)
+            self.placement.placed(server_id, share)
+            slots.append(chunk_ids)
+
+        # Slot k of the stripe lives on servers[k % server_count] at position k // server_count
+        stripe_servers = itertools.islice(itertools.cycle(servers), needed)
+        stripe_chunk_ids = [chunk_id for row in itertools.zip_longest(*slots) for chunk_id in row if chunk_id is not None]
+        entries = [
+            {'chunkserver_id': server_id, 'chunk_id': chunk_id, 'is_deleted': False, 'deleted_at': None}
+            for server_id, chunk_id in zip(stripe_servers, stripe_chunk_ids)
+        ]
+        return [entries[k:k + replication_factor] for k in range(0, needed, replication_factor)]
+
+    def allocate_stripes(self, size: int, ec: Tuple[int, int]) -> List[List[ChunkEntry]]:
+        """
+        Allocates every stripe of an erasure coded file of `size` bytes: a slot for each data
+        shard that holds part of the file and for each parity shard, all of a stripe's on
+        distinct chunkservers. The caller holds the allocation lock.
+        """
+        data_shards, parity_shards = ec
+        chunk_count = -(-size // self.max_chunk_size)
+        stripes: List[List[ChunkEntry]] = []
+        try:
+            for first in range(0, chunk_count, data_shards):
+                shards = list(range(min(data_shards, chunk_count - first))) + list(range(data_shards, data_shards + parity_shards))
+                servers = self.placement.choose(self, len(shards))
+                if len(servers) < len(shards):
+                    raise Exception("Not enough chunkservers available to allocate a stripe.")
+                stripe = []
+                stripes.append(stripe)
+                for server_id, shard in zip(servers, shards):
+                    chunk = self.allocate_chunk(server_id)
+                    chunk['shard'] = shard
+                    stripe.append(chunk)
+        except Exception:
+            for stripe in stripes:
+                for chunk in stripe:
+                    self.release_chunk(chunk['chunkserver_id'], chunk['chunk_id'])
+            raise
+        return stripes
+
+    def get_file_layout(self, path: str, offset: int = 0, limit: int | None = None) -> FileLayout:
+        """
+        Returns the chunk placement of parts [offset, offset + limit) in the compact
+        FileLayout format. Omit `limit` to get the whole file.
+        """
+        path = self.format_path(path)
+        with self.path_locks.read(path), self.namespace_lock.read():
+            return self.file_layout(path, offset, limit)
+
+    def file_layout(self, path: str, offset: int, limit: int | None) -> FileLayout:
+        parts = self.file_parts(path)
+        if offset < 0 or (limit is not None and limit < 0):
+            raise ValueError("Offset and limit must not be negative.")
+        end = len(parts) if limit is None else min(len(parts), offset + limit)
+
+        node = self.namespace.lookup(path)
+        servers: List[str] = []
+        shards: List[int] | None = [] if node.striped else None
+        replica_offsets, server_indexes, chunk_ids = self.layout_columns(parts[offset:end], servers, {}, shards)
+
+        layout = FileLayout(
+            path=self.format_path(path),
+            size=node.size,
+            chunk_size=self.max_chunk_size,
+            chunk_count=len(parts),
+            offset=offset,
+            servers=servers,
+            replica_offsets=replica_offsets,
+            server_indexes=server_indexes,
+            chunk_ids=chunk_ids,
+            version=node.version,
+            lease_seconds=self.location_lease,
+        )
+        if node.striped:
+            layout['ec'] = list(node.ec)
+            layout['shards'] = shards
+        return layout
+
+    @staticmethod
+    def layout_columns(parts: List[List[ChunkEntry]], servers: List[str], server_numbers: Dict[str, int],
+                       shards: List[int] | None = None) -> Tuple[List[int], List[int], List[int]]:
+        """
+        Flattens replica lists into (replica_offsets, server_indexes, chunk_ids), adding
+        chunkservers not seen before to `servers`. Stripes also list each entry's shard
+        index in `shards`.
+        """
+        replica_offsets = [0]
+        server_indexes: List[int] = []
+        chunk_ids: List[int] = []
+        for replicas in parts:
+            for chunk in replicas:
+                server_id = chunk['chunkserver_id']
+                number = server_numbers.get(server_id)
+                if number is None:
+                    number = server_numbers[server_id] = len(servers)
+                    servers.append(server_id)
+                server_indexes.append(number)
+                chunk_ids.append(chunk['chunk_id'])
+                if shards is not None:
+                    shards.append(chunk['shard'])
+            replica_offsets.append(len(chunk_ids))
+        return replica_offsets, server_indexes, chunk_ids
+
+    def get_file_layouts(self, paths: List[str]) -> BatchLayout:
+        """
+        Returns the layouts of many files at once, in the order of `paths`. A path that
+        cannot be read gets an error entry instead of failing the batch. Paths are
+        grouped by lock shard, so each shard is locked once per batch, not once per file.
+        """
+        servers: List[str] = []
+        server_numbers: Dict[str, int] = {}
+        files: List[dict | None] = [None] * len(paths)
+        by_shard: Dict[int, List[Tuple[int, str]]] = defaultdict(list)
+        for position, path in enumerate(paths):
+            try:
+                path = self.format_path(path)
+            except ValueError as e:
+                files[position] = {"path": path, "error": str(e)}
+                continue
+            by_shard[self.path_locks.index(path)].append((position, path))
+
+        for shard, group in sorted(by_shard.items()):
+            with self.path_locks.hold([shard], write=False), self.namespace_lock.read():
+                for position, path in group:
+                    try:
+                        parts = self.file_parts(path)
+                    except ValueError as e:
+                        files[position] = {"path": path, "error": str(e)}
+                        continue
+                    node = self.namespace.lookup(path)
+                    shards = [] if node.striped else None
+                    replica_offsets, server_indexes, chunk_ids = self.layout_columns(parts, servers, server_numbers, shards)
+                    files[position] = {
+                        "path": path,
+                        "size": node.size,
+                        "chunk_count": len(parts),
+                        "version": node.version,
+                        "replica_offsets": replica_offsets,
+                        "server_indexes": server_indexes,
+                        "chunk_ids": chunk_ids,
+                    }
+                    if node.striped:
+                        files[position]["ec"] = list(node.ec)
+                        files[position]["shards"] = shards
+
+        return BatchLayout(
+            chunk_size=self.max_chunk_size,
+            lease_seconds=self.location_lease,
+            servers=servers,
+            files=files,
+        )
+
+    def files_under(self, path: str) -> List[str]:
+        """
+        Paths of the live files below the directory `path` (or the file itself), in path order.
+        """
+        with self.namespace_lock.read():
+            return [file_path for file_path, node in self.namespace.walk_files(path) if node.deleted_at is None]
+
     def format_path(self, path: str) -> str:
         if not path or not isinstance(path, str):
             raise ValueError("Invalid path provided.")
@@ -132,60 +1020,102 @@ class Master:
         if not parts:
             return False
 
-        # Check that none of the parent folders is a file
-        current = ''
-        for part in parts[:-1]:
-            current += '/' + part
-            if current in self.files:
-                return False
-            
-        # Check that path is not a folder
-        for path in self.files.keys():
-            if path.startswith(self.format_path(path)) and path != self.format_path(path):
-                return False
-
-        return True
-
-    def create_file(self, path: str, size: int) -> list[list[ChunkEntry]]:
-
-        path = self.format_path(path)
+        # None of the parent folders may be a file and the path may not be a folder
+        return self.namespace.can_hold_file(path)
 
+    def check_new_file(self, path: str, size: int, appendable: bool = False):
         if self.file_exists(path):
             raise ValueError("File already exists at the specified path.")
 
         if not self.is_valid_path(path):
             raise ValueError("Invalid file path provided.")
 
-        if size <= 0:
+        if size < 0 or (size == 0 and not appendable):
             raise ValueError("File size must be greater than zero.")
-        
-        chunk_count = (size + self.max_chunk_size - 1) // self.max_chunk_size
 
-        allocated_chunks = []
+    def check_ec(self, ec, appendable: bool = False) -> Tuple[int, int]:
+        """
+        Validates an erasure coding policy (data shards, parity shards) and returns it as a tuple.
+        """
+        if len(ec) != 2:
+            raise ValueError("Erasure coding policy must be [data shards, parity shards].")
+        data_shards, parity_shards = int(ec[0]), int(ec[1])
+        if appendable:
+            raise ValueError("Appendable files cannot be erasure coded.")
+        if data_shards < 1 or parity_shards < 1 or data_shards + parity_shards > 256:
+            raise ValueError("Erasure coding needs at least one data and one parity shard, at most 256 shards in total.")
+        if data_shards + parity_shards > len(self.chunkserver_ids):
+            raise ValueError(f"Erasure coding {data_shards}+{parity_shards} needs at least {data_shards + parity_shards} chunkservers.")
+        return data_shards, parity_shards
+
+    def create_file(self, path: str, size: int, appendable: bool = False, ec=None) -> list[list[ChunkEntry]]:
+        """
+        Creates a file of `size` bytes. An `appendable` file may start empty and grows by
+        record appends, it always has a last chunk to append to. With `ec` = (data shards,
+        parity shards) the file is erasure coded from the start and its parts are stripes.
+        """
+        path = self.format_path(path)
+        if ec is not None:
+            ec = self.check_ec(ec, appendable)
 
-        for i in range(chunk_count):
-            try:
-                chunks = self.allocate_chunks()
-                allocated_chunks.append(chunks)
-            except Exception as e:
-                print(f"Error occurred while allocating chunks for file {path}: {e}")
-                continue
+        with self.path_locks.write(path):
+            with self.namespace_lock.read():
+                self.check_new_file(path, size, appendable)
 
-        if len(allocated_chunks) < chunk_count:
-            raise Exception("Failed to allocate all required chunks.")
+            chunk_count = max(int(appendable), (size + self.max_chunk_size - 1) // self.max_chunk_size)
 
-        self.files[path] = allocated_chunks
+            with self.allocation_lock, self.allocation_seconds.timer("file"):
+                if ec is None:
+                    allocated_chunks = self.allocate_chunk_batch(chunk_count)
+                else:
+                    allocated_chunks = self.allocate_stripes(size, ec)
+
+            with self.namespace_lock.write():
+                try:
+                    # Another create may have turned a parent directory into a file meanwhile
+                    self.check_new_file(path, size, appendable)
+                except ValueError:
+                    with self.allocation_lock:
+                        for replicas in allocated_chunks:
+                            for chunk in replicas:
+                                self.release_chunk(chunk['chunkserver_id'], chunk['chunk_id'])
+                    raise
+
+                with self.allocation_lock:
+                    # A deleted file at the same path is replaced; its chunks become orphans for GC
+                    if path in self.files:
+                        self.unindex_file(path)
+
+                    self.files[path] = allocated_chunks
+                    self.index_file(path)
+                version = self.next_version
+                self.next_version += 1
+                self.namespace.add_file(path, size, version, appendable)
+                node = self.namespace.lookup(path)
+                node.ec = ec
+                node.striped = ec is not None
+                fields = {"appendable": True} if appendable else {}
+                if ec is not None:
+                    fields["ec"] = list(ec)
+                self.log_operation("create", path=path, size=size, version=version, chunks=[
+                    [self.chunk_row(chunk) for chunk in replicas] for replicas in allocated_chunks
+                ], **fields)
 
         return allocated_chunks
 
     def get_file_chunks(self, path: str) -> List[List[ChunkEntry]]:
+        path = self.format_path(path)
+        with self.path_locks.read(path), self.namespace_lock.read():
+            # A copy, the handler serializes it after the locks are released
+            return [[ChunkEntry(**chunk) for chunk in replicas] for replicas in self.file_parts(path)]
+
+    def file_parts(self, path: str) -> List[List[ChunkEntry]]:
+        """
+        Returns the replica lists of a live file. The caller holds its path lock and the namespace lock.
+        """
         if not self.is_valid_path(path):
             raise ValueError("Invalid file path provided.")
 
-        path = self.format_path(path)
-
-        
-        
         if not self.file_exists(path):
             raise ValueError("File not found.")
 
@@ -194,160 +1124,1026 @@ class Master:
 
         return self.files[path]
 
-    def delete_file(self, path: str) -> bool:
-        if not self.is_valid_path(path):
-            raise ValueError("Invalid file path provided.")
-        
-        if not self.file_exists(path):
-            raise ValueError("File does not exist or has already been deleted.")
+    def file_stat(self, path: str, size: int) -> dict:
+        parts = self.files[path]
+        stat = {
+            "path": path,
+            "type": "file",
+            "size": size,
+            "chunk_count": len(parts),
+            "is_deleted": not self.file_exists(path),
+        }
+        node = self.namespace.lookup(path)
+        if node.ec:
+            stat["ec"] = list(node.ec)
+            stat["striped"] = node.striped  # False until the conversion finished, chunk_count then counts stripes
+        return stat
+
+    def list_directory(self, path: str, start_after: str | None = None, limit: int = 1000) -> dict:
+        """
+        Lists one page of a directory's entries in name order.
+        Pass the returned `next` as `start_after` to get the following page.
+        """
+        if limit <= 0:
+            raise ValueError("Limit must be positive.")
+        with self.namespace_lock.read():
+            entries, next_cursor = self.namespace.list_directory(path, start_after, limit)
+            return {
+                "path": self.format_path(path),
+                "entries": [
+                    {"name": node.name, "type": "file", "size": node.size} if node.is_file else
+                    {"name": node.name, "type": "directory"}
+                    for node in entries
+                ],
+                "next": next_cursor,
+            }
+
+    def stat(self, path: str, recursive: bool = False, start_after: str | None = None, limit: int = 1000) -> dict:
+        """
+        Describes a file or directory. With `recursive`, a directory also returns one
+        page of the stats of every file below it, in path order.
+        """
+        if limit <= 0:
+            raise ValueError("Limit must be positive.")
+        with self.namespace_lock.read():
+            return self.describe_path(path, recursive, start_after, limit)
+
+    def describe_path(self, path: str, recursive: bool, start_after: str | None, limit: int) -> dict:
+        node = self.namespace.lookup(path)
+        if node is None:
+            raise ValueError("Path not found.")
+        if node.is_file:
+            return self.file_stat(self.format_path(path), node.size)
+
+        result = {
+            "path": self.format_path(path),
+            "type": "directory",
+            "entry_count": len(node.children),
+        }
+        if recursive:
+            files = []
+            next_cursor = None
+            for file_path, file_node in self.namespace.walk_files(path, start_after):
+                if len(files) == limit:
+                    next_cursor = files[-1]["path"]
+                    break
+                files.append(self.file_stat(file_path, file_node.size))
+            result["files"] = files
+            result["next"] = next_cursor
+        return result
 
+    def delete_file(self, path: str) -> bool:
         path = self.format_path(path)
 
-        if path not in self.files:
-            raise ValueError("File not found.")
+        with self.path_locks.write(path), self.namespace_lock.write():
+            if not self.is_valid_path(path):
+                raise ValueError("Invalid file path provided.")
+
+            if not self.file_exists(path):
+                raise ValueError("File does not exist or has already been deleted.")
+
+            if path not in self.files:
+                raise ValueError("File not found.")
+
+            deleted_at = time.time()
+            self.tombstone(path, deleted_at)
+            # The queue keeps the parts list itself, so a file later created at the same
+            # path does not hide these chunks from the GC
+            self.deletion_queue.append((deleted_at, path, self.files[path]))
+            self.log_operation("delete", path=path, deleted_at=deleted_at)
+
+        return True
 
+    def delete_files(self, paths: List[str]) -> List[dict]:
+        """
+        Deletes many files, each on its own. Returns {"path", "deleted"} or {"path", "error"}
+        per path, in order. The caller syncs the log once for the whole batch.
+        """
+        results = []
+        for path in paths:
+            try:
+                results.append({"path": self.format_path(path), "deleted": self.delete_file(path)})
+            except ValueError as e:
+                results.append({"path": path, "error": str(e)})
+        return results
+
+    def delete_prefix(self, path: str) -> int:
+        """
+        Deletes every file below the directory `path` as one logged operation and returns
+        how many were deleted. Files already deleted keep their deletion time.
+        """
+        path = self.format_path(path)
+        # Touches any number of files, rare enough to stop everything else
+        with self.path_locks.write_all(), self.namespace_lock.write():
+            node = self.namespace.lookup(path)
+            if node is None or node.is_file:
+                raise ValueError("Directory not found.")
+            deleted_at = time.time()
+            deleted = self.tombstone_prefix(path, deleted_at)
+            for file_path in deleted:
+                self.deletion_queue.append((deleted_at, file_path, self.files[file_path]))
+            if deleted:
+                self.log_operation("delete_prefix", path=path, deleted_at=deleted_at)
+        return len(deleted)
+
+    def tombstone(self, path: str, deleted_at: float):
+        """
+        Marks a file and its chunks deleted. The caller holds its path lock and the namespace lock for writing.
+        """
         for replicas in self.files[path]:
             for chunk in replicas:
                 chunk['is_deleted'] = True
-                chunk['deleted_at'] = time.time()
+                chunk['deleted_at'] = deleted_at
+        self.namespace.lookup(path).deleted_at = deleted_at
 
-        return True
+    def tombstone_prefix(self, path: str, deleted_at: float) -> List[str]:
+        deleted = [file_path for file_path, node in self.namespace.walk_files(path) if node.deleted_at is None]
+        for file_path in deleted:
+            self.tombstone(file_path, deleted_at)
+        return deleted
+
+    # -------- Record appends --------
 
-    def register_chunkserver(self, chunkserver_id: str):
+    def append_snapshot(self, path: str):
+        """
+        Returns (part_index, replicas, live replicas, version) of an appendable file's last
+        chunk, replicas as (chunkserver_id, chunk_id) tuples. None if the file does not exist.
+        """
+        with self.path_locks.read(path), self.namespace_lock.read():
+            if not self.file_exists(path):
+                return None
+            node = self.namespace.lookup(path)
+            if not node.appendable:
+                raise ValueError("File was not created for record appends.")
+            part_index = len(self.files[path]) - 1
+            replicas = tuple((chunk['chunkserver_id'], chunk['chunk_id']) for chunk in self.files[path][part_index])
+            live = tuple((chunk['chunkserver_id'], chunk['chunk_id']) for chunk in self.live_replicas(path, part_index))
+            return part_index, replicas, live, node.version
+
+    def add_part(self, path: str, part_index: int, sealed_on: Set[str]):
+        """
+        Gives an appendable file a new last chunk after part `part_index` was sealed at the
+        full chunk size. Replicas missing from `sealed_on` did not take the padding and are dropped.
+        """
+        with self.path_locks.write(path):
+            if not self.file_exists(path) or len(self.files[path]) != part_index + 1:
+                return  # Deleted meanwhile
+            for chunk in list(self.files[path][part_index]):
+                if chunk['chunkserver_id'] not in sealed_on:
+                    self.drop_replica(self.chunk_locations[(chunk['chunkserver_id'], chunk['chunk_id'])], delete=True)
+
+            with self.namespace_lock.write():
+                with self.allocation_lock:
+                    with self.allocation_seconds.timer("part"):
+                        replicas = self.allocate_chunks()
+                    self.files[path].append(replicas)
+                    for chunk in replicas:
+                        self.index_chunk(path, part_index + 1, chunk)
+                size = (part_index + 1) * self.max_chunk_size
+                self.namespace.lookup(path).size = size
+                self.log_operation("extend", path=path, size=size,
+                                   chunks=[(chunk['chunkserver_id'], chunk['chunk_id']) for chunk in replicas])
+
+    def register_chunkserver(self, chunkserver_id: str, used_bytes: int | None = None, free_bytes: int | None = None,
+                             chunk_ids: List[int] | None = None, chunk_versions: List[int] | None = None,
+                             labels: Dict[str, str] | None = None) -> dict:
+        """
+        Adds a chunkserver, or refreshes one that restarted. A restarting chunkserver keeps
+        its chunks; with a chunk report they are reconciled against the metadata. `labels`
+        (rack, zone, ...) replace the ones the chunkserver registered with before.
+        """
         if not chunkserver_id:
             raise ValueError("Invalid chunkserver ID provided.")
 
-        self.chunkserver_ids.add(chunkserver_id)
-        self.chunkservers[chunkserver_id] = set() 
-        self.last_heartbeat[chunkserver_id] = time.time()
+        with self.allocation_lock:
+            if chunkserver_id not in self.chunkserver_ids:
+                self.chunkserver_ids.add(chunkserver_id)
+                self.chunkserver_list.append(chunkserver_id)
+                self.chunkservers[chunkserver_id] = set()
+                self.disk_usage.pop(chunkserver_id, None)
+                self.allocators[chunkserver_id] = ChunkSlotAllocator(self.slot_capacity(chunkserver_id))
+                self.update_pool(chunkserver_id)
+                self.set_labels(chunkserver_id, labels or {})
+                self.log_operation("register", chunkserver_id=chunkserver_id, labels=labels or {})
+                self.rebalancer.notify()  # A new chunkserver starts empty
+            elif labels is not None and labels != self.labels.get(chunkserver_id, {}):
+                self.set_labels(chunkserver_id, labels)
+                self.log_operation("labels", chunkserver_id=chunkserver_id, labels=labels)
+            self.update_disk_usage(chunkserver_id, used_bytes, free_bytes)
+            self.last_heartbeat[chunkserver_id] = time.time()
+        if chunk_ids is None:
+            return {}
+        return self.reconcile_chunkserver(chunkserver_id, chunk_ids, chunk_versions or [0] * len(chunk_ids))
+
+    def set_labels(self, chunkserver_id: str, labels: Dict[str, str]):
+        if labels:
+            self.labels[chunkserver_id] = labels
+        else:
+            self.labels.pop(chunkserver_id, None)
+
+    def reconcile_chunkserver(self, chunkserver_id: str, chunk_ids: List[int], chunk_versions: List[int]) -> dict:
+        """
+        Compares a chunkserver's full chunk report with the chunks allocated on it. Replicas
+        it lost, or holds with an old version, are dropped and re-replicated; chunks nobody
+        allocated are reserved and queued for deletion. Everything else is kept as is.
+        """
+        reported = dict(zip(chunk_ids, chunk_versions))
+        with self.allocation_lock:
+            allocated = list(self.chunkservers[chunkserver_id])
+        missing = 0
+        for chunk_id in allocated:
+            if chunk_id in reported:
+                continue
+            with self.locked_location(chunkserver_id, chunk_id) as location:
+                if location is None or location[2]['is_deleted']:
+                    continue  # Copies in flight, pending deletes and deleted files are handled elsewhere
+                self.drop_replica(location, delete=False)
+                missing += 1
 
-    def heartbeat(self, chunkserver_id: str) -> bool:
-        if chunkserver_id not in self.chunkserver_ids:
-            self.register_chunkserver(chunkserver_id)
+        stale, orphans = self.check_reported_chunks(chunkserver_id, reported.items())
+        return {"kept": len(reported) - stale - orphans, "missing": missing, "stale": stale, "orphans": orphans}
 
-        self.last_heartbeat[chunkserver_id] = time.time()
-        return True
-    
-    def garbage_collection(self):
-        current_time = time.time()
-        if (current_time - self.last_garbage_collection) < self.garbage_collection_time:
-            return
-        
-        for chunkserver_id in list(self.chunkserver_ids):
-            chunk_ids = list(self.chunkservers[chunkserver_id])
-            for chunk_id in chunk_ids:
-                path, part_index = self.get_chunkentry_location(ChunkEntry(chunkserver_id=chunkserver_id, chunk_id=chunk_id))
-                if path is None or part_index is None:
-                    self.chunkservers[chunkserver_id].remove(chunk_id)
-
-        for path, part in self.files.items():
-            for replicas in part:
-                for chunk in replicas:
-                    if chunk['is_deleted'] and (current_time - chunk['deleted_at']) >= self.garbage_collection_time:
-                        self.chunkservers[chunk['chunkserver_id']].remove(chunk['chunk_id'])
-                        replicas.remove(chunk)
+    def check_reported_chunks(self, chunkserver_id: str, chunks) -> Tuple[int, int]:
+        """
+        Checks (chunk_id, version) pairs a chunkserver says it holds. Replicas with another
+        version than their file are stale and dropped, chunks that are not allocated on the
+        chunkserver are orphans, reserved and queued for deletion. Returns both counts.
+        """
+        chunks = list(chunks)
+        with self.allocation_lock:
+            allocated = self.chunkservers[chunkserver_id]
+            orphans = {chunk_id for chunk_id, _ in chunks if chunk_id not in allocated}
+            if orphans:
+                self.allocators[chunkserver_id].reserve(orphans)
+                allocated.update(orphans)
+                self.pending_deletes[chunkserver_id].update(orphans)
+                self.update_pool(chunkserver_id)
+                self.log_operation("orphan", chunkserver_id=chunkserver_id, chunks=sorted(orphans))
+
+        # Compare versions in one pass, then drop the stale replicas under their file's lock
+        with self.namespace_lock.read():
+            suspects = [
+                (chunk_id, version) for chunk_id, version in chunks
+                if version and chunk_id not in orphans
+                and self.replica_is_stale(self.chunk_locations.get((chunkserver_id, chunk_id)), version)
+            ]
+        stale = 0
+        for chunk_id, version in suspects:
+            with self.locked_location(chunkserver_id, chunk_id) as location:
+                with self.namespace_lock.read():
+                    if not self.replica_is_stale(location, version):
+                        continue
+                self.drop_replica(location, delete=True)
+                stale += 1
+        return stale, len(orphans)
+
+    def replica_is_stale(self, location: Tuple[str, int, ChunkEntry] | None, version: int) -> bool:
+        """
+        Whether a reported replica has another version than its file. The caller holds the namespace lock.
+        """
+        if location is None or location[2]['is_deleted']:
+            return False
+        return version != self.namespace.lookup(location[0]).version
 
-        self.last_garbage_collection = current_time
+    def drop_replica(self, location: Tuple[str, int, ChunkEntry], delete: bool):
+        """
+        Removes a replica that can no longer be used from its file and schedules a new one.
+        With `delete` its chunk is deleted by the garbage collector, otherwise the slot is
+        released right away because the chunk is already gone from disk. The caller holds
+        the file's path lock.
+        """
+        path, part_index, chunk = location
+        self.remove_chunkentry(chunk)
+        if delete:
+            with self.allocation_lock:
+                self.pending_deletes[chunk['chunkserver_id']].add(chunk['chunk_id'])
+        else:
+            self.release_chunk(chunk['chunkserver_id'], chunk['chunk_id'])
+        self.replication.enqueue(path, part_index)
+
+    def heartbeat(self, chunkserver_id: str, used_bytes: int | None = None, free_bytes: int | None = None,
+                  corrupt_chunks: List[int] = (), added_ids: List[int] = (), added_versions: List[int] = (),
+                  removed_ids: List[int] = (), load: dict | None = None, appended_ids: List[int] = (),
+                  appended_sizes: List[int] = ()) -> bool:
+        """
+        Records a heartbeat and applies the chunk changes since the chunkserver's previous
+        one, in time proportional to the changes. Returns True if the chunkserver was
+        unknown and should send its full chunk report by registering again.
+        """
+        with self.allocation_lock:
+            unknown = chunkserver_id not in self.chunkserver_ids
+            if unknown:
+                self.register_chunkserver(chunkserver_id)
+
+            self.update_disk_usage(chunkserver_id, used_bytes, free_bytes)
+            now = time.time()
+            if not unknown:
+                self.heartbeat_interval_seconds.observe(now - self.last_heartbeat.get(chunkserver_id, now))
+            self.last_heartbeat[chunkserver_id] = now
+            if load is not None:
+                self.load[chunkserver_id] = load
+        if unknown:
+            return True  # The full report supersedes the deltas
+
+        if added_ids:
+            self.check_reported_chunks(chunkserver_id, zip(added_ids, added_versions or [0] * len(added_ids)))
+        if removed_ids:
+            self.drop_lost_chunks(chunkserver_id, removed_ids)
+        if corrupt_chunks:
+            self.drop_corrupt_chunks(chunkserver_id, corrupt_chunks)
+        if appended_ids:
+            self.record_appended_sizes(chunkserver_id, appended_ids, appended_sizes)
+        return False
+
+    def drop_lost_chunks(self, chunkserver_id: str, chunk_ids: List[int]) -> int:
+        """
+        Drops replicas whose chunks disappeared from a chunkserver's disk and re-replicates them.
+        """
+        dropped = 0
+        for chunk_id in chunk_ids:
+            with self.locked_location(chunkserver_id, chunk_id) as location:
+                if location is None or location[2]['is_deleted']:
+                    continue
+                print(f"Chunk {chunk_id} of {location[0]}[{location[1]}] is gone from {chunkserver_id}, re-replicating")
+                self.drop_replica(location, delete=False)
+                dropped += 1
+        return dropped
+
+    def drop_corrupt_chunks(self, chunkserver_id: str, chunk_ids: List[int]) -> int:
+        """
+        Drops replicas that failed their checksums on a chunkserver, so clients and copies
+        stop using them, schedules new replicas and queues the bad chunks for deletion.
+        Repeated reports are ignored.
+        """
+        dropped = 0
+        for chunk_id in chunk_ids:
+            with self.locked_location(chunkserver_id, chunk_id) as location:
+                if location is None or location[2]['is_deleted']:
+                    continue  # Already dropped, or garbage collection deletes it anyway
+                print(f"Chunk {chunk_id} of {location[0]}[{location[1]}] on {chunkserver_id} is corrupt, re-replicating")
+                self.drop_replica(location, delete=True)
+                dropped += 1
+        return dropped
+
+    def record_appended_sizes(self, chunkserver_id: str, chunk_ids: List[int], sizes: List[int]):
+        """
+        Grows appendable files to the length their last chunk reached on a chunkserver.
+        """
+        for chunk_id, chunk_size in zip(chunk_ids, sizes):
+            with self.locked_location(chunkserver_id, chunk_id) as location:
+                if location is None or location[2]['is_deleted']:
+                    continue
+                path, part_index, _ = location
+                if part_index != len(self.files[path]) - 1:
+                    continue  # Sealed chunks are full, the file size already counts them
+                with self.namespace_lock.write():
+                    node = self.namespace.lookup(path)
+                    size = part_index * self.max_chunk_size + min(chunk_size, self.max_chunk_size)
+                    if node.appendable and size > node.size:
+                        node.size = size
+                        self.log_operation("extend", path=path, size=size)
+
+    def chunkserver_status(self) -> dict:
+        now = time.time()
+        with self.allocation_lock:
+            return self.describe_chunkservers(now)
+
+    def describe_chunkservers(self, now: float) -> dict:
+        return {
+            chunkserver_id: {
+                "chunks": len(self.chunkservers[chunkserver_id]),
+                "free_slots": self.free_slots(chunkserver_id),
+                "utilization": len(self.chunkservers[chunkserver_id]) / max(1, self.slot_capacity(chunkserver_id)),
+                "used_bytes": self.disk_usage.get(chunkserver_id, (None, None))[0],
+                "free_bytes": self.disk_usage.get(chunkserver_id, (None, None))[1],
+                "seconds_since_heartbeat": now - self.last_heartbeat[chunkserver_id],
+                "load": self.load.get(chunkserver_id),
+                "labels": self.labels.get(chunkserver_id, {}),
+            }
+            for chunkserver_id in self.chunkserver_ids
+        }
+
+    async def garbage_collection(self):
+        """
+        Reclaims deleted files whose retention expired. The deletion queue is walked in
+        slices of at most gc_batch_size chunks, each taken off the metadata in a worker
+        thread, so the event loop never waits on the metadata locks. A chunk's slot is
+        only released once its chunkserver deleted it, so a reused slot never meets the
+        old data on disk.
+        """
+        cycle_start = time.perf_counter()
+        expire_before = time.time() - self.garbage_collection_time
+        reclaimed_chunks = reclaimed_bytes = slices = 0
+        max_slice = 0.0
+
+        # Deletes that were not acked last cycle go out first
+        batch, dropped = await asyncio.to_thread(self.take_pending_deletes), []
+        client = None  # Only opened if there is something to delete
+        try:
+            while True:
+                if not batch:
+                    slice_start = time.perf_counter()
+                    batch, dropped = await asyncio.to_thread(self.collect_garbage, expire_before)
+                    self.gc_slice_seconds.observe(time.perf_counter() - slice_start)
+                    max_slice = max(max_slice, time.perf_counter() - slice_start)
+                    slices += 1
+                    if not batch and not dropped:
+                        break
+
+                if batch and client is None:
+                    # Loading the CA bundle takes tens of milliseconds, too long for the event loop
+                    client = await asyncio.to_thread(httpx.AsyncClient, timeout=httpx.Timeout(60.0, connect=5.0))
+                released, freed_bytes = await self.send_deletes(client, batch)
+                reclaimed_chunks += len(released)
+                reclaimed_bytes += freed_bytes
+                batch, dropped = None, []
+                await asyncio.sleep(0)
+        finally:
+            if client is not None:
+                await client.aclose()
+
+        self.last_garbage_collection = time.time()
+        self.gc_stats["cycles"] += 1
+        self.gc_stats["last_cycle_seconds"] = time.perf_counter() - cycle_start
+        self.gc_cycle_seconds.observe(self.gc_stats["last_cycle_seconds"])
+        self.gc_stats["last_cycle_slices"] = slices
+        self.gc_stats["last_max_slice_seconds"] = max_slice
+        self.gc_stats["last_reclaimed_chunks"] = reclaimed_chunks
+        self.gc_stats["last_reclaimed_bytes"] = reclaimed_bytes
+        self.gc_stats["total_reclaimed_chunks"] += reclaimed_chunks
+        self.gc_stats["total_reclaimed_bytes"] += reclaimed_bytes
+
+    def take_pending_deletes(self) -> Dict[str, Set[int]]:
+        with self.allocation_lock:
+            pending = self.pending_deletes
+            self.pending_deletes = defaultdict(set)
+        return pending
+
+    def collect_garbage(self, expire_before: float) -> Tuple[Dict[str, List[int]], List[str]]:
+        """
+        Takes up to gc_batch_size expired chunks off the deletion queue and drops them
+        from the metadata. Returns the chunks to delete per chunkserver and the paths
+        of files that are now fully reclaimed and gone from the namespace.
+        """
+        batch: Dict[str, List[int]] = defaultdict(list)
+        dropped = []
+        count = 0
+        while self.deletion_queue and count < self.gc_batch_size:
+            # Only the garbage collector takes entries off the queue, so the head stays put
+            entry = self.deletion_queue[0]
+            deleted_at, path, parts = entry
+            if deleted_at > expire_before:
+                break
+
+            with (self.path_locks.write(path) if path is not None else nullcontext()), \
+                    self.namespace_lock.write(), self.allocation_lock:
+                while self.gc_cursor < len(parts) and count < self.gc_batch_size:
+                    replicas = parts[self.gc_cursor]
+                    for chunk in replicas:
+                        key = (chunk['chunkserver_id'], chunk['chunk_id'])
+                        location = self.chunk_locations.get(key)
+                        if location is not None and location[2] is chunk:
+                            del self.chunk_locations[key]
+                        batch[chunk['chunkserver_id']].append(chunk['chunk_id'])
+                    count += len(replicas)
+                    replicas.clear()
+                    self.gc_cursor += 1
+
+                if self.gc_cursor == len(parts):
+                    self.deletion_queue.popleft()
+                    self.gc_cursor = 0
+                    if path is not None and self.files.get(path) is parts:
+                        del self.files[path]
+                        self.namespace.remove_file(path)
+                        dropped.append(path)
+                        # Logged before the path lock is released, a new file at the path is logged after
+                        self.log_operation("reclaim", chunks=[], paths=[path])
+        return batch, dropped
+
+    async def send_deletes(self, client: httpx.AsyncClient, batch: Dict[str, List[int]]) -> Tuple[List[Tuple[str, int]], int]:
+        """
+        Sends one delete command per chunkserver and releases the slots of the chunks
+        that were deleted. Returns the released (chunkserver_id, chunk_id) pairs and the
+        bytes freed on disk. Chunks of unreachable chunkservers are retried next cycle.
+        """
+        # Chunks of chunkservers that are gone went away with their allocator
+        targets = [(chunkserver_id, list(chunk_ids)) for chunkserver_id, chunk_ids in batch.items()
+                   if chunk_ids and chunkserver_id in self.chunkservers]
+        if not targets:
+            return [], 0
+
+        results = await asyncio.gather(
+            *(self.delete_chunks(client, chunkserver_id, chunk_ids) for chunkserver_id, chunk_ids in targets),
+            return_exceptions=True,
+        )
+        return await asyncio.to_thread(self.release_deleted, targets, results)
+
+    def release_deleted(self, targets: List[Tuple[str, List[int]]], results: list) -> Tuple[List[Tuple[str, int]], int]:
+        """
+        Releases the slots of the chunks each chunkserver deleted, and keeps the chunks of
+        failed deletes for the next cycle.
+        """
+        released = []
+        freed_bytes = 0
+        with self.allocation_lock:
+            for (chunkserver_id, chunk_ids), result in zip(targets, results):
+                if chunkserver_id not in self.chunkservers:
+                    continue
+                if isinstance(result, BaseException):
+                    print(f"Deleting {len(chunk_ids)} chunks on {chunkserver_id} failed: {result}")
+                    self.pending_deletes[chunkserver_id].update(chunk_ids)
+                    continue
+                released.extend((chunkserver_id, chunk_id) for chunk_id in self.release_chunks(chunkserver_id, chunk_ids))
+                freed_bytes += result
+            # Logged before the slots can be handed out again
+            if released:
+                self.log_operation("reclaim", chunks=released, paths=[])
+        return released, freed_bytes
+
+    async def delete_chunks(self, client: httpx.AsyncClient, chunkserver_id: str, chunk_ids: List[int]) -> int:
+        """
+        Asks a chunkserver to delete chunks from disk, returns the bytes it freed.
+        """
+        resp = await client.post(f"{self.chunkserver_url(chunkserver_id)}/delete_chunks", json={"chunk_ids": chunk_ids})
+        if resp.status_code != 200 or resp.json().get("status") != "success":
+            raise Exception(f"{chunkserver_id} answered {resp.status_code}: {resp.text}")
+        return resp.json()["freed_bytes"]
+
+    def gc_status(self) -> dict:
+        with self.allocation_lock:
+            pending = sum(len(chunk_ids) for chunk_ids in self.pending_deletes.values())
+        return {
+            **self.gc_stats,
+            "queued_files": len(self.deletion_queue),
+            "pending_deletes": pending,
+        }
 
     def get_chunkentry_location(self, chunk: ChunkEntry):
         """
         Returns (file_path, part_index) for the given chunk entry.
         """
-        for path, parts in self.files.items():
-            for idx, replicas in enumerate(parts):
-                for target_chunk in replicas:
-                    if (target_chunk['chunkserver_id'] == chunk['chunkserver_id'] and
-                        target_chunk['chunk_id'] == chunk['chunk_id']):
-                        return path, idx
-        return None, None
+        location = self.chunk_locations.get((chunk['chunkserver_id'], chunk['chunk_id']))
+        if location is None:
+            return None, None
+        return location[0], location[1]
 
-    async def replicate_chunk(self, chunk: ChunkEntry) -> ChunkEntry:
+    def chunkserver_url(self, chunkserver_id: str) -> str:
+        return self.peer_addresses.get(chunkserver_id, chunkserver_id)
 
-        path, part_index = self.get_chunkentry_location(chunk)
+    def live_replicas(self, path: str, part_index: int) -> List[ChunkEntry]:
+        return [chunk for chunk in self.files[path][part_index]
+                if not chunk['is_deleted'] and chunk['chunkserver_id'] in self.chunkserver_ids]
 
-        replicas = self.files.get(path, []).copy()
-        replicas.remove(chunk)
+    def chunk_length(self, node: NamespaceNode, part_index: int, shard: int | None = None) -> int:
+        """
+        Bytes a chunk of the part holds: its share of the file, or in a stripe the share of
+        data shard `shard`. Parity shards are as long as the stripe's first data shard.
+        """
+        chunk_index = part_index
+        if node.striped:
+            data_shards = node.ec[0]
+            chunk_index = part_index * data_shards + (shard if shard < data_shards else 0)
+        return max(0, min(self.max_chunk_size, node.size - chunk_index * self.max_chunk_size))
 
-        if not replicas:
-            raise ValueError("No replicas found for the specified chunk.")
-        
-        source_chunk = replicas[0]
-        source_chunkserver_id = source_chunk['chunkserver_id']
-        source_chunk_id = source_chunk['chunk_id']
+    def stripe_shards(self, node: NamespaceNode, part_index: int) -> List[int]:
+        """
+        Shards a stripe stores: the data shards holding any of the file, then every parity
+        shard. Data shards past the end of the file are all zeros and stored nowhere.
+        """
+        data_shards, parity_shards = node.ec
+        return [shard for shard in range(data_shards) if self.chunk_length(node, part_index, shard)] + \
+            list(range(data_shards, data_shards + parity_shards))
 
-        target_chunkserver_id = self.get_random_chunkserver()
-        target_chunk_id = self.get_first_chunk(target_chunkserver_id)
+    def part_health(self, path: str, part_index: int) -> Tuple[int, int, int]:
+        """
+        (live, needed, wanted) of a part. A replicated chunk is readable with one live replica
+        and wants `replication_factor`. A stripe is readable with as many distinct live shards
+        as it stores data shards, and wants every shard. The caller holds the path lock.
+        """
+        live = self.live_replicas(path, part_index)
+        with self.namespace_lock.read():
+            node = self.namespace.lookup(path)
+            if node is None or not node.striped:
+                return len(live), 1, self.replication_factor
+            shards = self.stripe_shards(node, part_index)
+            return len({chunk['shard'] for chunk in live}), len(shards) - node.ec[1], len(shards)
+
+    def needs_replication(self, path: str, part_index: int) -> bool:
+        with self.path_locks.read(path):
+            if path not in self.files or part_index >= len(self.files[path]):
+                return False
+            live, needed, wanted = self.part_health(path, part_index)
+            return needed <= live < wanted
 
-        # Call the chunkserver to replicate the chunk data
-        source_url = f"{source_chunkserver_id}/read_chunk/{source_chunk_id}"
-        target_url = f"{target_chunkserver_id}/replicate_chunk"
+    def missing_shard(self, path: str, part_index: int, live: List[ChunkEntry]) -> int | None:
+        """
+        The first shard a stripe lacks, data shards first, or None for a replicated chunk.
+        The caller holds the path lock.
+        """
+        with self.namespace_lock.read():
+            node = self.namespace.lookup(path)
+            if node is None or not node.striped:
+                return None
+            present = {chunk['shard'] for chunk in live}
+            return next(shard for shard in self.stripe_shards(node, part_index) if shard not in present)
+
+    def begin_replication(self, path: str, part_index: int, source_load: Dict[str, int] | None = None,
+                          avoid: Set[str] = frozenset()):
+        """
+        Picks a source replica and reserves a slot for a new replica of the part,
+        preferring targets not in `avoid`. Returns (source_chunk, target_chunkserver_id,
+        target_chunk_id, shard), or None if the part is gone, deleted or already fully
+        replicated. For a stripe, `shard` is the lost shard the target rebuilds from the
+        surviving ones and `source_chunk` the survivor counted as its source; it is None
+        for replicated chunks.
+        """
+        with self.path_locks.read(path):
+            if not self.needs_replication(path, part_index) or self.appends.leased(path, part_index):
+                return None  # A leased chunk is replicated once its lease expires
+
+            live = self.live_replicas(path, part_index)
+            shard = self.missing_shard(path, part_index, live)
+            # Prefer the source that is busy with the fewest copies, then the one serving the fewest requests
+            source_chunk = min(live, key=lambda chunk: (
+                (source_load or {}).get(chunk['chunkserver_id'], 0),
+                (self.load.get(chunk['chunkserver_id']) or {}).get("inflight_requests", 0),
+            ))
+
+            holders = {replica['chunkserver_id'] for replica in self.files[path][part_index]}
+            live_holders = {chunk['chunkserver_id'] for chunk in live}
+            with self.allocation_lock, self.allocation_seconds.timer("replica"):
+                try:
+                    target_chunkserver_id = self.get_random_chunkserver(exclude=holders | avoid, holders=live_holders)
+                except Exception:
+                    target_chunkserver_id = self.get_random_chunkserver(exclude=holders, holders=live_holders)
+                target_chunk_id = self.allocate_chunk(target_chunkserver_id)['chunk_id']
+        return source_chunk, target_chunkserver_id, target_chunk_id, shard
+
+    async def copy_chunk(self, client: httpx.AsyncClient, source_chunk: ChunkEntry, target_chunkserver_id: str, target_chunk_id: int,
+                         path: str, part_index: int, rebuild: int | None = None):
+        """
+        Tells the target chunkserver to pull the chunk straight from the source and
+        waits for its completion report. No chunk data passes through the master.
+        With `rebuild`, the target instead decodes that shard of the stripe from the
+        stripe's surviving shards.
+        """
+        endpoint, request = await asyncio.to_thread(self.copy_request, source_chunk, target_chunk_id, path, part_index, rebuild)
+        key = (target_chunkserver_id, target_chunk_id)
+        done = asyncio.get_running_loop().create_future()
+        self.pending_copies[key] = done
         try:
-            async with httpx.AsyncClient() as client:
-                # Fetch chunk data from source chunkserver
-                resp = await client.get(source_url)
-                if resp.status_code != 200 or resp.json().get("status") != "success":
-                    raise Exception("Failed to fetch chunk from source chunkserver")
-                data = resp.json()["data"]
-                # Send chunk data to target chunkserver
-                payload = {
-                    "source_chunkserver_id": source_chunkserver_id,
-                    "source_chunk_id": source_chunk_id,
-                    "target_chunk_id": target_chunk_id,
-                    "data": data
+            resp = await client.post(f"{self.chunkserver_url(target_chunkserver_id)}{endpoint}", json=request)
+            if resp.status_code != 202:
+                raise Exception(f"Target chunkserver refused the copy: {resp.status_code} {resp.text}")
+            report = await asyncio.wait_for(done, self.copy_timeout)
+        finally:
+            self.pending_copies.pop(key, None)
+        if report.get("status") != "success":
+            raise Exception(f"Copy to {target_chunkserver_id} failed: {report.get('message')}")
+
+    def copy_request(self, source_chunk: ChunkEntry, target_chunk_id: int, path: str, part_index: int,
+                     rebuild: int | None) -> Tuple[str, dict]:
+        """
+        The endpoint and request of a copy_chunk() call, built under the file's lock.
+        """
+        with self.path_locks.read(path), self.namespace_lock.read():
+            node = self.namespace.lookup(path)
+            if node is None or not node.is_file:
+                raise ValueError("File not found.")
+            shard = rebuild if rebuild is not None else source_chunk.get('shard')
+            if node.striped != (shard is not None):
+                raise ValueError("File was converted to erasure coding meanwhile.")
+            expected_size = self.chunk_length(node, part_index, shard)
+            if node.appendable and part_index == len(self.files.get(path, ())) - 1:
+                expected_size = None  # Replicas of the last chunk may differ in length after failed appends
+            version = node.version
+            if rebuild is None:
+                endpoint = "/replicate_chunk"
+                request = {
+                    "chunk_id": target_chunk_id,
+                    "source_chunkserver_id": source_chunk['chunkserver_id'],
+                    "source_chunk_id": source_chunk['chunk_id'],
+                    "expected_size": expected_size,
+                    "version": version,
                 }
-                resp2 = await client.post(target_url, json=payload)
-                if resp2.status_code != 200 or resp2.json().get("status") != "success":
-                    raise Exception("Failed to replicate chunk to target chunkserver")
-        except Exception as e:
-            print(f"Replication failed: {e}")
-            raise
+            else:
+                endpoint = "/reconstruct_chunk"
+                data_shards, parity_shards = node.ec
+                request = {
+                    "chunk_id": target_chunk_id,
+                    "shard": rebuild,
+                    "data_shards": data_shards,
+                    "parity_shards": parity_shards,
+                    "shard_size": self.chunk_length(node, part_index, 0),
+                    "expected_size": expected_size,
+                    "empty_shards": [index for index in range(data_shards) if not self.chunk_length(node, part_index, index)],
+                    "sources": [
+                        {"shard": chunk['shard'], "chunkserver_id": chunk['chunkserver_id'], "chunk_id": chunk['chunk_id']}
+                        for chunk in sorted(self.live_replicas(path, part_index), key=lambda chunk: chunk['shard'])
+                    ],
+                    "version": version,
+                }
+        return endpoint, request
 
-        # Create a new chunk entry for the target chunkserver only if replication succeeded
-        new_chunk = ChunkEntry(
-            chunkserver_id=target_chunkserver_id,
-            chunk_id=target_chunk_id,
-            is_deleted=False,
-            deleted_at=None
-        )
+    def complete_copy(self, chunkserver_id: str, chunk_id: int, report: dict) -> bool:
+        """
+        Hands a chunkserver's copy report to the waiting copy_chunk(). Returns False if
+        nobody waits for it anymore (timed out or aborted), the copy must then be dropped.
+        """
+        done = self.pending_copies.get((chunkserver_id, chunk_id))
+        if done is None or done.done():
+            return False
+        done.set_result(report)
+        return True
 
-        self.chunkservers[target_chunkserver_id].add(target_chunk_id)
-        self.files[path][part_index].append(new_chunk)
+    def finish_replication(self, path: str, part_index: int, target_chunkserver_id: str, target_chunk_id: int,
+                           shard: int | None = None) -> ChunkEntry | None:
+        """
+        Records a copied replica, or the copied or rebuilt `shard` of a stripe. If the file
+        went away or was converted to erasure coding meanwhile, the slot is released instead.
+        """
+        with self.path_locks.write(path):
+            if path not in self.files or part_index >= len(self.files[path]) or target_chunkserver_id not in self.chunkserver_ids \
+                    or any(chunk['is_deleted'] for chunk in self.files[path][part_index]):
+                self.abort_replication(target_chunkserver_id, target_chunk_id)
+                return None
+            with self.namespace_lock.read():
+                converted = self.namespace.lookup(path).striped != (shard is not None)
+            if converted:
+                self.abort_replication(target_chunkserver_id, target_chunk_id)
+                return None
+
+            # Create a new chunk entry for the target chunkserver only if replication succeeded
+            new_chunk = self.chunk_entry(target_chunkserver_id, target_chunk_id, shard=shard)
+
+            self.files[path][part_index].append(new_chunk)
+            with self.allocation_lock:
+                self.index_chunk(path, part_index, new_chunk)
+            fields = {"shard": shard} if shard is not None else {}
+            self.log_operation("replicate", path=path, part_index=part_index,
+                               chunkserver_id=target_chunkserver_id, chunk_id=target_chunk_id, **fields)
 
         return new_chunk
 
-    def remove_chunkentry(self, chunk: ChunkEntry):
+    def abort_replication(self, target_chunkserver_id: str, target_chunk_id: int):
+        self.release_chunk(target_chunkserver_id, target_chunk_id)
+
+    def finish_move(self, path: str, part_index: int, chunk: ChunkEntry, target_chunkserver_id: str, target_chunk_id: int) -> bool:
+        """
+        Records the copy of a replica the rebalancer moved, then drops the original, so the
+        part has one replica too many while the move is in progress, never one too few. The
+        original is deleted by the garbage collector after the retention period, which
+        outlasts the locations clients may have cached.
+        """
+        with self.path_locks.write(path):
+            if self.finish_replication(path, part_index, target_chunkserver_id, target_chunk_id, chunk.get('shard')) is None:
+                return False
+            with self.namespace_lock.write():
+                location = self.chunk_locations.get((chunk['chunkserver_id'], chunk['chunk_id']))
+                if location is not None and location[2] is chunk and not chunk['is_deleted']:
+                    self.remove_chunkentry(chunk)
+                    chunk['is_deleted'] = True
+                    chunk['deleted_at'] = time.time()
+                    self.deletion_queue.append((chunk['deleted_at'], None, [[chunk]]))
+        return True
+
+    async def replicate_chunk(self, chunk: ChunkEntry) -> ChunkEntry:
+        """
+        Adds one replica to the part holding `chunk`, right away and outside of the scheduler.
+        """
         path, part_index = self.get_chunkentry_location(chunk)
+        if path is None:
+            raise ValueError("Chunk is not part of any file.")
 
-        self.files[path][part_index].remove(chunk)
+        plan = await asyncio.to_thread(self.begin_replication, path, part_index)
+        if plan is None:
+            raise ValueError("Chunk does not need another replica.")
+        source_chunk, target_chunkserver_id, target_chunk_id, shard = plan
 
+        try:
+            async with httpx.AsyncClient() as client:
+                await self.copy_chunk(client, source_chunk, target_chunkserver_id, target_chunk_id, path, part_index,
+                                      rebuild=shard)
+        except Exception as e:
+            print(f"Replication failed: {e}")
+            await asyncio.to_thread(self.abort_replication, target_chunkserver_id, target_chunk_id)
+            raise
 
-    def replicate_chunkserver(self, chunkserver_id: str):
-        
-        if chunkserver_id not in self.chunkserver_ids:
-            raise ValueError("Chunkserver not registered.")
+        new_chunk = await asyncio.to_thread(self.finish_replication, path, part_index, target_chunkserver_id,
+                                            target_chunk_id, shard)
+        if new_chunk is None:
+            raise ValueError("File changed while the chunk was replicated.")
+        return new_chunk
 
+    # -------- Erasure coding --------
 
-        for path, parts in self.files.items():
-            for replicas in parts:
+    def set_storage_policy(self, path: str, ec) -> dict:
+        """
+        Asks for a file to be stored erasure coded as `ec` = (data shards, parity shards)
+        instead of replicated. The caller queues it for the converter unless it is striped.
+        """
+        path = self.format_path(path)
+        with self.path_locks.write(path), self.namespace_lock.write():
+            if not self.file_exists(path):
+                raise ValueError("File not found.")
+            node = self.namespace.lookup(path)
+            ec = self.check_ec(ec, node.appendable)
+            if node.ec is not None and node.ec != ec:
+                raise ValueError(f"File is already erasure coded as {node.ec[0]}+{node.ec[1]}.")
+            if node.ec is None:
+                node.ec = ec
+                self.log_operation("policy", path=path, ec=list(ec))
+            return {"path": path, "ec": list(ec), "striped": node.striped}
+
+    def plan_conversion(self, path: str) -> ConversionPlan | None:
+        """
+        Plans the stripes of a file to be erasure coded and reserves slots for the copies
+        and parity shards. Returns None if there is nothing to convert.
+        """
+        with self.path_locks.read(path), self.namespace_lock.read():
+            if not self.file_exists(path):
+                return None
+            node = self.namespace.lookup(path)
+            if node.ec is None or node.striped:
+                return None
+            data_shards, parity_shards = node.ec
+            parts = self.files[path]
+            live_parts = [self.live_replicas(path, part_index) for part_index in range(len(parts))]
+            if not all(live_parts):
+                raise Exception("Chunks without live replicas, waiting for re-replication")
+
+            plan = ConversionPlan(path, node.version, node.size, node.ec)
+            with self.allocation_lock, self.allocation_seconds.timer("stripe"):
+                try:
+                    for first in range(0, len(parts), data_shards):
+                        used: Set[str] = set()
+                        shards = []
+                        sources = []
+                        for shard, part_index in enumerate(range(first, min(first + data_shards, len(parts)))):
+                            live = live_parts[part_index]
+                            candidates = [chunk for chunk in live if chunk['chunkserver_id'] not in used]
+                            if candidates:
+                                chunk = self.rand.choice(candidates)
+                                chunkserver_id, chunk_id = chunk['chunkserver_id'], chunk['chunk_id']
+                                plan.kept[(chunkserver_id, chunk_id)] = part_index
+                            else:
+                                # Every replica sits on a server the stripe already uses, one is copied elsewhere
+                                chunkserver_id = self.get_random_chunkserver(exclude=used, holders=used)
+                                chunk_id = self.allocate_chunk(chunkserver_id)['chunk_id']
+                                plan.new_slots.append((chunkserver_id, chunk_id))
+                                plan.copies.append((self.rand.choice(live), chunkserver_id, chunk_id, part_index))
+                                chunk = None
+                            used.add(chunkserver_id)
+                            shards.append((shard, chunkserver_id, chunk_id))
+                            # The kept replica first, the chunkserver encoding the stripe falls back to the others
+                            sources.append([f"{replica['chunk_id']}@{replica['chunkserver_id']}"
+                                            for replica in sorted(live, key=lambda replica: replica is not chunk)])
+                        sources += [[] for _ in range(data_shards - len(sources))]
+
+                        parity_servers = self.placement.choose(self, parity_shards, used, used)
+                        if len(parity_servers) < parity_shards:
+                            raise Exception(f"Not enough chunkservers for {parity_shards} parity shards")
+                        for index, chunkserver_id in enumerate(parity_servers):
+                            chunk_id = self.allocate_chunk(chunkserver_id)['chunk_id']
+                            plan.new_slots.append((chunkserver_id, chunk_id))
+                            shards.append((data_shards + index, chunkserver_id, chunk_id))
+                        plan.stripes.append(shards)
+                        plan.sources.append(sources)
+                        plan.shard_sizes.append(max(0, min(self.max_chunk_size, node.size - first * self.max_chunk_size)))
+                except Exception:
+                    for chunkserver_id, chunk_id in plan.new_slots:
+                        self.release_chunk(chunkserver_id, chunk_id)
+                    raise
+        return plan
+
+    async def encode_stripe(self, client: httpx.AsyncClient, plan: ConversionPlan, stripe: int):
+        """
+        Has the chunkserver of the stripe's first parity shard read the data shards,
+        compute every parity shard and store them in their slots.
+        """
+        data_shards = plan.ec[0]
+        parity = [f"{chunk_id}@{chunkserver_id}" for shard, chunkserver_id, chunk_id in plan.stripes[stripe]
+                  if shard >= data_shards]
+        encoder = parity[0].split("@", 1)[1]
+        resp = await client.post(f"{self.chunkserver_url(encoder)}/encode_stripe", json={
+            "data": plan.sources[stripe],
+            "parity": parity,
+            "shard_size": plan.shard_sizes[stripe],
+            "version": plan.version,
+        })
+        if resp.status_code != 200:
+            raise Exception(f"Encoding stripe {stripe} of {plan.path} on {encoder} failed: {resp.status_code} {resp.text}")
+
+    def finish_conversion(self, plan: ConversionPlan) -> bool:
+        """
+        Swaps the file's replicated parts for the planned stripes, if the file and the
+        replicas kept as data shards are still as planned. The other replicas are deleted
+        by the garbage collector after the retention period.
+        """
+        path = plan.path
+        with self.path_locks.write(path), self.namespace_lock.write(), self.allocation_lock:
+            node = self.namespace.lookup(path)
+            if not self.file_exists(path) or node.version != plan.version or node.striped:
+                return False
+            for chunkserver_id, chunk_id in plan.new_slots:
+                if chunk_id not in self.chunkservers.get(chunkserver_id, ()):
+                    return False  # The chunkserver went away
+            for key, part_index in plan.kept.items():
+                location = self.chunk_locations.get(key)
+                if location is None or location[0] != path or location[1] != part_index or location[2]['is_deleted']:
+                    return False  # Dropped or moved meanwhile
+
+            kept = set(plan.kept)
+            deleted_at = time.time()
+            dropped = []
+            for replicas in self.files[path]:
                 for chunk in replicas:
-                    if chunk['chunkserver_id'] == chunkserver_id and not chunk['is_deleted']:
-                        try:
-                            new_chunk = asyncio.run(self.replicate_chunk(chunk))
-                            print(f"Replicated chunk {chunk['chunk_id']} from {chunkserver_id} to {new_chunk['chunkserver_id']}")
-                        except Exception as e:
-                            print(f"Failed to replicate chunk {chunk['chunk_id']} from {chunkserver_id}: {e}")
+                    if (chunk['chunkserver_id'], chunk['chunk_id']) not in kept:
+                        chunk['is_deleted'] = True
+                        chunk['deleted_at'] = deleted_at
+                        dropped.append(chunk)
+            self.unindex_file(path)
+            self.files[path] = [[self.chunk_entry(chunkserver_id, chunk_id, shard=shard)
+                                 for shard, chunkserver_id, chunk_id in stripe] for stripe in plan.stripes]
+            self.index_file(path)
+            node.striped = True
+            if dropped:
+                self.deletion_queue.append((deleted_at, None, [dropped]))
+            self.log_operation("convert", path=path, stripes=[
+                [self.chunk_row(chunk) for chunk in stripe] for stripe in self.files[path]
+            ])
+        return True
 
+    def abort_conversion(self, plan: ConversionPlan):
+        """
+        Frees the slots of a failed conversion. Copies and parity shards may already be on
+        disk, so the garbage collector deletes them before the slots are reused.
+        """
+        with self.allocation_lock:
+            for chunkserver_id, chunk_id in plan.new_slots:
+                if chunk_id in self.chunkservers.get(chunkserver_id, ()) \
+                        and (chunkserver_id, chunk_id) not in self.chunk_locations:
+                    self.pending_deletes[chunkserver_id].add(chunk_id)
+
+    def remove_chunkentry(self, chunk: ChunkEntry):
+        """
+        Drops a replica from its file. The caller holds the file's path lock.
+        """
+        with self.allocation_lock:
+            location = self.chunk_locations.get((chunk['chunkserver_id'], chunk['chunk_id']))
+            if location is None:
+                raise ValueError("Chunk is not part of any file.")
+
+            path, part_index, indexed_chunk = location
+            self.files[path][part_index].remove(indexed_chunk)
+            self.unindex_chunk(indexed_chunk)
+        self.log_operation("remove", chunkserver_id=indexed_chunk['chunkserver_id'], chunk_id=indexed_chunk['chunk_id'])
+
+
+    def chunkserver_parts(self, chunkserver_id: str) -> List[Tuple[str, int]]:
+        """
+        Returns (path, part_index) of every live part with a replica on the chunkserver.
+        """
+        parts = []
+        for chunk_id in self.chunkservers[chunkserver_id]:
+            location = self.chunk_locations.get((chunkserver_id, chunk_id))
+            if location is not None and not location[2]['is_deleted']:
+                parts.append((location[0], location[1]))
+        return parts
 
     def disconnect_chunkserver(self, chunkserver_id: str, replicate: bool = True):
+        # Touches the files of every chunk on the server, rare enough to stop everything else
+        with self.path_locks.write_all(), self.namespace_lock.write(), self.allocation_lock:
+            self.drop_chunkserver(chunkserver_id, replicate)
+
+    def drop_chunkserver(self, chunkserver_id: str, replicate: bool):
         if chunkserver_id not in self.chunkserver_ids:
             raise ValueError("Chunkserver not registered.")
-        
-        if replicate:
-            self.replicate_chunkserver(chunkserver_id)
+
+        lost_parts = self.chunkserver_parts(chunkserver_id)
+
+        # Replicas on the removed chunkserver are unreachable, drop them from their files
+        for chunk_id in self.chunkservers[chunkserver_id]:
+            location = self.chunk_locations.get((chunkserver_id, chunk_id))
+            if location is not None:
+                self.remove_chunkentry(location[2])
 
         self.chunkserver_ids.remove(chunkserver_id)
+        self.chunkserver_list.remove(chunkserver_id)
+        self.pool.remove(chunkserver_id)
+        del self.allocators[chunkserver_id]
         del self.chunkservers[chunkserver_id]
         del self.last_heartbeat[chunkserver_id]
+        self.disk_usage.pop(chunkserver_id, None)
+        self.load.pop(chunkserver_id, None)
+        self.labels.pop(chunkserver_id, None)
+        self.pending_deletes.pop(chunkserver_id, None)
+        self.log_operation("disconnect", chunkserver_id=chunkserver_id)
+
+        if replicate:
+            # The scheduler copies the lost replicas from the survivors in the background
+            for path, part_index in lost_parts:
+                self.replication.enqueue(path, part_index)
 
     def heartbeat_check(self):
         current_time = time.time()
@@ -356,9 +2152,24 @@ class Master:
                 print(f"Chunkserver {chunkserver_id} is unresponsive. Disconnecting...")
                 self.disconnect_chunkserver(chunkserver_id)
 
-master = Master()
-
-app = FastAPI()
+master = Master(data_dir=os.getenv("MASTER_DATA_DIR"))
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Runs under both `python master.py` and `uvicorn master:app`
+    master.replication.start()
+    master.rebalancer.start()
+    master.appends.start()
+    master.converter.start()
+    background = asyncio.create_task(serial_background_loop())
+    yield
+    background.cancel()
+    await master.converter.stop()
+    await master.appends.stop()
+    await master.rebalancer.stop()
+    await master.replication.stop()
+
+app = FastAPI(lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -367,6 +2178,10 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(RequestMetrics, histogram=master.request_seconds)
+
+# Opt-in sampling profiler, stacks are only sampled while GET /debug/profile runs
+profiler = StackSampler() if os.getenv("PROFILER_ENABLED", "") in ("1", "true") else None
 
 # -------------------
 # Request Models
@@ -375,18 +2190,55 @@ app.add_middleware(
 class CreateFileRequest(BaseModel):
     path: str
     size: int
+    compact: bool = False  # Return a FileLayout instead of nested ChunkEntry lists
+    ec: List[int] | None = None  # [data shards, parity shards] to store the file erasure coded instead of replicated
+
+class StoragePolicyRequest(BaseModel):
+    path: str
+    ec: List[int]  # [data shards, parity shards], e.g. [6, 3]
+
+class AppendTargetRequest(BaseModel):
+    path: str
+    full_part: int | None = None  # Part the primary answered "chunk_full" for
 
 class DeleteFileRequest(BaseModel):
     path: str
 
+class BatchPathsRequest(BaseModel):
+    paths: List[str] = []
+    prefix: str | None = None  # Every live file below this directory, instead of `paths`
+    stream: bool = False  # Answer with one JSON document per page of files (NDJSON) as they are ready
+
 class GetFileChunksRequest(BaseModel):
     path: str
 
 class RegisterChunkserverRequest(BaseModel):
     chunkserver_id: str
+    used_bytes: int | None = None  # Bytes taken by stored chunks
+    free_bytes: int | None = None  # Bytes still available for chunks
+    chunk_ids: List[int] | None = None  # Chunks on disk, None if the chunkserver sends no report
+    chunk_versions: List[int] | None = None  # Version of each reported chunk, 0 if unknown
+    labels: Dict[str, str] | None = None  # Failure domains for replica placement, e.g. {"rack": "r1", "zone": "z1"}
 
 class HeartbeatRequest(BaseModel):
     chunkserver_id: str
+    used_bytes: int | None = None
+    free_bytes: int | None = None
+    # Chunk changes since the previous acknowledged heartbeat, omitted when empty
+    added_ids: List[int] = []  # Chunks stored since
+    added_versions: List[int] = []  # Version of each added chunk
+    removed_ids: List[int] = []  # Chunks that disappeared without the master deleting them
+    corrupt_chunks: List[int] = []  # Chunks that failed their checksums
+    load: dict | None = None  # inflight_requests, copy_queue, read/write_bytes_per_second
+    appended_ids: List[int] = []  # Chunks that grew by record appends since
+    appended_sizes: List[int] = []  # Their length now
+
+class ReplicationCompleteRequest(BaseModel):
+    chunkserver_id: str
+    chunk_id: int
+    status: str  # "success" or "error"
+    size: int | None = None  # Bytes copied
+    message: str | None = None
 
 # -------------------
 # API Endpoints
@@ -396,7 +2248,11 @@ class HeartbeatRequest(BaseModel):
 @app.post("/create_file")
 def create_file(req: CreateFileRequest):
     try:
-        return master.create_file(req.path, req.size)
+        chunks = master.create_file(req.path, req.size, ec=req.ec)
+        master.sync_log()
+        if req.compact:
+            return master.get_file_layout(req.path)
+        return chunks
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
@@ -405,12 +2261,67 @@ def create_file(req: CreateFileRequest):
 @app.post("/delete_file")
 def delete_file(req: DeleteFileRequest):
     try:
-        return master.delete_file(req.path)
+        deleted = master.delete_file(req.path)
+        master.sync_log()
+        return deleted
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail="Internal server error")
 
+def batch_paths(req: BatchPathsRequest) -> List[str]:
+    if req.prefix is not None:
+        if req.paths:
+            raise ValueError("Pass either paths or a prefix, not both.")
+        return master.files_under(req.prefix)
+    return req.paths
+
+def ndjson_pages(paths: List[str], page: Callable[[List[str]], object]) -> StreamingResponse:
+    # A sync generator, Starlette runs it in the threadpool; no lock is held between pages
+    def lines():
+        for start in range(0, len(paths), master.batch_page_size):
+            yield json.dumps(page(paths[start:start + master.batch_page_size])) + "\n"
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+@app.post("/get_file_layouts")
+def get_file_layouts(req: BatchPathsRequest):
+    try:
+        paths = batch_paths(req)
+        if req.stream:
+            return ndjson_pages(paths, master.get_file_layouts)
+        return master.get_file_layouts(paths)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail="Internal server error")
+
+@app.post("/delete_files")
+def delete_files(req: BatchPathsRequest):
+    try:
+        if req.prefix is not None and not req.paths:
+            deleted = master.delete_prefix(req.prefix)
+            master.sync_log()
+            return {"path": master.format_path(req.prefix), "deleted": deleted}
+        results = master.delete_files(batch_paths(req))
+        master.sync_log()
+        return results
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail="Internal server error")
+
+@app.post("/append_target")
+async def append_target(req: AppendTargetRequest):
+    # Runs on the event loop, where leases are granted to the primaries
+    try:
+        return await master.appends.target(req.path, req.full_part)
+    except AppendBusy as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
 @app.get("/get_file_chunks")
 def get_file_chunks(path: str):
     try:
@@ -420,39 +2331,144 @@ def get_file_chunks(path: str):
     except Exception as e:
         raise HTTPException(status_code=500, detail="Internal server error")
 
+@app.get("/get_file_layout")
+def get_file_layout(path: str, offset: int = 0, limit: int | None = None):
+    try:
+        return master.get_file_layout(path, offset, limit)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail="Internal server error")
+
+@app.get("/list_directory")
+def list_directory(path: str = "/", start_after: str | None = None, limit: int = 1000):
+    try:
+        return master.list_directory(path, start_after, limit)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail="Internal server error")
+
+@app.get("/stat")
+def stat(path: str = "/", recursive: bool = False, start_after: str | None = None, limit: int = 1000):
+    try:
+        return master.stat(path, recursive, start_after, limit)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail="Internal server error")
+
+@app.post("/set_storage_policy")
+async def set_storage_policy(req: StoragePolicyRequest):
+    # Runs on the event loop, where the converter's queue lives
+    try:
+        result = await asyncio.to_thread(master.set_storage_policy, req.path, req.ec)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    await asyncio.to_thread(master.sync_log)
+    if not result["striped"]:
+        master.converter.enqueue(result["path"])
+    return result
+
 # -------- From Chunkserver --------
 
 @app.post("/register_chunkserver")
-def register_chunkserver(req: RegisterChunkserverRequest):
-    master.register_chunkserver(req.chunkserver_id)
+async def register_chunkserver(req: RegisterChunkserverRequest):
+    # Reconciling a full chunk report takes the metadata locks, so it runs in a worker
+    # thread; lost replicas are handed to the replication scheduler on the event loop
+    result = await asyncio.to_thread(master.register_chunkserver, req.chunkserver_id, req.used_bytes,
+                                     req.free_bytes, req.chunk_ids, req.chunk_versions, req.labels)
+    await asyncio.to_thread(master.sync_log)
+    return result
 
 @app.post("/heartbeat")
-def heartbeat(req: HeartbeatRequest):
-    master.heartbeat(req.chunkserver_id)
+async def heartbeat(req: HeartbeatRequest):
+    # Runs in a worker thread like registration, lost and corrupt chunks are handed to
+    # the replication scheduler on the event loop
+    unknown = await asyncio.to_thread(master.heartbeat, req.chunkserver_id, req.used_bytes, req.free_bytes,
+                                      req.corrupt_chunks, req.added_ids, req.added_versions, req.removed_ids,
+                                      req.load, req.appended_ids, req.appended_sizes)
+    return {"status": "success", "chunk_report": unknown}
+
+@app.post("/replication_complete")
+async def replication_complete(req: ReplicationCompleteRequest):
+    # Runs on the event loop, where the copy futures live. The target only moves the
+    # copy into place once accepted: a stale copy's slot may already hold another chunk.
+    if master.complete_copy(req.chunkserver_id, req.chunk_id, req.model_dump()):
+        return {"status": "accepted"}
+    return {"status": "discard"}
 
 
 # -------- Testing --------
 @app.get("/test/get_chunkservers")
 def get_chunkservers():
-    return list(master.chunkserver_ids)
+    with master.allocation_lock:
+        return list(master.chunkserver_ids)
 
 @app.get("/test/get_files")
 def get_files():
-    return list(master.files.keys())
+    with master.namespace_lock.read():
+        return list(master.files.keys())
 
 @app.get("/test/get_chunkserver_chunks")
 def get_chunkserver_chunks(chunkserver_id: str):
-    return list(master.chunkservers.get(chunkserver_id, []))
+    with master.allocation_lock:
+        return list(master.chunkservers.get(chunkserver_id, []))
+
+@app.get("/replication_status")
+def replication_status():
+    return master.replication.status()
+
+@app.get("/chunkserver_status")
+def chunkserver_status():
+    return master.chunkserver_status()
+
+@app.get("/rebalance_status")
+def rebalance_status():
+    return master.rebalancer.status()
+
+@app.get("/conversion_status")
+def conversion_status():
+    return master.converter.status()
+
+@app.get("/append_status")
+async def append_status():
+    return master.appends.status()
+
+@app.get("/gc_status")
+def gc_status():
+    return master.gc_status()
+
+@app.get("/metrics")
+def metrics():
+    return PlainTextResponse(master.metrics.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/debug/profile")
+def profile(seconds: float = 10.0, interval: float = 0.005, limit: int = 200, idle: bool = False):
+    if profiler is None:
+        raise HTTPException(status_code=404, detail="Profiling is off, start the master with PROFILER_ENABLED=1")
+    if not 0 < seconds <= 300 or not 0.001 <= interval <= 1:
+        raise HTTPException(status_code=400, detail="seconds must be in (0, 300], interval in [0.001, 1]")
+    try:
+        return PlainTextResponse(profiler.profile(seconds, interval, limit, idle))
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+@app.get("/test/check_chunk_index")
+def check_chunk_index():
+    return master.check_chunk_index()
 
 
 async def serial_background_loop():
     while True:
-        master.heartbeat_check()
-        master.garbage_collection()
-        await asyncio.sleep(5)
+        # Disconnecting a chunkserver takes every metadata lock, so it runs in a worker thread
+        await asyncio.to_thread(master.heartbeat_check)
+        await master.appends.expire()
+        await master.garbage_collection()
+        await asyncio.to_thread(master.checkpoint_if_needed)
+        await asyncio.sleep(master.background_interval)
 
 async def start_app():
-    asyncio.create_task(serial_background_loop())
     config = uvicorn.Config(app=app, host="0.0.0.0", port=8000)
     server = uvicorn.Server(config)
     await server.serve()
@@ -0,0 +1,163 @@
+import bisect
+from typing import Dict, Iterator, List, Optional, Tuple
+
+
+class NamespaceNode:
+    __slots__ = ("name", "parent", "children", "size", "version", "appendable", "ec", "striped", "deleted_at",
+                 "sorted_names")
+
+    def __init__(self, name: str, parent: Optional["NamespaceNode"], is_file: bool, size: int = 0, version: int = 0,
+                 appendable: bool = False):
+        self.name = name
+        self.parent = parent
+        self.children: Optional[Dict[str, NamespaceNode]] = None if is_file else {}
+        self.size = size  # File size in bytes, 0 for directories
+        self.version = version  # Version of the file's chunks, changes whenever the path gets new chunks
+        self.appendable = appendable  # Grows by record appends, its last chunk has no fixed size
+        self.ec: Optional[Tuple[int, int]] = None  # (data shards, parity shards) if the file is to be erasure coded
+        self.striped = False  # Parts are erasure coded stripes instead of replicated chunks
+        self.deleted_at: Optional[float] = None  # Set when the file is deleted, it stays until the garbage collector reclaims it
+        self.sorted_names: Optional[List[str]] = None  # Cached sorted child names, rebuilt lazily after changes
+
+    @property
+    def is_file(self) -> bool:
+        return self.children is None
+
+    def names(self) -> List[str]:
+        if self.sorted_names is None:
+            self.sorted_names = sorted(self.children)
+        return self.sorted_names
+
+
+class NamespaceTree:
+    """
+    Directory tree of the file namespace. Directories are implicit: they exist
+    as long as they contain at least one file. Lookups and validation walk one
+    node per path component, so they cost O(depth) regardless of file count.
+    """
+
+    def __init__(self):
+        self.root = NamespaceNode("", None, is_file=False)
+
+    @staticmethod
+    def split(path: str) -> List[str]:
+        return [part for part in path.split('/') if part]
+
+    def lookup(self, path: str) -> Optional[NamespaceNode]:
+        node = self.root
+        for part in self.split(path):
+            if node.is_file:
+                return None
+            node = node.children.get(part)
+            if node is None:
+                return None
+        return node
+
+    def can_hold_file(self, path: str) -> bool:
+        """
+        True if a file may live at `path`: no parent is a file and the path is not a directory.
+        """
+        parts = self.split(path)
+        if not parts:
+            return False
+        node = self.root
+        for part in parts:
+            if node.is_file:
+                return False
+            node = node.children.get(part)
+            if node is None:
+                return True
+        return node.is_file
+
+    def add_file(self, path: str, size: int, version: int = 0, appendable: bool = False):
+        parts = self.split(path)
+        if not parts:
+            raise ValueError("Invalid file path provided.")
+        node = self.root
+        for part in parts[:-1]:
+            child = node.children.get(part)
+            if child is None:
+                child = node.children[part] = NamespaceNode(part, node, is_file=False)
+                node.sorted_names = None
+            elif child.is_file:
+                raise ValueError("Invalid file path provided.")
+            node = child
+
+        existing = node.children.get(parts[-1])
+        if existing is not None and not existing.is_file:
+            raise ValueError("Invalid file path provided.")
+        if existing is None:
+            node.sorted_names = None
+        node.children[parts[-1]] = NamespaceNode(parts[-1], node, is_file=True, size=size, version=version,
+                                                 appendable=appendable)
+
+    def remove_file(self, path: str):
+        node = self.lookup(path)
+        if node is None or not node.is_file:
+            return
+        # Drop the file and every directory it leaves empty
+        while node.parent is not None and (node.is_file or not node.children):
+            parent = node.parent
+            del parent.children[node.name]
+            parent.sorted_names = None
+            node = parent
+
+    def list_directory(self, path: str, start_after: Optional[str] = None, limit: int = 1000) -> Tuple[List[NamespaceNode], Optional[str]]:
+        """
+        Returns up to `limit` children of a directory in name order, starting after
+        the name `start_after`, plus the cursor for the next page (None on the last page).
+        Deleted files are left out; a directory is listed until the garbage collector
+        reclaims its last file.
+        """
+        node = self.lookup(path)
+        if node is None or node.is_file:
+            raise ValueError("Directory not found.")
+        names = node.names()
+        index = 0 if start_after is None else bisect.bisect_right(names, start_after)
+        page: List[NamespaceNode] = []
+        while index < len(names) and len(page) < limit:
+            child = node.children[names[index]]
+            index += 1
+            if child.deleted_at is None:
+                page.append(child)
+        # Stops at the first live entry, without copying the rest of the names
+        more = any(node.children[names[i]].deleted_at is None for i in range(index, len(names)))
+        next_cursor = page[-1].name if more else None
+        return page, next_cursor
+
+    def walk_files(self, path: str, start_after: Optional[str] = None) -> Iterator[Tuple[str, NamespaceNode]]:
+        """
+        Yields (path, node) for every file under `path` in depth-first name order,
+        resuming after the full file path `start_after` if given.
+        """
+        node = self.lookup(path)
+        if node is None:
+            raise ValueError("Path not found.")
+        prefix = '/' + '/'.join(self.split(path))
+        if node.is_file:
+            if start_after is None or prefix > start_after:
+                yield prefix, node
+            return
+
+        resume = self.split(start_after) if start_after else []
+        base_depth = len(self.split(path))
+        if resume[:base_depth] != self.split(path):
+            resume = []
+        yield from self.walk_directory(node, prefix.rstrip('/'), resume[base_depth:])
+
+    def walk_directory(self, node: NamespaceNode, prefix: str, resume: List[str]) -> Iterator[Tuple[str, NamespaceNode]]:
+        names = node.names()
+        start = 0
+        if resume:
+            # Skip straight to the subtree that holds the cursor
+            start = bisect.bisect_left(names, resume[0])
+        for index in range(start, len(names)):
+            name = names[index]
+            child = node.children[name]
+            child_path = f"{prefix}/{name}"
+            on_cursor = bool(resume) and index == start and name == resume[0]
+            if child.is_file:
+                if not on_cursor:
+                    yield child_path, child
+            else:
+                yield from self.walk_directory(child, child_path, resume[1:] if on_cursor else [])
@@ -0,0 +1,207 @@
+import json
+import os
+import pickle
+import struct
+import threading
+import time
+import zlib
+from typing import Any, Dict, Iterator, List, Optional
+
+# Every log record is framed as <payload length><crc32 of payload><payload>,
+# the payload being the JSON encoded operation. A torn write at the end of the
+# log (crash during append) fails the length or CRC check and ends the replay.
+RECORD_HEADER = struct.Struct("<II")
+
+CHECKPOINT_FILE = "checkpoint.bin"
+SEGMENT_PREFIX = "oplog."
+SEGMENT_SUFFIX = ".log"
+
+
+class OperationLog:
+    """
+    Append-only write-ahead log for master metadata with group commit.
+
+    append() only queues a record; a flusher thread writes everything queued so
+    far with a single write and a single fsync. Callers that need durability
+    call wait() and share that fsync with every other record of the batch.
+
+    The log is split into segments named after the sequence number of their
+    first record. A checkpoint stores the sequence number it covers, so after a
+    checkpoint only segments created afterwards are needed to recover.
+    """
+
+    def __init__(self, directory: str, flush_interval: float = 0.005):
+        self.directory = directory
+        self.flush_interval = flush_interval  # Max time a record waits for its group commit
+        os.makedirs(directory, exist_ok=True)
+
+        self.lock = threading.Condition()  # Guards the queue and sequence numbers
+        self.io_lock = threading.Lock()  # Serializes writes, fsyncs and segment switches
+        self.pending: List[bytes] = []
+        self.last_seq = 0  # Sequence number of the last appended record
+        self.durable_seq = 0  # Sequence number of the last fsynced record
+        self.records_since_checkpoint = 0
+        self.closed = False
+        self.segment = None
+        self.flusher = None
+
+    def start(self, last_seq: int):
+        """
+        Starts appending after `last_seq`, the last record seen during recovery.
+        """
+        self.last_seq = self.durable_seq = last_seq
+        # Whatever is left in a segment starting after the recovered tail is a torn write
+        self.segment = open(self.segment_path(last_seq + 1), "wb")
+        self.flusher = threading.Thread(target=self.flush_loop, name="oplog-flusher", daemon=True)
+        self.flusher.start()
+
+    # -------- Paths --------
+
+    def segment_path(self, first_seq: int) -> str:
+        return os.path.join(self.directory, f"{SEGMENT_PREFIX}{first_seq:020d}{SEGMENT_SUFFIX}")
+
+    def segments(self) -> List[str]:
+        names = [name for name in os.listdir(self.directory)
+                 if name.startswith(SEGMENT_PREFIX) and name.endswith(SEGMENT_SUFFIX)]
+        return [os.path.join(self.directory, name) for name in sorted(names)]
+
+    def checkpoint_path(self) -> str:
+        return os.path.join(self.directory, CHECKPOINT_FILE)
+
+    # -------- Appending --------
+
+    def append(self, record: Dict[str, Any]) -> int:
+        """
+        Queues a record and returns its sequence number. Does not wait for fsync.
+        """
+        with self.lock:
+            if self.closed:
+                raise RuntimeError("Operation log is closed.")
+            self.last_seq += 1
+            record["seq"] = self.last_seq
+            payload = json.dumps(record, separators=(",", ":")).encode()
+            self.pending.append(RECORD_HEADER.pack(len(payload), zlib.crc32(payload)) + payload)
+            self.records_since_checkpoint += 1
+            if len(self.pending) == 1:
+                self.lock.notify_all()
+            return self.last_seq
+
+    def wait(self, seq: Optional[int] = None):
+        """
+        Blocks until the record `seq` (default: everything appended so far) is on disk.
+        """
+        with self.lock:
+            target = self.last_seq if seq is None else seq
+            while self.durable_seq < target:
+                if self.closed:
+                    raise RuntimeError("Operation log is closed.")
+                self.lock.wait()
+
+    def flush_loop(self):
+        while True:
+            with self.lock:
+                while not self.pending and not self.closed:
+                    self.lock.wait()
+                if self.closed and not self.pending:
+                    return
+
+            # Give concurrent appenders a moment to join this group commit
+            time.sleep(self.flush_interval)
+
+            with self.io_lock:
+                with self.lock:
+                    batch, self.pending = self.pending, []
+                    batch_seq = self.last_seq
+                if batch:
+                    self.segment.write(b"".join(batch))
+                    self.segment.flush()
+                    os.fsync(self.segment.fileno())
+
+            with self.lock:
+                self.durable_seq = max(self.durable_seq, batch_seq)
+                self.lock.notify_all()
+
+    def close(self):
+        with self.lock:
+            self.closed = True
+            self.lock.notify_all()
+        self.flusher.join()
+        self.segment.close()
+
+    # -------- Checkpoints --------
+
+    def write_checkpoint(self, state: Dict[str, Any]):
+        """
+        Persists a snapshot of the master state that reflects every record up to
+        the current sequence number, then drops the log segments it covers.
+        The caller must not append while the snapshot is taken.
+        """
+        self.finish_checkpoint(self.begin_checkpoint(), state)
+
+    def begin_checkpoint(self) -> int:
+        """
+        Flushes the log and starts a fresh segment. Returns the sequence number the
+        snapshot must reflect; take the snapshot and call this without appending in between.
+        """
+        with self.io_lock:
+            with self.lock:
+                seq = self.last_seq
+                batch, self.pending = self.pending, []
+                self.records_since_checkpoint = 0
+            self.segment.write(b"".join(batch))
+            self.segment.flush()
+            os.fsync(self.segment.fileno())
+            self.segment.close()
+            # Records appended from now on go to a fresh segment
+            self.segment = open(self.segment_path(seq + 1), "wb")
+
+        with self.lock:
+            self.durable_seq = max(self.durable_seq, seq)
+            self.lock.notify_all()
+        return seq
+
+    def finish_checkpoint(self, seq: int, state: Dict[str, Any]):
+        """
+        Writes the snapshot taken at `seq` and drops the log segments it covers.
+        """
+        old_segments = [path for path in self.segments() if path != self.segment.name]
+        tmp_path = self.checkpoint_path() + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(zlib.compress(pickle.dumps({"seq": seq, "state": state}, protocol=pickle.HIGHEST_PROTOCOL), 1))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.checkpoint_path())
+
+        for path in old_segments:
+            os.remove(path)
+
+    def load_checkpoint(self) -> tuple[int, Optional[Dict[str, Any]]]:
+        """
+        Returns (seq, state) of the latest checkpoint, or (0, None) if there is none.
+        """
+        if not os.path.exists(self.checkpoint_path()):
+            return 0, None
+        with open(self.checkpoint_path(), "rb") as f:
+            checkpoint = pickle.loads(zlib.decompress(f.read()))
+        return checkpoint["seq"], checkpoint["state"]
+
+    # -------- Recovery --------
+
+    def read_records(self, after_seq: int = 0) -> Iterator[Dict[str, Any]]:
+        """
+        Yields every intact record with a sequence number above `after_seq`, in order.
+        """
+        for path in self.segments():
+            with open(path, "rb") as f:
+                data = f.read()
+            offset = 0
+            while offset + RECORD_HEADER.size <= len(data):
+                length, crc = RECORD_HEADER.unpack_from(data, offset)
+                payload = data[offset + RECORD_HEADER.size:offset + RECORD_HEADER.size + length]
+                if len(payload) < length or zlib.crc32(payload) != crc:
+                    print(f"Ignoring torn operation log record in {path} at offset {offset}")
+                    break
+                offset += RECORD_HEADER.size + length
+                record = json.loads(payload)
+                if record["seq"] > after_seq:
+                    yield record
@@ -0,0 +1,190 @@
+import math
+import time
+from typing import TYPE_CHECKING, Dict, Iterable, List, Set
+
+if TYPE_CHECKING:
+    from master import Master
+
+
+class PlacementPolicy:
+    """
+    Chooses the chunkservers new replicas go to. Policies only pick servers, the
+    master allocates the slots and tells the policy through `placed`.
+    """
+
+    name = "base"
+    stripes = False  # True if whole files may be striped over servers ordered by free space
+
+    def choose(self, master: "Master", count: int, exclude: Set[str] = frozenset(),
+               holders: Iterable[str] = ()) -> List[str]:
+        """
+        Returns up to `count` distinct chunkservers with free slots, none in `exclude`.
+        `holders` already hold replicas of the chunk.
+        """
+        raise NotImplementedError
+
+    def placed(self, chunkserver_id: str, count: int = 1):
+        """
+        Called when `count` replicas were allocated on a chunkserver.
+        """
+
+    def accepts(self, master: "Master", chunkserver_id: str, holders: Iterable[str]) -> bool:
+        """
+        Whether the chunkserver may hold a replica of a chunk that `holders` already store.
+        """
+        return True
+
+
+class MostFreePolicy(PlacementPolicy):
+    """
+    Servers with the most free slots first, from the master's heap-ordered pool.
+    Fills servers evenly by free space but ignores how busy they are.
+    """
+
+    name = "most_free"
+    stripes = True
+
+    def choose(self, master, count, exclude=frozenset(), holders=()):
+        chosen = master.pool.take(count, exclude)
+        for chunkserver_id in chosen:
+            master.update_pool(chunkserver_id)  # take() pops the entries, put them back unchanged
+        return chosen
+
+
+class PowerOfTwoPolicy(PlacementPolicy):
+    """
+    Power of two choices: for every replica two random servers with free slots are
+    compared and the better one wins. The score weighs free space against the
+    load the server reported in its last heartbeat, so hot servers are avoided
+    without scanning the whole cluster.
+    """
+
+    name = "p2c"
+
+    def __init__(self, choices: int = 2, attempts: int = 16):
+        self.choices = choices
+        self.attempts = attempts  # Random draws per pick before falling back to a scan
+
+    def score(self, master: "Master", chunkserver_id: str) -> float:
+        load = master.load.get(chunkserver_id) or {}
+        busy = load.get("inflight_requests", 0) + load.get("copy_queue", 0)
+        writes = load.get("write_bytes_per_second", 0) / master.max_chunk_size
+        return master.free_slots(chunkserver_id) / (1 + busy + writes)
+
+    def candidates(self, master: "Master", exclude: Set[str]) -> List[str]:
+        return [chunkserver_id for chunkserver_id in master.chunkserver_list
+                if chunkserver_id not in exclude and master.free_slots(chunkserver_id) > 0]
+
+    def choose(self, master, count, exclude=frozenset(), holders=()):
+        chosen: List[str] = []
+        servers = master.chunkserver_list
+        for _ in range(count):
+            sample = []
+            for _ in range(self.attempts):
+                if len(sample) == self.choices or not servers:
+                    break
+                chunkserver_id = servers[master.rand.randrange(len(servers))]
+                if (chunkserver_id not in exclude and chunkserver_id not in chosen
+                        and chunkserver_id not in sample and master.free_slots(chunkserver_id) > 0):
+                    sample.append(chunkserver_id)
+            if len(sample) < self.choices:
+                # Few eligible servers left, sample from the ones that are
+                eligible = [c for c in self.candidates(master, exclude) if c not in chosen and c not in sample]
+                sample.extend(master.rand.sample(eligible, min(self.choices - len(sample), len(eligible))))
+            if not sample:
+                break
+            chosen.append(max(sample, key=lambda chunkserver_id: self.score(master, chunkserver_id)))
+        return chosen
+
+
+class WriteBalancePolicy(PlacementPolicy):
+    """
+    Spreads incoming writes: the servers that were given the fewest replicas
+    recently (decaying with `half_life` seconds) plus the write throughput they
+    report win. Scans every server, so it suits clusters of up to a few hundred.
+    """
+
+    name = "write_balance"
+
+    def __init__(self, half_life: float = 60.0):
+        self.half_life = half_life
+        self.recent: Dict[str, float] = {}  # Decayed count of replicas placed per server
+        self.updated_at: Dict[str, float] = {}
+
+    def recent_writes(self, chunkserver_id: str, now: float) -> float:
+        count = self.recent.get(chunkserver_id, 0.0)
+        if count:
+            count *= math.pow(0.5, (now - self.updated_at[chunkserver_id]) / self.half_life)
+        return count
+
+    def score(self, master: "Master", chunkserver_id: str, now: float) -> float:
+        load = master.load.get(chunkserver_id) or {}
+        return self.recent_writes(chunkserver_id, now) + load.get("write_bytes_per_second", 0) / master.max_chunk_size
+
+    def choose(self, master, count, exclude=frozenset(), holders=()):
+        now = time.monotonic()
+        eligible = [chunkserver_id for chunkserver_id in master.chunkserver_list
+                    if chunkserver_id not in exclude and master.free_slots(chunkserver_id) > 0]
+        eligible.sort(key=lambda chunkserver_id: self.score(master, chunkserver_id, now))
+        return eligible[:count]
+
+    def placed(self, chunkserver_id: str, count: int = 1):
+        now = time.monotonic()
+        self.recent[chunkserver_id] = self.recent_writes(chunkserver_id, now) + count
+        self.updated_at[chunkserver_id] = now
+
+
+class DomainSpreadPolicy(PlacementPolicy):
+    """
+    Puts the replicas of a chunk in distinct failure domains (racks or zones, from
+    the chunkserver labels) where possible, letting `inner` pick within them.
+    Unlabeled chunkservers are their own domain.
+    """
+
+    def __init__(self, inner: PlacementPolicy, label: str = "rack"):
+        self.inner = inner
+        self.label = label
+        self.name = f"{inner.name}+{label}"
+
+    def domain(self, master: "Master", chunkserver_id: str) -> str:
+        return master.labels.get(chunkserver_id, {}).get(self.label, chunkserver_id)
+
+    def choose(self, master, count, exclude=frozenset(), holders=()):
+        chosen: List[str] = []
+        used_domains = {self.domain(master, chunkserver_id) for chunkserver_id in holders}
+        for _ in range(count):
+            taken = set(exclude) | set(chosen)
+            spread = taken | {chunkserver_id for chunkserver_id in master.chunkserver_list
+                              if self.domain(master, chunkserver_id) in used_domains}
+            # Fall back to a shared domain rather than fewer replicas
+            pick = self.inner.choose(master, 1, spread, holders) or self.inner.choose(master, 1, taken, holders)
+            if not pick:
+                break
+            chosen.append(pick[0])
+            used_domains.add(self.domain(master, pick[0]))
+        return chosen
+
+    def placed(self, chunkserver_id: str, count: int = 1):
+        self.inner.placed(chunkserver_id, count)
+
+    def accepts(self, master, chunkserver_id, holders):
+        domain = self.domain(master, chunkserver_id)
+        return all(self.domain(master, holder) != domain for holder in holders)
+
+
+POLICIES = {
+    MostFreePolicy.name: MostFreePolicy,
+    PowerOfTwoPolicy.name: PowerOfTwoPolicy,
+    WriteBalancePolicy.name: WriteBalancePolicy,
+}
+
+
+def make_policy(spec: str) -> PlacementPolicy:
+    """
+    Builds a policy from a spec like "p2c", "most_free+rack" or "write_balance+zone".
+    """
+    name, _, label = spec.partition("+")
+    if name not in POLICIES:
+        raise ValueError(f"Unknown placement policy {name!r}, expected one of {', '.join(POLICIES)}")
+    policy = POLICIES[name]()
+    return DomainSpreadPolicy(policy, label) if label else policy
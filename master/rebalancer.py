@@ -0,0 +1,321 @@
+import asyncio
+import statistics
+import time
+from collections import defaultdict
+from typing import TYPE_CHECKING, Dict, Iterator, List, Optional, Set, Tuple
+
+import httpx
+
+from replication import on_loop
+
+if TYPE_CHECKING:
+    from master import ChunkEntry, Master
+
+
+class Rebalancer:
+    """
+    Moves chunk replicas from the fullest chunkservers to the emptiest ones, so new
+    chunkservers take their share of the data (and of the reads) instead of sitting idle.
+
+    A move copies the replica to the target with the re-replication machinery, records
+    the copy and only then drops the original, so a part never has fewer replicas than
+    before the move. Moves are planned in rounds while the utilization spread (fullest
+    minus emptiest server) exceeds `threshold`, at most `max_concurrent` at a time and
+    throttled to `bytes_per_second` of copied data across the cluster.
+    """
+
+    def __init__(self, master: "Master", bytes_per_second: int = 32 * 1024 * 1024, max_concurrent: int = 4,
+                 threshold: float = 0.1, interval: float = 60.0):
+        self.master = master
+        self.bytes_per_second = bytes_per_second  # Copy budget, 0 disables the rebalancer
+        self.max_concurrent = max_concurrent  # Moves in flight
+        self.threshold = threshold  # Utilization spread tolerated between the fullest and emptiest server
+        self.interval = interval  # Seconds between balance checks when there is nothing to do
+
+        self.moving: Set[Tuple[str, int]] = set()  # Parts with a move in flight
+        self.draining: Dict[str, Set[int]] = defaultdict(set)  # Moved-away originals the garbage collector has not reclaimed yet
+        self.next_copy_at = 0.0  # Monotonic time the copy budget allows the next move to start
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.wakeup: Optional[asyncio.Event] = None
+        self.task: Optional[asyncio.Task] = None
+        self.client: Optional[httpx.AsyncClient] = None
+
+        # Metrics
+        self.in_flight = 0
+        self.completed = 0
+        self.failed = 0
+        self.bytes_moved = 0
+        self.episode_started_at: Optional[float] = None  # When the current rebalancing started
+        self.spread_before: Optional[dict] = None  # Utilization spread when the last rebalancing started
+        self.spread_after: Optional[dict] = None  # Utilization spread when it finished
+        self.last_episode_seconds: Optional[float] = None
+
+    # -------- Lifecycle --------
+
+    def start(self):
+        """
+        Starts the rebalancing loop, must be called from the running event loop.
+        """
+        if self.task is not None or self.bytes_per_second <= 0:
+            return
+        self.loop = asyncio.get_running_loop()
+        self.wakeup = asyncio.Event()
+        self.client = httpx.AsyncClient(timeout=httpx.Timeout(120.0, connect=5.0))
+        self.task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+        self.loop = None
+        if self.client is not None:
+            await self.client.aclose()
+            self.client = None
+
+    def notify(self):
+        """
+        Checks the balance right away, e.g. after a chunkserver joined. May be called from any thread.
+        """
+        if self.wakeup is None:
+            return
+        if on_loop(self.loop):
+            self.wakeup.set()
+        else:
+            self.loop.call_soon_threadsafe(self.wakeup.set)
+
+    async def run(self):
+        while True:
+            # Planning takes the metadata locks, so it runs in a worker thread
+            planning = asyncio.ensure_future(asyncio.to_thread(self.plan))
+            try:
+                moves = await asyncio.shield(planning)
+            except asyncio.CancelledError:
+                # The plan still reserves its target slots, give them back
+                await asyncio.wait([planning])
+                if not planning.cancelled() and planning.exception() is None:
+                    await asyncio.to_thread(self.drop, planning.result())
+                raise
+            except Exception as e:
+                print(f"Rebalancing plan failed: {e}")
+                moves = []
+            if moves:
+                tasks = [asyncio.create_task(self.move(*move)) for move in moves]
+                try:
+                    moved = await asyncio.gather(*tasks)
+                except asyncio.CancelledError:
+                    # Moves cancelled before they started still hold their target slots
+                    await asyncio.wait(tasks)
+                    await asyncio.to_thread(self.drop, [move for move in moves if (move[0], move[1]) in self.moving])
+                    raise
+                if any(moved):
+                    continue
+            else:
+                await asyncio.to_thread(self.finish_episode)
+            self.wakeup.clear()
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+
+    # -------- Planning --------
+
+    def utilization(self) -> Dict[str, float]:
+        """
+        Fraction of its chunk slots each chunkserver has allocated, not counting the
+        originals of finished moves that only wait for the garbage collector.
+        """
+        master = self.master
+        with master.allocation_lock:
+            for chunkserver_id in set(self.draining) - master.chunkserver_ids:
+                del self.draining[chunkserver_id]
+            utilization = {}
+            for chunkserver_id in master.chunkserver_ids:
+                allocated = master.chunkservers[chunkserver_id]
+                draining = self.draining.get(chunkserver_id)
+                if draining:
+                    draining.intersection_update(allocated)
+                used = len(allocated) - len(draining or ())
+                utilization[chunkserver_id] = used / max(1, master.slot_capacity(chunkserver_id))
+        return utilization
+
+    def spread(self, utilization: Dict[str, float] | None = None) -> dict:
+        utilization = self.utilization() if utilization is None else utilization
+        if not utilization:
+            return {"min": None, "max": None, "spread": 0.0, "stdev": 0.0}
+        values = list(utilization.values())
+        return {
+            "min": min(values),
+            "max": max(values),
+            "spread": max(values) - min(values),
+            "stdev": statistics.pstdev(values),
+        }
+
+    def plan(self) -> List[Tuple[str, int, "ChunkEntry", str, int, int]]:
+        """
+        Picks up to `max_concurrent` moves, each from the currently fullest chunkserver to
+        the emptiest one that may take the part, and reserves their target slots.
+        Returns (path, part_index, source_chunk, target_chunkserver_id, target_chunk_id, size).
+        """
+        master = self.master
+        utilization = self.utilization()
+        if len(utilization) < 2 or self.spread(utilization)["spread"] <= self.threshold:
+            return []
+        if self.episode_started_at is None:
+            self.episode_started_at = time.time()
+            self.spread_before = self.spread(utilization)
+
+        capacity = {chunkserver_id: max(1, master.slot_capacity(chunkserver_id)) for chunkserver_id in utilization}
+        candidates: Dict[str, Iterator[int]] = {}
+        exhausted: Set[str] = set()  # Sources with nothing left to move this round
+        moves = []
+        try:  # Chunkservers may go away meanwhile
+            while len(moves) < self.max_concurrent:
+                sources = [chunkserver_id for chunkserver_id in utilization if chunkserver_id not in exhausted]
+                if not sources:
+                    break
+                source = max(sources, key=utilization.get)
+                targets = sorted((chunkserver_id for chunkserver_id in utilization
+                                  if utilization[source] - utilization[chunkserver_id] > self.threshold
+                                  and master.free_slots(chunkserver_id) > 0), key=utilization.get)
+                if not targets:
+                    break
+                if source not in candidates:
+                    with master.allocation_lock:
+                        candidates[source] = iter(list(master.chunkservers[source]))
+                move = self.pick_move(source, candidates[source], targets)
+                if move is None:
+                    exhausted.add(source)
+                    continue
+                path, part_index, chunk, target = move
+                size = self.chunk_size(path, part_index, chunk)
+                with master.allocation_lock, master.allocation_seconds.timer("move"):
+                    target_chunk_id = master.allocate_chunk(target)['chunk_id']
+                self.moving.add((path, part_index))
+                moves.append((path, part_index, chunk, target, target_chunk_id, size))
+                # The source keeps its slot until the original is deleted, count it as moved already
+                utilization[source] -= 1 / capacity[source]
+                utilization[target] += 1 / capacity[target]
+        except Exception:
+            self.drop(moves)
+            raise
+        return moves
+
+    def drop(self, moves: List[Tuple[str, int, "ChunkEntry", str, int, int]]):
+        """
+        Releases the target slots of planned moves that will not run.
+        """
+        for path, part_index, _, target_chunkserver_id, target_chunk_id, _ in moves:
+            self.master.abort_replication(target_chunkserver_id, target_chunk_id)
+            self.moving.discard((path, part_index))
+
+    def chunk_size(self, path: str, part_index: int, chunk: "ChunkEntry") -> int:
+        """
+        Bytes the replica holds, what moving it copies.
+        """
+        master = self.master
+        with master.namespace_lock.read():
+            node = master.namespace.lookup(path)
+            return master.chunk_length(node, part_index, chunk.get('shard')) if node else 0
+
+    def pick_move(self, source: str, chunk_ids: Iterator[int], targets: List[str]):
+        """
+        Returns the next replica on `source` that can move to one of `targets` as
+        (path, part_index, chunk, target), or None if there is none.
+        """
+        master = self.master
+        policy = master.placement
+        for chunk_id in chunk_ids:
+            location = master.chunk_locations.get((source, chunk_id))
+            if location is None:
+                continue  # Copy in flight, pending delete or orphan
+            path, part_index, chunk = location
+            if (path, part_index) in self.moving or (path, part_index) in master.replication.queued \
+                    or master.appends.leased(path, part_index):
+                continue  # Appends to a leased chunk would miss the copy
+            with master.path_locks.read(path):
+                if master.chunk_locations.get((source, chunk_id)) is not location or chunk['is_deleted']:
+                    continue
+                live, _, wanted = master.part_health(path, part_index)
+                if live < wanted:
+                    continue  # Re-replication comes first
+                holders = {replica['chunkserver_id'] for replica in master.files[path][part_index]}
+            others = holders - {source}
+            for target in targets:
+                if target in holders:
+                    continue
+                # Never move a replica into a failure domain the other replicas already cover, unless its source was in one
+                if not policy.accepts(master, target, others) and policy.accepts(master, source, others):
+                    continue
+                return path, part_index, chunk, target
+        return None
+
+    # -------- Moving --------
+
+    async def throttle(self, size: int):
+        now = time.monotonic()
+        start_at = max(now, self.next_copy_at)
+        self.next_copy_at = start_at + size / self.bytes_per_second
+        if start_at > now:
+            await asyncio.sleep(start_at - now)
+
+    async def move(self, path: str, part_index: int, chunk: "ChunkEntry", target_chunkserver_id: str,
+                   target_chunk_id: int, size: int) -> bool:
+        """
+        Copies the replica to the reserved target slot, then drops the original. Returns True if it moved.
+        """
+        master = self.master
+        replication = master.replication
+        source_id = chunk['chunkserver_id']
+
+        self.in_flight += 1
+        replication.source_load[source_id] += 1
+        try:
+            await self.throttle(size)
+            # Shares the per-chunkserver copy limits with re-replication
+            async with replication.slot(replication.source_slots, source_id, replication.per_source), \
+                       replication.slot(replication.target_slots, target_chunkserver_id, replication.per_target):
+                await master.copy_chunk(self.client, chunk, target_chunkserver_id, target_chunk_id, path, part_index)
+        except asyncio.CancelledError:
+            await asyncio.to_thread(master.abort_replication, target_chunkserver_id, target_chunk_id)
+            raise
+        except Exception as e:
+            print(f"Moving {path}[{part_index}] from {source_id} to {target_chunkserver_id} failed: {e}")
+            await asyncio.to_thread(master.abort_replication, target_chunkserver_id, target_chunk_id)
+            self.failed += 1
+            return False
+        finally:
+            replication.source_load[source_id] -= 1
+            self.in_flight -= 1
+            self.moving.discard((path, part_index))
+
+        if not await asyncio.to_thread(master.finish_move, path, part_index, chunk, target_chunkserver_id, target_chunk_id):
+            return False
+        self.draining[source_id].add(chunk['chunk_id'])
+        self.completed += 1
+        self.bytes_moved += size
+        return True
+
+    # -------- Metrics --------
+
+    def finish_episode(self):
+        if self.episode_started_at is not None and not self.in_flight:
+            self.last_episode_seconds = time.time() - self.episode_started_at
+            self.spread_after = self.spread()
+            self.episode_started_at = None
+
+    def status(self) -> dict:
+        return {
+            "enabled": self.bytes_per_second > 0,
+            "rebalancing": self.episode_started_at is not None,
+            "in_flight": self.in_flight,
+            "completed": self.completed,
+            "failed": self.failed,
+            "bytes_moved": self.bytes_moved,
+            "bytes_per_second_limit": self.bytes_per_second,
+            "threshold": self.threshold,
+            "spread_now": self.spread(),
+            "spread_before": self.spread_before,
+            "spread_after": self.spread_after,
+            "last_episode_seconds": self.last_episode_seconds,
+        }
@@ -0,0 +1,272 @@
+import asyncio
+import heapq
+import itertools
+import time
+from collections import defaultdict
+from typing import TYPE_CHECKING, Dict, List, Optional, Set, Tuple
+
+import httpx
+
+if TYPE_CHECKING:
+    from master import Master
+
+
+class ReplicationScheduler:
+    """
+    Re-replicates under-replicated chunks on the master's event loop.
+
+    Work items are file parts (path, part_index), ordered by how many more copies
+    they can lose, so chunks down to a single copy go first. Lost shards of erasure
+    coded stripes are rebuilt from the surviving shards instead of copied. A fixed
+    pool of worker tasks bounds the global concurrency, and per-chunkserver
+    semaphores bound how many copies a single server sources or receives at once.
+    Failed copies are retried with exponential backoff, and parts still failing after
+    `max_attempts` are retried every `max_backoff` until they recover or are gone, so
+    an outage longer than the backoff (e.g. no eligible target while a rack is down)
+    does not leave them under-replicated.
+    """
+
+    def __init__(self, master: "Master", max_concurrent: int = 16, per_source: int = 4, per_target: int = 4,
+                 max_attempts: int = 5, base_backoff: float = 1.0, max_backoff: float = 60.0):
+        self.master = master
+        self.max_concurrent = max_concurrent  # Copies in flight across the cluster
+        self.per_source = per_source  # Copies a single chunkserver serves at once
+        self.per_target = per_target  # Copies a single chunkserver receives at once
+        self.max_attempts = max_attempts
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+
+        self.queue: List[Tuple[int, int, str, int]] = []  # (copies it can still lose, seq, path, part_index)
+        self.queued: Set[Tuple[str, int]] = set()
+        self.active: Set[Tuple[str, int]] = set()  # Parts a worker is copying
+        self.attempts: Dict[Tuple[str, int], int] = defaultdict(int)
+        self.stuck: Set[Tuple[str, int]] = set()  # Parts past max_attempts, retried every max_backoff
+        self.delayed = 0  # Items waiting out a retry backoff
+        self.counter = itertools.count()
+        self.source_slots: Dict[str, asyncio.Semaphore] = {}
+        self.target_slots: Dict[str, asyncio.Semaphore] = {}
+        self.source_load: Dict[str, int] = defaultdict(int)
+        self.failed_targets: Dict[str, float] = {}  # Chunkserver -> time of its last failed copy
+        self.failure_cooldown = 30.0  # Seconds a failed target is avoided for
+
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.wakeup: Optional[asyncio.Event] = None
+        self.workers: List[asyncio.Task] = []
+        self.retries: Set[asyncio.Task] = set()  # Tasks re-queueing the delayed items
+        self.client: Optional[httpx.AsyncClient] = None
+
+        # Metrics
+        self.in_flight = 0
+        self.completed = 0
+        self.failed_attempts = 0
+        self.episode_started_at: Optional[float] = None  # When the current recovery started
+        self.episode_completed = 0
+        self.last_recovery_seconds: Optional[float] = None  # Time to full redundancy of the last recovery
+
+    # -------- Lifecycle --------
+
+    def start(self):
+        """
+        Starts the worker tasks, must be called from the running event loop.
+        """
+        if self.workers:
+            return
+        self.loop = asyncio.get_running_loop()
+        self.wakeup = asyncio.Event()
+        # Semaphores are bound to the loop they are first used on
+        self.source_slots.clear()
+        self.target_slots.clear()
+        self.client = httpx.AsyncClient(
+            timeout=httpx.Timeout(120.0, connect=5.0),
+            limits=httpx.Limits(max_connections=self.max_concurrent * 2),
+        )
+        self.workers = [asyncio.create_task(self.worker()) for _ in range(self.max_concurrent)]
+        if self.queue:
+            self.wakeup.set()
+
+    async def stop(self):
+        tasks = self.workers + list(self.retries)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self.workers = []
+        self.loop = None
+        if self.client is not None:
+            await self.client.aclose()
+            self.client = None
+
+    # -------- Queue --------
+
+    def enqueue(self, path: str, part_index: int):
+        """
+        Queues a part from a worker thread, or before the event loop runs: its priority
+        is computed under the path lock in the caller's thread, the queue itself is only
+        touched on the event loop. Code on the event loop awaits requeue() instead.
+        """
+        if (path, part_index) in self.queued:
+            return
+        margin = self.margin(path, part_index)
+        if self.loop is not None and not on_loop(self.loop):
+            self.loop.call_soon_threadsafe(self.push, margin, path, part_index)
+        else:
+            self.push(margin, path, part_index)
+
+    async def requeue(self, path: str, part_index: int):
+        """
+        Queues a part from the event loop.
+        """
+        if (path, part_index) in self.queued:
+            return
+        margin = await asyncio.to_thread(self.margin, path, part_index)
+        self.push(margin, path, part_index)
+
+    def margin(self, path: str, part_index: int) -> int:
+        """
+        How many more copies the part can lose, its priority in the queue.
+        """
+        with self.master.path_locks.read(path):
+            if path not in self.master.files or part_index >= len(self.master.files[path]):
+                return 0
+            live, needed, _ = self.master.part_health(path, part_index)
+            return live - needed
+
+    def push(self, margin: int, path: str, part_index: int):
+        key = (path, part_index)
+        if key in self.queued:
+            return
+        if self.episode_started_at is None:
+            self.episode_started_at = time.time()
+            self.episode_completed = 0
+        self.queued.add(key)
+        heapq.heappush(self.queue, (margin, next(self.counter), path, part_index))
+        if self.wakeup is not None:
+            self.wakeup.set()
+
+    def retry_later(self, path: str, part_index: int):
+        key = (path, part_index)
+        self.attempts[key] += 1
+        if self.attempts[key] == self.max_attempts:
+            print(f"Re-replicating {path}[{part_index}] failed {self.attempts[key]} times, retrying every {self.max_backoff}s")
+            self.stuck.add(key)
+        attempts = min(self.attempts[key], self.max_attempts)
+        delay = min(self.max_backoff, self.base_backoff * 2 ** (attempts - 1))
+        self.delayed += 1
+        task = asyncio.create_task(self.requeue_after(delay, path, part_index))
+        self.retries.add(task)
+        task.add_done_callback(self.retries.discard)
+
+    async def requeue_after(self, delay: float, path: str, part_index: int):
+        try:
+            await asyncio.sleep(delay)
+            await self.requeue(path, part_index)
+        finally:
+            self.delayed -= 1
+            self.check_episode_done()
+
+    def check_episode_done(self):
+        if self.episode_started_at is not None and not self.queue and not self.in_flight and not self.delayed:
+            self.last_recovery_seconds = time.time() - self.episode_started_at
+            self.episode_started_at = None
+
+    # -------- Workers --------
+
+    async def worker(self):
+        while True:
+            if not self.queue:
+                self.wakeup.clear()
+                await self.wakeup.wait()
+                continue
+
+            _, _, path, part_index = heapq.heappop(self.queue)
+            self.queued.discard((path, part_index))
+            self.active.add((path, part_index))
+            self.in_flight += 1
+            try:
+                await self.replicate_part(path, part_index)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Re-replication of {path}[{part_index}] failed: {e}")
+                self.failed_attempts += 1
+                self.retry_later(path, part_index)
+            finally:
+                self.active.discard((path, part_index))
+                self.in_flight -= 1
+                self.check_episode_done()
+
+    async def replicate_part(self, path: str, part_index: int):
+        """
+        Adds one replica to the part, or rebuilds one lost shard of a stripe. Re-enqueues
+        it if it is still short afterwards.
+        """
+        now = time.time()
+        avoid = {server for server, failed_at in self.failed_targets.items() if now - failed_at < self.failure_cooldown}
+        # Metadata calls take blocking locks, so they run in worker threads
+        plan = await asyncio.to_thread(self.master.begin_replication, path, part_index, self.source_load, avoid)
+        if plan is None:
+            self.forget(path, part_index)
+            return
+        source, target_chunkserver_id, target_chunk_id, shard = plan
+        source_id = source['chunkserver_id']
+
+        self.source_load[source_id] += 1
+        try:
+            async with self.slot(self.source_slots, source_id, self.per_source), \
+                       self.slot(self.target_slots, target_chunkserver_id, self.per_target):
+                await self.master.copy_chunk(self.client, source, target_chunkserver_id, target_chunk_id,
+                                             path, part_index, rebuild=shard)
+        except BaseException:
+            await asyncio.to_thread(self.master.abort_replication, target_chunkserver_id, target_chunk_id)
+            self.failed_targets[target_chunkserver_id] = time.time()
+            raise
+        finally:
+            self.source_load[source_id] -= 1
+
+        new_chunk = await asyncio.to_thread(self.master.finish_replication, path, part_index, target_chunkserver_id,
+                                            target_chunk_id, shard)
+        if new_chunk is not None:
+            self.completed += 1
+            self.episode_completed += 1
+            self.forget(path, part_index)
+        # Also when the copy was dropped, e.g. because the target went away meanwhile
+        if await asyncio.to_thread(self.master.needs_replication, path, part_index):
+            await self.requeue(path, part_index)
+
+    def forget(self, path: str, part_index: int):
+        """
+        Drops the retry state of a part that was copied or needs no more copies.
+        """
+        self.attempts.pop((path, part_index), None)
+        self.stuck.discard((path, part_index))
+
+    def slot(self, slots: Dict[str, asyncio.Semaphore], chunkserver_id: str, limit: int) -> asyncio.Semaphore:
+        if chunkserver_id not in slots:
+            slots[chunkserver_id] = asyncio.Semaphore(limit)
+        return slots[chunkserver_id]
+
+    # -------- Metrics --------
+
+    def status(self) -> dict:
+        elapsed = time.time() - self.episode_started_at if self.episode_started_at is not None else None
+        return {
+            "queued": len(self.queue),
+            "in_flight": self.in_flight,
+            "retrying": self.delayed,
+            "completed": self.completed,
+            "failed_attempts": self.failed_attempts,
+            "stuck": len(self.stuck),
+            "recovering": self.episode_started_at is not None,
+            "recovery_elapsed_seconds": elapsed,
+            "chunks_per_second": self.episode_completed / elapsed if elapsed else None,
+            "last_recovery_seconds": self.last_recovery_seconds,
+        }
+
+
+def on_loop(loop: asyncio.AbstractEventLoop) -> bool:
+    """
+    Whether the caller runs on `loop`, rather than in a worker thread.
+    """
+    try:
+        return asyncio.get_running_loop() is loop
+    except RuntimeError:
+        return False
@@ -1,5 +1,6 @@
 #!/usr/bin/env python3
 import asyncio
+import os
 import subprocess
 import time
 
@@ -7,7 +8,8 @@ async def start_services():
     print("🚀 Starting master server...")
     master = subprocess.Popen(
         ["uvicorn", "master:app", "--host", "0.0.0.0", "--port", "8000"],
-        cwd="./master"
+        cwd="./master",
+        env={**os.environ, "MASTER_DATA_DIR": os.environ.get("MASTER_DATA_DIR", "metadata")}
     )
     
     print("\n🛠️ Starting chunkservers...")
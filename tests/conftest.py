@@ -0,0 +1,36 @@
+import asyncio
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "master"))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "common"))
+
+from master import Master
+
+
+def make_master(data_dir: str | None = None, servers: int = 5) -> Master:
+    """
+    A master with in-memory chunkservers: garbage collection is immediate and chunk
+    deletes are acked without a chunkserver.
+    """
+    master = Master(data_dir=data_dir)
+    for i in range(servers):
+        if f"http://chunkserver{i}:8000" not in master.chunkserver_ids:
+            master.register_chunkserver(f"http://chunkserver{i}:8000")
+    master.garbage_collection_time = 0
+
+    async def ack_deletes(client, chunkserver_id, chunk_ids):
+        return 0
+    master.delete_chunks = ack_deletes
+    return master
+
+
+def collect_garbage(master: Master):
+    asyncio.run(master.garbage_collection())
+
+
+@pytest.fixture
+def master() -> Master:
+    return make_master()
@@ -0,0 +1,30 @@
+import itertools
+import random
+
+import pytest
+
+from erasure import ReedSolomon
+
+
+@pytest.mark.parametrize("data_shards, parity_shards", [(4, 2), (6, 3)])
+def test_reconstruct_from_any_surviving_shards(data_shards, parity_shards):
+    rand = random.Random(data_shards)
+    size = 1000
+    # The last data shard is short, it counts as zero-padded
+    data = [rand.randbytes(size) for _ in range(data_shards - 1)] + [rand.randbytes(size // 3)]
+    code = ReedSolomon(data_shards, parity_shards)
+    shards = data + code.encode(data)
+    padded = [shard.ljust(size, b"\0") for shard in shards]
+
+    for surviving in itertools.combinations(range(code.total_shards), data_shards):
+        lost = [index for index in range(code.total_shards) if index not in surviving]
+        rebuilt = code.reconstruct({index: shards[index] for index in surviving}, size, lost)
+        assert rebuilt == {index: padded[index] for index in lost}
+
+
+def test_reconstruct_needs_enough_shards():
+    code = ReedSolomon(4, 2)
+    data = [bytes([i]) * 16 for i in range(4)]
+    shards = data + code.encode(data)
+    with pytest.raises(ValueError):
+        code.reconstruct({index: shards[index] for index in range(3)}, 16, [3])
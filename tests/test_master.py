@@ -0,0 +1,126 @@
+import threading
+from collections import Counter
+
+import pytest
+
+from conftest import collect_garbage, make_master
+from master import ChunkSlotAllocator
+
+
+def chunk_owners(master) -> Counter:
+    owners = Counter()
+    for parts in master.files.values():
+        for replicas in parts:
+            for chunk in replicas:
+                owners[(chunk['chunkserver_id'], chunk['chunk_id'])] += 1
+    return owners
+
+
+def test_chunk_index_after_create_delete_and_gc(master):
+    size = 3 * master.max_chunk_size
+    for i in range(10):
+        master.create_file(f"/data/f{i}", size)
+    assert master.check_chunk_index() == []
+    assert len(master.chunk_locations) == 10 * 3 * master.replication_factor
+
+    for i in range(0, 10, 2):
+        master.delete_file(f"/data/f{i}")
+    assert master.check_chunk_index() == []
+
+    collect_garbage(master)
+    assert master.check_chunk_index() == []
+    assert sorted(master.files) == [f"/data/f{i}" for i in range(1, 10, 2)]
+    assert len(master.chunk_locations) == 5 * 3 * master.replication_factor
+    # Every slot of a reclaimed file went back to its chunkserver
+    assert sum(len(chunk_ids) for chunk_ids in master.chunkservers.values()) == len(master.chunk_locations)
+
+
+def test_chunk_index_after_recreating_a_deleted_path(master):
+    master.create_file("/data/f", master.max_chunk_size)
+    master.delete_file("/data/f")
+    master.create_file("/data/f", 2 * master.max_chunk_size)
+    collect_garbage(master)
+    assert master.check_chunk_index() == []
+    assert len(master.files["/data/f"]) == 2
+
+
+def test_allocator_hands_out_each_slot_once():
+    allocator = ChunkSlotAllocator(100)
+    used = set()
+    for _ in range(30):
+        used.add(allocator.allocate())
+    used.update(allocator.allocate_many(20))
+    assert len(used) == 50
+    for chunk_id in sorted(used)[::3]:
+        allocator.release(chunk_id)
+        used.remove(chunk_id)
+    reused = [allocator.allocate() for _ in range(10)] + allocator.allocate_many(allocator.free)
+    assert not used & set(reused)
+    assert len(set(reused)) == len(reused)
+    assert len(used) + len(reused) == 100
+    with pytest.raises(Exception):
+        allocator.allocate()
+
+
+def test_allocator_from_used_and_reserve():
+    allocator = ChunkSlotAllocator.from_used(10, {1, 4, 5})
+    allocator.reserve({7, 12})
+    chunk_ids = allocator.allocate_many(allocator.free)
+    assert not {1, 4, 5, 7, 12} & set(chunk_ids)
+    assert len(set(chunk_ids)) == len(chunk_ids)
+
+
+def test_concurrent_creates_and_deletes_use_each_slot_once(master):
+    errors = []
+
+    def client(index: int):
+        try:
+            for n in range(40):
+                master.create_file(f"/c{index}/f{n}", 2 * master.max_chunk_size)
+                if n % 3 == 0:
+                    master.delete_file(f"/c{index}/f{n}")
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+    collect_garbage(master)
+    assert master.check_chunk_index() == []
+    assert max(chunk_owners(master).values()) == 1
+    for chunkserver_id, chunk_ids in master.chunkservers.items():
+        allocator = master.allocators[chunkserver_id]
+        assert allocator.capacity - allocator.free == len(chunk_ids)
+
+
+def test_oplog_replay_after_checkpoint(tmp_path):
+    master = make_master(str(tmp_path))
+    for i in range(4):
+        master.create_file(f"/logged/f{i}", 2 * master.max_chunk_size)
+    master.checkpoint()
+    # Only in the log tail
+    master.create_file("/logged/after", master.max_chunk_size)
+    master.delete_file("/logged/f1")
+    master.sync_log()
+    expected = {path: [[(chunk['chunkserver_id'], chunk['chunk_id'], chunk['is_deleted']) for chunk in replicas]
+                       for replicas in parts] for path, parts in master.files.items()}
+    master.oplog.close()
+
+    recovered = make_master(str(tmp_path))
+    try:
+        assert {path: [[(chunk['chunkserver_id'], chunk['chunk_id'], chunk['is_deleted']) for chunk in replicas]
+                       for replicas in parts] for path, parts in recovered.files.items()} == expected
+        assert recovered.check_chunk_index() == []
+        assert not recovered.file_exists("/logged/f1")
+        assert recovered.file_exists("/logged/after")
+        assert recovered.chunkservers == master.chunkservers
+
+        # The deleted file is still queued for the garbage collector after the restart
+        collect_garbage(recovered)
+        assert "/logged/f1" not in recovered.files
+        assert recovered.check_chunk_index() == []
+    finally:
+        recovered.oplog.close()
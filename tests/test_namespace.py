@@ -0,0 +1,42 @@
+from conftest import collect_garbage
+
+
+def names(listing: dict) -> list:
+    return [entry["name"] for entry in listing["entries"]]
+
+
+def test_list_directory_skips_tombstones(master):
+    for name in ("a", "b", "c", "d", "e"):
+        master.create_file(f"/dir/{name}", master.max_chunk_size)
+    master.delete_file("/dir/b")
+    master.delete_file("/dir/e")
+
+    listing = master.list_directory("/dir")
+    assert names(listing) == ["a", "c", "d"]
+    assert listing["next"] is None
+
+
+def test_list_directory_pages_end_before_trailing_tombstones(master):
+    for name in ("a", "b", "c", "d"):
+        master.create_file(f"/dir/{name}", master.max_chunk_size)
+    master.delete_file("/dir/b")
+    master.delete_file("/dir/d")
+
+    first = master.list_directory("/dir", limit=1)
+    assert names(first) == ["a"]
+    assert first["next"] == "a"
+    second = master.list_directory("/dir", start_after=first["next"], limit=1)
+    assert names(second) == ["c"]
+    # Only deleted files follow, so this is the last page
+    assert second["next"] is None
+
+
+def test_directory_of_deleted_files_is_listed_until_reclaimed(master):
+    master.create_file("/dir/sub/f", master.max_chunk_size)
+    master.delete_file("/dir/sub/f")
+
+    assert names(master.list_directory("/dir")) == ["sub"]
+    assert names(master.list_directory("/dir/sub")) == []
+
+    collect_garbage(master)
+    assert names(master.list_directory("/")) == []